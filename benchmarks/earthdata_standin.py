@@ -0,0 +1,111 @@
+import hashlib
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+import numpy as np
+
+# ------------------------------
+# SYNTHETIC GRANULES
+# ------------------------------
+SEED = 20240101
+
+
+def synthetic_granule(size, seed=SEED):
+    # Random bytes, so a resume that lands on the wrong offset changes the checksum
+    return np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8).tobytes()
+
+
+def checksum_line(name, body, algorithm="sha256"):
+    # One line of an md5sum/sha256sum style checksum file
+    return f"{hashlib.new(algorithm, body).hexdigest()}  {name}\n"
+
+
+# ------------------------------
+# HTTP STAND-IN
+# ------------------------------
+class GranuleHandler(BaseHTTPRequestHandler):
+    # GET /granules/<name>                      -> whole file (200)
+    # GET /granules/<name> with Range: bytes=N- -> rest of the file (206), or
+    #                                              416 when N is past the end
+    # Faults, per server: drop_after cuts the first response of each file
+    # after that many bytes; ignore_range answers every Range with a 200
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_empty(self, status, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        name = urlparse(self.path).path.rsplit("/", 1)[-1]
+        range_header = self.headers.get("Range")
+        with server.lock:
+            server.requests.append((name, range_header))
+            first = name not in server.served
+            server.served.add(name)
+        if server.latency:
+            time.sleep(server.latency)
+
+        body = server.files.get(name)
+        if body is None:
+            self.send_empty(404)
+            return
+
+        offset = 0
+        match = re.match(r"^bytes=(\d+)-$", range_header or "")
+        if match and not server.ignore_range:
+            offset = int(match.group(1))
+            if offset >= len(body):
+                self.send_empty(416, {"Content-Range": f"bytes */{len(body)}"})
+                return
+
+        self.send_response(206 if offset else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body) - offset))
+        if offset:
+            self.send_header("Content-Range", f"bytes {offset}-{len(body) - 1}/{len(body)}")
+        self.end_headers()
+
+        if first and server.drop_after is not None:
+            # Promise the whole file, send part of it, then hang up
+            self.wfile.write(body[offset:offset + server.drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body[offset:])
+
+
+class GranuleServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, files, drop_after=None, ignore_range=False, latency=0.0):
+        super().__init__(("127.0.0.1", 0), GranuleHandler)
+        self.files = dict(files)
+        self.drop_after = drop_after
+        self.ignore_range = ignore_range
+        self.latency = latency
+        self.lock = threading.Lock()
+        # (file name, Range header) of every request, in arrival order
+        self.requests = []
+        self.served = set()
+        self.base_url = f"http://127.0.0.1:{self.server_port}"
+
+    def url(self, name):
+        return f"{self.base_url}/granules/{name}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
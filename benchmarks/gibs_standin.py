@@ -0,0 +1,188 @@
+import hashlib
+import io
+import threading
+import time
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from PIL import Image
+
+# ------------------------------
+# SYNTHETIC COLORMAP
+# ------------------------------
+# 250 value classes plus a transparent nodata entry, about the size of a real
+# GIBS colormap. Colours are spread over the RGB cube so none collide.
+COLORMAP_CLASSES = 250
+NODATA_RGB = (0, 0, 0)
+TILE_SIZE = 512
+# Distinct images per size; TIME picks one, so different days really differ
+IMAGE_VARIANTS = 8
+SEED = 20240101
+
+
+def class_colors():
+    rng = np.random.default_rng(SEED)
+    packed = rng.choice(np.arange(1, 256 ** 3), size=COLORMAP_CLASSES, replace=False)
+    return np.stack([(packed >> 16) & 255, (packed >> 8) & 255, packed & 255], axis=1).astype(np.uint8)
+
+
+CLASS_COLORS = class_colors()
+
+
+def colormap_xml():
+    entries = "\n".join(
+        f'<ColorMapEntry rgb="{r},{g},{b}" transparent="false" value="[{i},{i + 1})"/>'
+        for i, (r, g, b) in enumerate(CLASS_COLORS)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<ColorMaps>\n'
+        '<ColorMap title="No Data"><Entries>\n'
+        f'<ColorMapEntry rgb="{",".join(map(str, NODATA_RGB))}" transparent="true" nodata="true"/>\n'
+        '</Entries></ColorMap>\n'
+        '<ColorMap title="Synthetic Field" units="K"><Entries>\n'
+        f"{entries}\n</Entries></ColorMap>\n</ColorMaps>\n"
+    ).encode()
+
+
+# ------------------------------
+# SYNTHETIC IMAGES
+# ------------------------------
+@lru_cache(maxsize=64)
+def synthetic_png(width, height, variant):
+    # Smooth field plus noise, quantised to the colormap classes, with a
+    # nodata band: compresses about like real GIBS imagery
+    rng = np.random.default_rng(SEED + variant)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    field = (
+        np.sin(x / max(width, 1) * 6 + variant) + np.cos(y / max(height, 1) * 4 - variant)
+        + rng.normal(0, 0.05, (height, width))
+    )
+    classes = ((field - field.min()) / (np.ptp(field) or 1) * (COLORMAP_CLASSES - 1)).astype(np.int64)
+    rgb = CLASS_COLORS[classes]
+    rgb[: max(1, height // 20)] = NODATA_RGB
+
+    buffer = io.BytesIO()
+    Image.fromarray(rgb, "RGB").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def variant_for(*parts):
+    return int(hashlib.sha256("|".join(parts).encode()).hexdigest(), 16) % IMAGE_VARIANTS
+
+
+# ------------------------------
+# CAPABILITIES
+# ------------------------------
+def capabilities_xml(base_url, layer_count, vector_every=50):
+    layers = []
+    for i in range(layer_count):
+        name = f"Synthetic_Layer_{i:05d}"
+        vector = vector_every and i % vector_every == vector_every - 1
+        fmt = "application/vnd.mapbox-vector-tile" if vector else "image/png"
+        metadata = (
+            f'<ows:Metadata xlink:type="simple" xlink:role="http://earthdata.nasa.gov/gibs/metadata-type/mapbox-gl-style" '
+            f'xlink:href="{base_url}/vector-metadata/{name}.json"/>'
+            if vector else
+            f'<ows:Metadata xlink:type="simple" xlink:role="http://earthdata.nasa.gov/gibs/metadata-type/colormap" '
+            f'xlink:href="{base_url}/colormaps/{name}.xml"/>'
+        )
+        layers.append(
+            f"""<Layer><ows:Title>{name}</ows:Title>
+<ows:WGS84BoundingBox crs="urn:ogc:def:crs:OGC:2:84"><ows:LowerCorner>-180 -90</ows:LowerCorner><ows:UpperCorner>180 90</ows:UpperCorner></ows:WGS84BoundingBox>
+<ows:Identifier>{name}</ows:Identifier>{metadata}
+<Style isDefault="true"><ows:Title>default</ows:Title><ows:Identifier>default</ows:Identifier>
+<LegendURL format="image/svg+xml" xlink:type="simple" xlink:role="http://earthdata.nasa.gov/gibs/legend-type/horizontal" xlink:href="{base_url}/legends/{name}_H.svg"/></Style>
+<Format>{fmt}</Format>
+<Dimension><ows:Identifier>Time</ows:Identifier><ows:UOM>ISO8601</ows:UOM><Default>2024-01-31</Default><Current>false</Current>
+<Value>2000-02-24/2010-12-31/P1D</Value><Value>2011-01-02/2024-01-31/P1D</Value></Dimension>
+<TileMatrixSetLink><TileMatrixSet>2km</TileMatrixSet></TileMatrixSetLink>
+<ResourceURL format="{fmt}" resourceType="tile" template="{base_url}/wmts/{name}/default/{{Time}}/{{TileMatrixSet}}/{{TileMatrix}}/{{TileRow}}/{{TileCol}}.png"/>
+</Layer>"""
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Capabilities xmlns="http://www.opengis.net/wmts/1.0" xmlns:ows="http://www.opengis.net/ows/1.1" '
+        'xmlns:xlink="http://www.w3.org/1999/xlink" version="1.0.0">\n<Contents>\n'
+        + "\n".join(layers)
+        + '\n<TileMatrixSet><ows:Identifier>2km</ows:Identifier></TileMatrixSet>\n</Contents>\n</Capabilities>\n'
+    ).encode()
+
+
+# ------------------------------
+# HTTP STAND-IN
+# ------------------------------
+class StandInHandler(BaseHTTPRequestHandler):
+    # GET /wms?REQUEST=GetMap&WIDTH=..&HEIGHT=..&TIME=..   -> PNG
+    # GET /wmts/<layer>/default/<time>/<tms>/<z>/<row>/<col>.png -> 512px PNG
+    # GET /wmts/capabilities                               -> WMTS capabilities (ETag)
+    # GET /colormaps/<layer>.xml                           -> colormap XML
+    # GET /vector-metadata/<layer>.json                    -> MVT properties
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, content_type, headers=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        url = urlparse(self.path)
+        query = {key.upper(): values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+
+        if parts[0] == "wms" and query.get("REQUEST") == "GetMap":
+            width, height = int(query["WIDTH"]), int(query["HEIGHT"])
+            body = synthetic_png(width, height, variant_for(query.get("LAYERS", ""), query.get("TIME", "")))
+            self.send_body(body, "image/png")
+        elif parts[0] == "wmts" and parts[-1] == "capabilities":
+            etag = server.capabilities_etag
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_body(server.capabilities, "text/xml", {"ETag": etag})
+        elif parts[0] == "wmts" and len(parts) == 8:
+            layer, time_str, row, col = parts[1], parts[3], parts[6], parts[7].split(".")[0]
+            self.send_body(synthetic_png(TILE_SIZE, TILE_SIZE, variant_for(layer, time_str, row, col)), "image/png")
+        elif parts[0] == "colormaps":
+            self.send_body(server.colormap, "text/xml")
+        elif parts[0] == "vector-metadata":
+            self.send_body(b'{"mvt_properties": [{"Identifier": "value", "DataType": "float"}]}', "application/json")
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, capabilities_layers=1000, latency=0.0):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.latency = latency
+        self.base_url = f"http://127.0.0.1:{self.server_port}"
+        self.colormap = colormap_xml()
+        self.capabilities = capabilities_xml(self.base_url, capabilities_layers)
+        self.capabilities_etag = '"' + hashlib.sha256(self.capabilities).hexdigest()[:16] + '"'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
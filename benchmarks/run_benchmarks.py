@@ -0,0 +1,346 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+GIBS_PROJECT_DIR = os.path.join(REPO_DIR, "src", "gibs_map_project")
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+sys.path.insert(0, GIBS_PROJECT_DIR)
+
+from gibs_standin import StandInServer, synthetic_png
+
+# ------------------------------
+# SCENARIOS
+# ------------------------------
+FULL = {
+    "decode_frames": 20,
+    "decode_size": (2000, 2000),
+    "end_to_end_days": [1, 7, 30],
+    "end_to_end_bbox_degrees": [5, 20, 60],
+    "end_to_end_modes": ["wms", "wmts"],
+    "netcdf_frames": 60,
+    "netcdf_size": (2000, 2000),
+    "capabilities_layers": 1500,
+}
+QUICK = {
+    "decode_frames": 5,
+    "decode_size": (1000, 1000),
+    "end_to_end_days": [1, 3],
+    "end_to_end_bbox_degrees": [5, 20],
+    "end_to_end_modes": ["wms", "wmts"],
+    "netcdf_frames": 10,
+    "netcdf_size": (1000, 1000),
+    "capabilities_layers": 300,
+}
+
+LAYER = "Synthetic_Layer_00000"
+START_DATE = "2024-01-01"
+
+
+def proc_status_mib(field):
+    # VmHWM/VmRSS from /proc, in MiB; None where /proc is not available
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mib():
+    # Prefer VmHWM: on Linux ru_maxrss survives exec, so a child would report
+    # the driver's (stand-in server's) peak instead of its own
+    peak = proc_status_mib("VmHWM")
+    if peak is not None:
+        return peak
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mib():
+    rss = proc_status_mib("VmRSS")
+    return rss if rss is not None else peak_rss_mib()
+
+
+# ------------------------------
+# BENCHMARKS (EACH RUNS IN ITS OWN PROCESS)
+# ------------------------------
+def bench_decode(base_url, frames, size):
+    # The /save_data colormap path on in-memory PNGs: PNG decode + LUT lookup
+    from PIL import Image
+    from colormap_decoder import decode_frame
+    from colormap_registry import compile_colormap
+    import lxml.etree as xmltree
+    import requests
+
+    colormap = compile_colormap(xmltree.fromstring(requests.get(f"{base_url}/colormaps/{LAYER}.xml").content))
+    pngs = [synthetic_png(size[0], size[1], i) for i in range(frames)]
+
+    open_seconds = lookup_seconds = 0.0
+    for content in pngs:
+        started = time.perf_counter()
+        image = Image.open(BytesIO(content))
+        image.load()
+        opened = time.perf_counter()
+        grid = decode_frame(image, colormap.lut)
+        lookup_seconds += time.perf_counter() - opened
+        open_seconds += opened - started
+        assert np.isfinite(grid).any()
+
+    total = open_seconds + lookup_seconds
+    megapixels = frames * size[0] * size[1] / 1e6
+    return {
+        "frames": frames,
+        "size": list(size),
+        "seconds": total,
+        "framesPerSecond": frames / total,
+        "megapixelsPerSecond": megapixels / total,
+        "pngDecodeSeconds": open_seconds,
+        "lutLookupSeconds": lookup_seconds,
+    }
+
+
+def bench_end_to_end(base_url, days, bbox_degrees, mode):
+    # One /save_data job through run_extraction, cold caches, against the
+    # stand-in. Paths are pointed at a scratch directory so nothing under
+    # data/ is read or written.
+    import functools
+    import extraction
+    import metrics
+    from colormap_registry import ColorMapRegistry
+    from frame_cache import FrameCache
+    from jobs import Job
+
+    scratch = tempfile.mkdtemp(prefix="gibs-bench-")
+    try:
+        layers_info_path = os.path.join(scratch, "layers_info.json")
+        with open(layers_info_path, "w") as f:
+            json.dump({LAYER: {
+                "Layer": LAYER,
+                "TileMatrixSet": "2km",
+                "TimeExtent": ["2000-01-01/2030-12-31/P1D"],
+                "Format": "image/png",
+                "Template": f"{base_url}/wmts/{LAYER}/default/{{Time}}/{{TileMatrixSet}}/{{TileMatrix}}/{{TileRow}}/{{TileCol}}.png",
+                "MetadataHref": f"{base_url}/colormaps/{LAYER}.xml",
+            }}, f)
+
+        extraction.LAYERS_INFO_PATH = layers_info_path
+        extraction.JOBS_DIRECTORY = os.path.join(scratch, "jobs")
+        extraction.frame_cache = FrameCache(os.path.join(scratch, "frames"))
+        extraction.colormap_registry = ColorMapRegistry(os.path.join(scratch, "colormaps"))
+        extraction.download_frames = functools.partial(extraction.download_frames, url=f"{base_url}/wms")
+        metrics.LOG_DIRECTORY = os.path.join(scratch, "logs")
+        metrics.JOB_LOG_PATH = os.path.join(metrics.LOG_DIRECTORY, "jobs.jsonl")
+
+        end_date = str(np.datetime64(START_DATE) + np.timedelta64(days - 1, "D"))
+        half = bbox_degrees / 2
+        params = extraction.parse_request({
+            "layer": LAYER, "startDate": START_DATE, "endDate": end_date,
+            "lonmin": -half, "latmin": -half, "lonmax": half, "latmax": half,
+            "metadataHref": f"{base_url}/colormaps/{LAYER}.xml", "mode": mode,
+        })
+        job = Job(params)
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stderr):
+            result = extraction.run_extraction(job)
+        seconds = time.perf_counter() - started
+
+        path = os.path.join(extraction.job_directory(job.id), result["file"])
+        return {
+            "mode": mode,
+            "days": days,
+            "bboxDegrees": bbox_degrees,
+            "seconds": seconds,
+            "secondsPerDay": seconds / days,
+            "missingDates": len(result["missingDates"]),
+            "fileBytes": os.path.getsize(path),
+            # Per-stage breakdown from the job's own instrumentation
+            "stages": job.stats.to_dict(),
+        }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def bench_netcdf(frames, size):
+    # NetCDF assembly alone: append synthetic frames through NetCDFWriter and
+    # report the process's peak RSS, which should not grow with frames
+    from netcdf_writer import NetCDFWriter
+    from colormap_decoder import frame_coordinates
+
+    scratch = tempfile.mkdtemp(prefix="gibs-bench-")
+    try:
+        path = os.path.join(scratch, "bench.nc")
+        width, height = size
+        lats, lons = frame_coordinates((-10, -10, 10, 10), width, height)
+        rng = np.random.default_rng(0)
+        base = rng.random((height, width), dtype=np.float32) * 250
+
+        baseline = current_rss_mib()
+        started = time.perf_counter()
+        with NetCDFWriter(path, lats, lons, {"value": {"units": "K"}}) as writer:
+            for i in range(frames):
+                grid = base + i
+                grid[: height // 20] = np.nan
+                writer.append(np.datetime64(START_DATE) + np.timedelta64(i, "D"), {"value": grid})
+        seconds = time.perf_counter() - started
+
+        return {
+            "frames": frames,
+            "size": list(size),
+            "seconds": seconds,
+            "framesPerSecond": frames / seconds,
+            "fileBytes": os.path.getsize(path),
+            "rawBytes": frames * width * height * 4,
+            "baselineRssMiB": baseline,
+            "assemblyRssGrowthMiB": peak_rss_mib() - baseline,
+        }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def bench_capabilities(base_url, layers):
+    # gibs_wmts.refresh_capabilities: a cold parse, then a conditional GET
+    # that should come back 304
+    import gibs_wmts
+
+    scratch = tempfile.mkdtemp(prefix="gibs-bench-")
+    try:
+        gibs_wmts.LAYERS_DIR = scratch
+        gibs_wmts.LAYERS_INFO_PATH = os.path.join(scratch, "layers_info.json")
+        gibs_wmts.ALL_LAYERS_PATH = os.path.join(scratch, "all_layers.json")
+        gibs_wmts.CACHE_DIR = os.path.join(scratch, "cache")
+        gibs_wmts.CAPABILITIES_STATE_PATH = os.path.join(scratch, "cache", "capabilities_state.json")
+        gibs_wmts.VECTOR_METADATA_DIR = os.path.join(scratch, "cache", "vector_metadata")
+        url = f"{base_url}/wmts/capabilities"
+
+        with contextlib.redirect_stdout(sys.stderr):
+            started = time.perf_counter()
+            cold = gibs_wmts.refresh_capabilities(url)
+            cold_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            warm = gibs_wmts.refresh_capabilities(url)
+            warm_seconds = time.perf_counter() - started
+
+        return {
+            "layers": layers,
+            "coldSeconds": cold_seconds,
+            "layersPerSecond": len(cold["added"]) / cold_seconds,
+            "unchangedSeconds": warm_seconds,
+            "unchangedWas304": warm["unchanged"],
+        }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "end_to_end": bench_end_to_end,
+    "netcdf": bench_netcdf,
+    "capabilities": bench_capabilities,
+}
+
+
+# ------------------------------
+# DRIVER
+# ------------------------------
+def run_child(name, kwargs):
+    # A fresh interpreter per measurement, so peak RSS belongs to it alone
+    command = [sys.executable, os.path.abspath(__file__), "--child", name, "--kwargs", json.dumps(kwargs)]
+    completed = subprocess.run(command, cwd=GIBS_PROJECT_DIR, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{name} {kwargs} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(scenarios, latency, label):
+    server = StandInServer(capabilities_layers=scenarios["capabilities_layers"], latency=latency).start()
+    base_url = server.base_url
+    results = {"decode": [], "endToEnd": [], "netcdf": [], "capabilities": []}
+
+    try:
+        print("decode ...")
+        results["decode"].append(run_child("decode", {
+            "base_url": base_url, "frames": scenarios["decode_frames"], "size": scenarios["decode_size"],
+        }))
+
+        for mode in scenarios["end_to_end_modes"]:
+            for days in scenarios["end_to_end_days"]:
+                for degrees in scenarios["end_to_end_bbox_degrees"]:
+                    print(f"end to end: {mode}, {days} days, {degrees} degrees ...")
+                    results["endToEnd"].append(run_child("end_to_end", {
+                        "base_url": base_url, "days": days, "bbox_degrees": degrees, "mode": mode,
+                    }))
+
+        print("netcdf ...")
+        results["netcdf"].append(run_child("netcdf", {
+            "frames": scenarios["netcdf_frames"], "size": scenarios["netcdf_size"],
+        }))
+
+        print("capabilities ...")
+        results["capabilities"].append(run_child("capabilities", {
+            "base_url": base_url, "layers": scenarios["capabilities_layers"],
+        }))
+    finally:
+        server.shutdown()
+
+    return {
+        "label": label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "gitCommit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "standInLatencySeconds": latency,
+        "scenarios": scenarios,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the GIBS extraction stages against a local stand-in")
+    parser.add_argument("--quick", action="store_true", help="small scenarios, for a smoke run")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the stand-in waits per request")
+    parser.add_argument("--label", default="", help="free text stored with the results")
+    parser.add_argument("--output", help="results JSON (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--child", choices=sorted(BENCHMARKS), help=argparse.SUPPRESS)
+    parser.add_argument("--kwargs", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = BENCHMARKS[args.child](**json.loads(args.kwargs))
+        result["peakRssMiB"] = peak_rss_mib()
+        print(json.dumps(result))
+        sys.exit(0)
+
+    report = run_suite(QUICK if args.quick else FULL, args.latency, args.label)
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%dT%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
@@ -1,5 +1,13 @@
 import urllib.request as urllib2
 from http.cookiejar import CookieJar
+from urllib.parse import urlparse
+
+import requests
+import requests.auth
+from requests.adapters import HTTPAdapter
+
+AUTH_HOST = "urs.earthdata.nasa.gov"
+
 
 def login(username, password):
     password_manager = urllib2.HTTPPasswordMgrWithDefaultRealm()
@@ -14,4 +22,34 @@ def login(username, password):
         urllib2.HTTPCookieProcessor(cookie_jar))
     urllib2.install_opener(opener)
 
-    return opener
\ No newline at end of file
+    return opener
+
+
+class EarthdataAuth(requests.auth.HTTPBasicAuth):
+    # Basic credentials go to Earthdata Login only, never to the data hosts
+    def __call__(self, request):
+        if urlparse(request.url).hostname == AUTH_HOST:
+            return super().__call__(request)
+        return request
+
+
+class EarthdataSession(requests.Session):
+    # Data hosts redirect to Earthdata Login and back; requests does not
+    # re-apply session auth on redirects, so add it for the login hop. The
+    # data hosts then recognise us by the cookie left in the session's jar.
+    def rebuild_auth(self, prepared_request, response):
+        super().rebuild_auth(prepared_request, response)
+        if self.auth is not None and urlparse(prepared_request.url).hostname == AUTH_HOST:
+            prepared_request.prepare_auth(self.auth)
+
+
+def create_session(username=None, password=None, pool_size=8):
+    # One session (and cookie jar) shared by every request of a crawl or
+    # bulk download, so the login redirect only happens once
+    session = EarthdataSession()
+    if username and password:
+        session.auth = EarthdataAuth(username, password)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -4,10 +4,10 @@ from bs4 import BeautifulSoup
 import os
 import json
 from urls import url_dict
-from earthdata_helper import login
+from earthdata_helper import login, create_session
+from granule_downloader import download_granule
 
 DATA_DIR = '../../data/'
-EARTHDATA_PROJECT_DIR = '../../src/earthdata_project/'
 CONFIG_FILE_PATH = "../../config/user_config.json"
 
 def select_date(date_links):
@@ -88,6 +88,7 @@ with open(CONFIG_FILE_PATH) as config_file:
 url_0 = url_dict[1]
 
 opener = login(username, password)
+session = create_session(username, password)
 
 # file_links and hdf_links isnt used
 dir_links, file_links, hdf_links = read_html_page(url_0)
@@ -122,26 +123,24 @@ if dir_links:
 
     #reading inside the dir after date
     dir_links, file_links, hdf_links = read_html_page(url_2)
-    os.chdir(os.path.join(DATA_DIR, path_str))
+    # download the files themselves, not the directory page under their name
     if file_links:
-        urllib2.urlretrieve(url_2, file_links[0])
-        print(f"Downloaded: {file_links[0]}")
+        result = download_granule(session, url_2 + file_links[0], os.path.join(DATA_DIR, path_str))
+        print(f"{result.status.capitalize()}: {file_links[0]}")
     if hdf_links:
         selected_hdf_file = select_hdf_file(hdf_links)
         print("Selected HDF file:", selected_hdf_file)
-        urllib2.urlretrieve(url_2, selected_hdf_file)
-        print(f"Downloaded: {selected_hdf_file}")
-    os.chdir(os.path.join(EARTHDATA_PROJECT_DIR))
+        result = download_granule(session, url_2 + selected_hdf_file, os.path.join(DATA_DIR, path_str))
+        print(f"{result.status.capitalize()}: {selected_hdf_file}")
 
 # if the files are inside the date folder and not inside other directories
 elif file_links or hdf_links:
-    os.chdir(os.path.join(DATA_DIR, selected_date))
     print(url_1)
     if file_links:
-        urllib2.urlretrieve(url_1, file_links[0])
+        result = download_granule(session, url_1 + file_links[0], os.path.join(DATA_DIR, selected_date))
+        print(f"{result.status.capitalize()}: {file_links[0]}")
     if hdf_links:
         selected_hdf_file = select_hdf_file(hdf_links)
         print("Selected HDF file:", selected_hdf_file)
-        urllib2.urlretrieve(url_1, selected_hdf_file)
-        print(f"Downloaded: {selected_hdf_file}")
-    os.chdir(os.path.join(EARTHDATA_PROJECT_DIR))
+        result = download_granule(session, url_1 + selected_hdf_file, os.path.join(DATA_DIR, selected_date))
+        print(f"{result.status.capitalize()}: {selected_hdf_file}")
@@ -0,0 +1,331 @@
+import argparse
+import fnmatch
+import json
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urljoin, urlparse
+
+import lxml.html
+import pandas as pd
+import requests
+
+from earthdata_helper import create_session
+from urls import url_dict
+
+# ------------------------------
+# PATHS & SETTINGS
+# ------------------------------
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.abspath(os.path.join(PROJECT_DIR, "../../data"))
+INDEX_PATH = os.path.join(DATA_DIR, "earthdata", "granule_index.sqlite")
+CONFIG_FILE_PATH = os.path.abspath(os.path.join(PROJECT_DIR, "../../config/user_config.json"))
+
+# At most this many listing requests in flight against one DAAC
+DEFAULT_CONCURRENCY = 4
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT = 60
+
+# A dated directory is re-listed until its last day is this far in the past;
+# after that its cached listing is trusted
+SETTLE_DAYS = 3
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    url TEXT PRIMARY KEY,
+    parent TEXT,
+    collection TEXT NOT NULL,
+    listed_at REAL
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+CREATE TABLE IF NOT EXISTS granules (
+    url TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    modified TEXT,
+    date TEXT
+);
+CREATE INDEX IF NOT EXISTS granules_collection_date ON granules (collection, date);
+CREATE INDEX IF NOT EXISTS granules_directory ON granules (directory);
+"""
+
+
+# ------------------------------
+# LISTING PARSER
+# ------------------------------
+def parse_size(text):
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)B?\s*", text or "", re.IGNORECASE)
+    if match is None:
+        return None
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def parse_listing(body, base_url):
+    # Apache/DAAC index page -> (directory URLs, [(file URL, size, modified)]).
+    # Links count from "Parent Directory" up to the NASA footer, like
+    # get_earthdata.read_html_page; size and date come from the link's table
+    # row, or from the text after it in <pre> style listings.
+    document = lxml.html.fromstring(body)
+    directories, files = [], []
+    seen = set()
+    found_parent_dir = False
+
+    for link in document.iter("a"):
+        text = link.text_content().strip()
+        if text == "Parent Directory":
+            found_parent_dir = True
+            continue
+        if text.startswith("NASA Web Privacy Policy"):
+            break
+        href = link.get("href")
+        if not found_parent_dir or not href or href.startswith(("?", "#")):
+            continue
+
+        url = urljoin(base_url, href)
+        if url in seen or not url.startswith(base_url):
+            continue
+        seen.add(url)
+
+        if href.endswith("/"):
+            directories.append(url)
+            continue
+
+        row = next(link.iterancestors("tr"), None)
+        if row is not None:
+            cells = [cell.text_content().strip() for cell in row.iter("td")]
+            link_cell = next(i for i, cell in enumerate(cells) if cell == text) if text in cells else 0
+            details = cells[link_cell + 1:]
+        else:
+            details = (link.tail or "").split()
+            details = [" ".join(details[:2]), details[2]] if len(details) >= 3 else []
+
+        modified = details[0] if details else None
+        size = parse_size(details[1]) if len(details) > 1 else None
+        files.append((url, size, modified))
+
+    return directories, files
+
+
+# ------------------------------
+# DATES FROM PATHS
+# ------------------------------
+def directory_span(collection_url, url):
+    # Date range a directory can hold, from its path below the collection:
+    # YYYY.MM.DD/, YYYY/DDD/, YYYY/MM/DD/, YYYY/MM/ or YYYY/. None when the
+    # path carries no date, in which case the directory is never pruned.
+    segments = [s for s in url[len(collection_url):].split("/") if s]
+    span = None
+    year = month = None
+
+    for segment in segments:
+        if re.fullmatch(r"\d{4}\.\d{2}\.\d{2}", segment):
+            day = pd.Timestamp(segment.replace(".", "-"))
+            span = (day, day)
+        elif year is None and re.fullmatch(r"\d{4}", segment):
+            year = int(segment)
+            span = (pd.Timestamp(year=year, month=1, day=1), pd.Timestamp(year=year, month=12, day=31))
+        elif year is not None and month is None and re.fullmatch(r"\d{3}", segment):
+            day = pd.Timestamp(year=year, month=1, day=1) + pd.Timedelta(days=int(segment) - 1)
+            span = (day, day)
+        elif year is not None and month is None and re.fullmatch(r"\d{2}", segment) and 1 <= int(segment) <= 12:
+            month = int(segment)
+            first = pd.Timestamp(year=year, month=month, day=1)
+            span = (first, first + pd.offsets.MonthEnd(0))
+        elif month is not None and re.fullmatch(r"\d{2}", segment):
+            day = pd.Timestamp(year=year, month=month, day=int(segment))
+            span = (day, day)
+    return span
+
+
+def granule_date(name, span):
+    # Prefer the directory's day, then a date in the file name
+    if span is not None and span[0] == span[1]:
+        return span[0]
+    match = re.search(r"(?<!\d)(\d{4})(\d{2})(\d{2})(?!\d)", name)
+    if match:
+        try:
+            return pd.Timestamp(year=int(match.group(1)), month=int(match.group(2)), day=int(match.group(3)))
+        except ValueError:
+            pass
+    match = re.search(r"\.A(\d{4})(\d{3})\.", name)
+    if match:
+        return pd.Timestamp(year=int(match.group(1)), month=1, day=1) + pd.Timedelta(days=int(match.group(2)) - 1)
+    return span[0] if span is not None else None
+
+
+def overlaps(span, start, end):
+    return span is None or (span[0] <= end and span[1] >= start)
+
+
+# ------------------------------
+# GRANULE INDEX
+# ------------------------------
+def open_index(path=INDEX_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.executescript(INDEX_SCHEMA)
+    return connection
+
+
+def cached_listing(connection, url, span, now):
+    # Children of an already listed, settled directory; None means re-list it
+    if span is None or span[1] >= pd.Timestamp(now, unit="s").normalize() - pd.Timedelta(days=SETTLE_DAYS):
+        return None
+    row = connection.execute("SELECT listed_at FROM directories WHERE url = ?", (url,)).fetchone()
+    if row is None or row[0] is None:
+        return None
+    children = [r[0] for r in connection.execute("SELECT url FROM directories WHERE parent = ?", (url,))]
+    return children
+
+
+def store_listing(connection, collection_url, url, directories, files, span, now):
+    with connection:
+        connection.execute(
+            "INSERT INTO directories (url, parent, collection, listed_at) VALUES (?, NULL, ?, ?)"
+            " ON CONFLICT (url) DO UPDATE SET listed_at = excluded.listed_at",
+            (url, collection_url, now),
+        )
+        connection.executemany(
+            "INSERT OR IGNORE INTO directories (url, parent, collection, listed_at) VALUES (?, ?, ?, NULL)",
+            [(child, url, collection_url) for child in directories],
+        )
+        connection.execute("DELETE FROM granules WHERE directory = ?", (url,))
+        rows = []
+        for file_url, size, modified in files:
+            name = file_url.rsplit("/", 1)[-1]
+            date = granule_date(name, span)
+            rows.append((file_url, collection_url, url, name, size, modified,
+                         date.strftime("%Y-%m-%d") if date is not None else None))
+        connection.executemany("INSERT OR REPLACE INTO granules VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def query_granules(connection, collection_url, start, end, pattern="*"):
+    # Granules of the collection dated inside [start, end] whose file name
+    # matches the glob pattern, in date then name order
+    rows = connection.execute(
+        "SELECT url, name, size, date FROM granules WHERE collection = ? AND date BETWEEN ? AND ?"
+        " ORDER BY date, name",
+        (collection_url, pd.Timestamp(start).strftime("%Y-%m-%d"), pd.Timestamp(end).strftime("%Y-%m-%d")),
+    )
+    return [
+        {"url": url, "name": name, "size": size, "date": date}
+        for url, name, size, date in rows
+        if fnmatch.fnmatch(name, pattern)
+    ]
+
+
+# ------------------------------
+# CONCURRENT CRAWL
+# ------------------------------
+def fetch_listing(session, url):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = session.get(url, timeout=REQUEST_TIMEOUT)
+            if response.status_code < 500 or attempt == MAX_RETRIES:
+                response.raise_for_status()
+                return parse_listing(response.content, response.url if response.url.endswith("/") else url)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+        time.sleep(BACKOFF_SECONDS * 2 ** attempt)
+
+
+def crawl(session, collection_url, start, end, index_path=INDEX_PATH, concurrency=DEFAULT_CONCURRENCY):
+    # Walks the collection breadth-first, skipping directories whose dates
+    # fall outside [start, end] and reusing settled listings from the index.
+    # Only worker threads touch the network; the index is written here.
+    collection_url = collection_url.rstrip("/") + "/"
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    now = time.time()
+    connection = open_index(index_path)
+    stats = {"listed": 0, "cached": 0, "failed": 0}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+
+        def visit(url):
+            span = directory_span(collection_url, url)
+            if not overlaps(span, start, end):
+                return
+            children = cached_listing(connection, url, span, now)
+            if children is not None:
+                stats["cached"] += 1
+                for child in children:
+                    visit(child)
+                return
+            pending[executor.submit(fetch_listing, session, url)] = (url, span)
+
+        visit(collection_url)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, span = pending.pop(future)
+                try:
+                    directories, files = future.result()
+                except Exception as e:
+                    print(f"Failed to list {url}: {e}")
+                    stats["failed"] += 1
+                    continue
+                store_listing(connection, collection_url, url, directories, files, span, now)
+                stats["listed"] += 1
+                for child in directories:
+                    visit(child)
+
+    connection.close()
+    return stats
+
+
+def resolve_collection(collection):
+    # A url_dict key or a full collection URL
+    if collection.isdigit():
+        return url_dict[int(collection)]
+    if not urlparse(collection).scheme:
+        raise ValueError(f"Not a collection URL or url_dict key: {collection}")
+    return collection
+
+
+def load_credentials(path=CONFIG_FILE_PATH):
+    if not os.path.exists(path):
+        return None, None
+    with open(path) as config_file:
+        config = json.load(config_file)
+    return config.get("username"), config.get("password")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the granules of an Earthdata collection")
+    parser.add_argument("collection", help="collection URL, or a key of urls.url_dict")
+    parser.add_argument("--start", required=True, help="first date, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="last date, YYYY-MM-DD")
+    parser.add_argument("--pattern", default="*", help="file name glob, e.g. '*.HDF5'")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--index", default=INDEX_PATH, help="granule index database")
+    parser.add_argument("--output", help="write the matching granule URLs to this file")
+    args = parser.parse_args()
+
+    collection_url = resolve_collection(args.collection).rstrip("/") + "/"
+    session = create_session(*load_credentials(), pool_size=args.concurrency)
+
+    started = time.time()
+    stats = crawl(session, collection_url, args.start, args.end, args.index, args.concurrency)
+    connection = open_index(args.index)
+    granules = query_granules(connection, collection_url, args.start, args.end, args.pattern)
+    connection.close()
+
+    print(
+        f"Listed {stats['listed']} directories ({stats['cached']} from the index, {stats['failed']} failed) "
+        f"in {time.time() - started:.1f}s: {len(granules)} granules match"
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.writelines(g["url"] + "\n" for g in granules)
+    else:
+        for granule in granules:
+            print(granule["url"])
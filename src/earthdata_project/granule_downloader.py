@@ -0,0 +1,232 @@
+import argparse
+import hashlib
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import NamedTuple
+from urllib.parse import urlparse
+
+import requests
+
+from earthdata_helper import create_session
+from granule_crawler import DATA_DIR, INDEX_PATH, load_credentials, open_index, query_granules, resolve_collection
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+DOWNLOAD_DIR = os.path.join(DATA_DIR, "earthdata", "granules")
+DEFAULT_CONCURRENCY = 4
+CHUNK_SIZE = 1024 * 1024
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT = 120
+PARTIAL_SUFFIX = ".part"
+
+# Checksum algorithm by hex digest length, for "<digest>  <file name>" lists
+DIGEST_ALGORITHMS = {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}
+
+
+class DownloadResult(NamedTuple):
+    url: str
+    path: str
+    status: str     # "downloaded", "resumed", "skipped" or "failed"
+    size: int
+    error: str
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+# ------------------------------
+# CHECKSUMS
+# ------------------------------
+def load_checksums(path):
+    # md5sum/sha256sum style file -> {file name: (algorithm, hex digest)}
+    checksums = {}
+    with open(path) as f:
+        for line in f:
+            match = re.match(r"^([0-9a-fA-F]+)\s+\*?(.+?)\s*$", line)
+            if match and len(match.group(1)) in DIGEST_ALGORITHMS:
+                digest = match.group(1).lower()
+                checksums[os.path.basename(match.group(2))] = (DIGEST_ALGORITHMS[len(digest)], digest)
+    return checksums
+
+
+def hash_file(hasher, path):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+
+
+# ------------------------------
+# SINGLE GRANULE
+# ------------------------------
+def granule_path(url, directory):
+    return os.path.join(directory, os.path.basename(urlparse(url).path))
+
+
+def response_total_size(response, offset):
+    # Full file size from Content-Range on a 206, Content-Length on a 200
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("/*"):
+        return int(content_range.rsplit("/", 1)[1])
+    if "Content-Length" in response.headers:
+        return int(response.headers["Content-Length"]) + (offset if response.status_code == 206 else 0)
+    return None
+
+
+def transfer(session, url, partial_path, hasher):
+    # One attempt: resume from whatever is already in partial_path.
+    # Returns the full size the server reported (or None if it did not say).
+    offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code == 416 and offset:
+            # Nothing left to send: the partial file already holds everything
+            total = response_total_size(response, offset)
+            if total == offset:
+                hash_file(hasher, partial_path)
+                return total
+            os.remove(partial_path)
+            raise IncompleteDownload(f"server rejected resume at byte {offset}")
+        response.raise_for_status()
+
+        if response.status_code == 206:
+            hash_file(hasher, partial_path)
+            mode = "ab"
+        else:
+            # Server ignored the Range header: start over
+            offset = 0
+            mode = "wb"
+
+        total = response_total_size(response, offset)
+        with open(partial_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                hasher.update(chunk)
+
+    size = os.path.getsize(partial_path)
+    if total is not None and size != total:
+        raise IncompleteDownload(f"got {size} of {total} bytes")
+    return total
+
+
+def download_granule(session, url, directory, checksum=None):
+    # Streams url into directory. The file only gets its final name once its
+    # size (and checksum, when given) has been verified, so an existing final
+    # file is complete and is skipped; a leftover .part is resumed with Range.
+    path = granule_path(url, directory)
+    if os.path.exists(path):
+        return DownloadResult(url, path, "skipped", os.path.getsize(path), None)
+
+    os.makedirs(directory, exist_ok=True)
+    partial_path = path + PARTIAL_SUFFIX
+    resumed = os.path.exists(partial_path)
+    algorithm = checksum[0] if checksum else "sha256"
+
+    for attempt in range(MAX_RETRIES + 1):
+        hasher = hashlib.new(algorithm)
+        try:
+            transfer(session, url, partial_path, hasher)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                IncompleteDownload) as e:
+            error = e
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code < 500:
+                return DownloadResult(url, path, "failed", 0, str(e))
+            error = e
+
+        if attempt == MAX_RETRIES:
+            return DownloadResult(url, path, "failed", 0, str(error))
+        resumed = resumed or os.path.exists(partial_path)
+        time.sleep(BACKOFF_SECONDS * 2 ** attempt)
+
+    if checksum is not None and hasher.hexdigest() != checksum[1]:
+        os.remove(partial_path)
+        return DownloadResult(url, path, "failed", 0, f"{algorithm} mismatch")
+
+    os.replace(partial_path, path)
+    return DownloadResult(url, path, "resumed" if resumed else "downloaded", os.path.getsize(path), None)
+
+
+# ------------------------------
+# BULK DOWNLOAD
+# ------------------------------
+def download_granules(urls, directory=DOWNLOAD_DIR, session=None, concurrency=DEFAULT_CONCURRENCY, checksums=None):
+    # All granules share one session, so one login cookie and one connection
+    # pool serve the whole batch
+    session = session or create_session(*load_credentials(), pool_size=concurrency)
+    checksums = checksums or {}
+    results = []
+
+    # Each destination is fetched once: two workers on the same path would
+    # write the same .part file. Repeated URLs are dropped; a different URL
+    # with a file name already taken fails instead of overwriting it.
+    urls_by_path = {}
+    for url in urls:
+        path = granule_path(url, directory)
+        if path not in urls_by_path:
+            urls_by_path[path] = url
+        elif urls_by_path[path] != url:
+            results.append(DownloadResult(url, path, "failed", 0, f"same file name as {urls_by_path[path]}"))
+            print(f"failed: {os.path.basename(path)} (same file name as {urls_by_path[path]})")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(download_granule, session, url, directory, checksums.get(os.path.basename(path)))
+            for path, url in urls_by_path.items()
+        ]
+        for i, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results.append(result)
+            message = f"[{i}/{len(futures)}] {result.status}: {os.path.basename(result.path)}"
+            print(message + (f" ({result.error})" if result.error else ""))
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download Earthdata granules in parallel, resuming partial files")
+    parser.add_argument("urls", nargs="*", help="granule URLs")
+    parser.add_argument("--input", help="file with one granule URL per line (e.g. granule_crawler.py --output)")
+    parser.add_argument("--collection", help="take the URLs from the granule index for this collection")
+    parser.add_argument("--start", help="first date for --collection, YYYY-MM-DD")
+    parser.add_argument("--end", help="last date for --collection, YYYY-MM-DD")
+    parser.add_argument("--pattern", default="*", help="file name glob for --collection")
+    parser.add_argument("--index", default=INDEX_PATH, help="granule index database")
+    parser.add_argument("--checksums", help="md5sum/sha256sum style file to verify against")
+    parser.add_argument("--output-dir", default=DOWNLOAD_DIR)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+
+    urls = list(args.urls)
+    if args.input:
+        with open(args.input) as f:
+            urls += [line.strip() for line in f if line.strip()]
+    if args.collection:
+        if not (args.start and args.end):
+            parser.error("--collection needs --start and --end")
+        connection = open_index(args.index)
+        collection_url = resolve_collection(args.collection).rstrip("/") + "/"
+        urls += [g["url"] for g in query_granules(connection, collection_url, args.start, args.end, args.pattern)]
+        connection.close()
+    if not urls:
+        parser.error("no granule URLs given")
+
+    checksums = load_checksums(args.checksums) if args.checksums else None
+    started = time.time()
+    results = download_granules(urls, args.output_dir, concurrency=args.concurrency, checksums=checksums)
+
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    total_bytes = sum(r.size for r in results if r.status in ("downloaded", "resumed"))
+    print(
+        f"{len(results)} granules in {time.time() - started:.1f}s "
+        f"({total_bytes / 1024 ** 2:.1f} MiB): "
+        + ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    )
@@ -0,0 +1,410 @@
+import argparse
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import h5py
+import numpy as np
+
+from granule_crawler import DATA_DIR, granule_date
+
+# The NetCDF layout is shared with the GIBS extraction pipeline
+GIBS_PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../gibs_map_project"))
+sys.path.insert(0, GIBS_PROJECT_DIR)
+from netcdf_writer import NetCDFWriter, DEFAULT_COMPLEVEL
+from colormap_decoder import frame_coordinates
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+OUTPUT_DIR = os.path.join(DATA_DIR, "earthdata", "subsets")
+DEFAULT_WORKERS = 4
+# Swath data is binned onto a regular grid of this many degrees per cell
+DEFAULT_RESOLUTION = 0.1
+# Rows of 2-D geolocation scanned per read when locating a bbox in a swath
+SCAN_BLOCK_ROWS = 512
+
+LATITUDE_NAMES = ("lat", "latitude", "nlat", "ydim")
+LONGITUDE_NAMES = ("lon", "longitude", "nlon", "xdim")
+
+
+class GranuleVariable(NamedTuple):
+    path: str
+    latitude: str
+    longitude: str
+    shape: tuple
+    kind: str       # "grid" (1-D lat/lon axes) or "swath" (2-D lat/lon arrays)
+    units: str
+    long_name: str
+
+
+# ------------------------------
+# DISCOVERY
+# ------------------------------
+def attribute_text(attrs, name):
+    value = attrs.get(name)
+    if value is None:
+        return None
+    if isinstance(value, np.ndarray):
+        value = value.flat[0] if value.size else None
+    if isinstance(value, bytes):
+        value = value.decode(errors="replace")
+    return str(value) if value is not None else None
+
+
+def find_geolocation(group):
+    # Latitude/longitude datasets that sit in the variable's group, or in a
+    # "Geolocation Fields" style subgroup as HDF-EOS5 puts them
+    candidates = [group] + [child for child in group.values() if isinstance(child, h5py.Group)]
+    for container in candidates:
+        names = {name.lower(): name for name, item in container.items() if isinstance(item, h5py.Dataset)}
+        latitude = next((names[n] for n in LATITUDE_NAMES if n in names), None)
+        longitude = next((names[n] for n in LONGITUDE_NAMES if n in names), None)
+        if latitude and longitude:
+            return container[latitude], container[longitude]
+    return None, None
+
+
+def discover(h5file):
+    # Every numeric dataset that can be located on the globe. Only metadata
+    # is touched here: shapes, attributes and the geolocation datasets' names.
+    variables = {}
+
+    def visit(name, item):
+        if not isinstance(item, h5py.Dataset) or item.dtype.kind not in "iuf":
+            return
+        latitude, longitude = find_geolocation(item.parent)
+        if latitude is None or item.name in (latitude.name, longitude.name):
+            return
+
+        shape = tuple(d for d in item.shape if d != 1)
+        if latitude.ndim == 1 and longitude.ndim == 1:
+            if sorted(shape) != sorted((latitude.shape[0], longitude.shape[0])):
+                return
+            kind = "grid"
+        elif latitude.ndim == 2 and latitude.shape == longitude.shape and shape == latitude.shape:
+            kind = "swath"
+        else:
+            return
+
+        variables[item.name] = GranuleVariable(
+            item.name, latitude.name, longitude.name, item.shape, kind,
+            attribute_text(item.attrs, "units") or attribute_text(item.attrs, "Units"),
+            attribute_text(item.attrs, "long_name") or attribute_text(item.attrs, "LongName"),
+        )
+
+    h5file.visititems(visit)
+    return variables
+
+
+def grid_key(variable):
+    # Swath variables are all binned onto the same grid over the bbox; grid
+    # variables share a grid only when they share their latitude/longitude
+    return "swath" if variable.kind == "swath" else (variable.latitude, variable.longitude)
+
+
+def select_variables(name, available, variable_paths=None):
+    # The variables to subset, all on one grid, since one NetCDF file holds
+    # one latitude/longitude pair. Without a choice, the largest such group.
+    groups = {}
+    for variable in available.values():
+        groups.setdefault(grid_key(variable), []).append(variable.path)
+    if not variable_paths:
+        return max(groups.values(), key=len) if groups else []
+
+    missing = [v for v in variable_paths if v not in available]
+    if missing:
+        raise ValueError(f"{name} has no locatable variable(s): {', '.join(missing)}")
+    keys = {grid_key(available[v]) for v in variable_paths}
+    if len(keys) > 1:
+        listing = "; ".join(
+            ", ".join(v for v in variable_paths if grid_key(available[v]) == key) for key in keys
+        )
+        raise ValueError(f"{name}: the variables are on different grids ({listing}); subset one grid at a time")
+    return list(variable_paths)
+
+
+# ------------------------------
+# VALUE CLEANUP
+# ------------------------------
+def physical_values(dataset, raw):
+    # Fill values to NaN, then scale_factor/add_offset as CF and HDF-EOS use them
+    values = raw.astype(np.float32)
+    for name in ("_FillValue", "missing_value", "MissingValue", "_FillValue_"):
+        fill = dataset.attrs.get(name)
+        if fill is not None:
+            values[np.isin(raw, np.atleast_1d(fill))] = np.nan
+    scale = dataset.attrs.get("scale_factor")
+    offset = dataset.attrs.get("add_offset")
+    if scale is not None:
+        values *= np.float32(np.atleast_1d(scale)[0])
+    if offset is not None:
+        values += np.float32(np.atleast_1d(offset)[0])
+    return values
+
+
+# ------------------------------
+# GRID SUBSET
+# ------------------------------
+def axis_window(axis, low, high):
+    # Contiguous index range of a 1-D coordinate inside [low, high]
+    inside = np.nonzero((axis >= low) & (axis <= high))[0]
+    if inside.size == 0:
+        return None
+    return slice(int(inside[0]), int(inside[-1]) + 1)
+
+
+def read_grid(h5file, variable, bbox):
+    # 1-D axes are tiny, so they are read whole; the data itself is read as a
+    # single hyperslab, which h5py turns into reads of the overlapping chunks
+    lonmin, latmin, lonmax, latmax = bbox
+    dataset = h5file[variable.path]
+    lats = h5file[variable.latitude][()]
+    lons = h5file[variable.longitude][()]
+
+    rows = axis_window(lats, latmin, latmax)
+    cols = axis_window(lons, lonmin, lonmax)
+    if rows is None or cols is None:
+        return None
+
+    # Leading/trailing singleton dimensions (time, band) are sliced to 0
+    squeezed = [i for i, d in enumerate(dataset.shape) if d != 1]
+    lat_axis, lon_axis = squeezed
+    if dataset.shape[lat_axis] != len(lats):
+        lat_axis, lon_axis = lon_axis, lat_axis
+    selection = [0] * dataset.ndim
+    selection[lat_axis], selection[lon_axis] = rows, cols
+
+    grid = physical_values(dataset, dataset[tuple(selection)])
+    if lat_axis > lon_axis:
+        grid = grid.T
+
+    lats, lons = lats[rows], lons[cols]
+    if lats[0] > lats[-1]:
+        lats, grid = lats[::-1], grid[::-1]
+    return lats, lons, grid
+
+
+# ------------------------------
+# SWATH SUBSET
+# ------------------------------
+def swath_window(latitude, longitude, bbox):
+    # Scan the 2-D geolocation block by block for the rows/columns that hold
+    # points inside the bbox, never holding more than one block in memory
+    lonmin, latmin, lonmax, latmax = bbox
+    row0 = col0 = None
+    row1 = col1 = 0
+    block_rows = SCAN_BLOCK_ROWS
+    if latitude.chunks:
+        # Whole chunks per read, so no chunk is decompressed twice
+        block_rows = math.ceil(SCAN_BLOCK_ROWS / latitude.chunks[0]) * latitude.chunks[0]
+
+    for start in range(0, latitude.shape[0], block_rows):
+        lat_block = latitude[start:start + block_rows]
+        lon_block = longitude[start:start + block_rows]
+        inside = (lat_block >= latmin) & (lat_block <= latmax) & (lon_block >= lonmin) & (lon_block <= lonmax)
+        if not inside.any():
+            continue
+        rows = np.nonzero(inside.any(axis=1))[0]
+        cols = np.nonzero(inside.any(axis=0))[0]
+        row0 = start + rows[0] if row0 is None else row0
+        row1 = start + rows[-1] + 1
+        col0 = cols[0] if col0 is None else min(col0, cols[0])
+        col1 = max(col1, cols[-1] + 1)
+
+    if row0 is None:
+        return None
+    return slice(int(row0), int(row1)), slice(int(col0), int(col1))
+
+
+def read_swath(h5file, variable, bbox, resolution):
+    # Reads the swath window only, then averages its points into the cells
+    # of a regular grid over the bbox
+    lonmin, latmin, lonmax, latmax = bbox
+    latitude = h5file[variable.latitude]
+    longitude = h5file[variable.longitude]
+    window = swath_window(latitude, longitude, bbox)
+
+    height = max(1, math.ceil((latmax - latmin) / resolution))
+    width = max(1, math.ceil((lonmax - lonmin) / resolution))
+    lats, lons = frame_coordinates(bbox, width, height)
+    if window is None:
+        return lats, lons, np.full((height, width), np.nan, dtype=np.float32)
+
+    dataset = h5file[variable.path]
+    values = physical_values(dataset, dataset[window]).ravel()
+    point_lats = latitude[window].ravel()
+    point_lons = longitude[window].ravel()
+
+    keep = (
+        np.isfinite(values)
+        & (point_lats >= latmin) & (point_lats <= latmax)
+        & (point_lons >= lonmin) & (point_lons <= lonmax)
+    )
+    rows = np.minimum(((point_lats[keep] - latmin) / (latmax - latmin) * height).astype(np.int64), height - 1)
+    cols = np.minimum(((point_lons[keep] - lonmin) / (lonmax - lonmin) * width).astype(np.int64), width - 1)
+    cells = rows * width + cols
+
+    sums = np.bincount(cells, weights=values[keep], minlength=height * width)
+    counts = np.bincount(cells, minlength=height * width)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        grid = (sums / counts).astype(np.float32)
+    return lats, lons, grid.reshape(height, width)
+
+
+# ------------------------------
+# ONE GRANULE (RUNS IN A WORKER PROCESS)
+# ------------------------------
+def subset_granule(path, bbox, variable_paths=None, resolution=DEFAULT_RESOLUTION):
+    # -> (time, lats, lons, {variable: grid south->north}, {variable: attrs})
+    with h5py.File(path, "r") as h5file:
+        available = discover(h5file)
+        wanted = select_variables(os.path.basename(path), available, variable_paths)
+
+        grids, attrs = {}, {}
+        lats = lons = None
+        for name in wanted:
+            variable = available[name]
+            if variable.kind == "grid":
+                result = read_grid(h5file, variable, bbox)
+                if result is None:
+                    continue
+            else:
+                result = read_swath(h5file, variable, bbox, resolution)
+            lats, lons, grids[name] = result
+            attrs[name] = {"units": variable.units, "long_name": variable.long_name}
+
+    return granule_date(os.path.basename(path), None), lats, lons, grids, attrs
+
+
+def netcdf_name(variable_path):
+    return variable_path.strip("/").replace("/", "_").replace(" ", "_")
+
+
+def merge_grids(merged, grids):
+    # Accumulates the granules that fall on one date (a day of swath
+    # granules) so they become one timestep, each cell the mean of the
+    # granules that have data there
+    for name, grid in grids.items():
+        finite = np.isfinite(grid)
+        if name not in merged:
+            merged[name] = (np.zeros(grid.shape, dtype=np.float64), np.zeros(grid.shape, dtype=np.int32))
+        sums, counts = merged[name]
+        sums += np.where(finite, grid, 0)
+        counts += finite
+
+
+def mean_grids(merged):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {name: (sums / counts).astype(np.float32) for name, (sums, counts) in merged.items()}
+
+
+# ------------------------------
+# MANY GRANULES
+# ------------------------------
+def subset_granules(paths, bbox, output_path, variable_paths=None, resolution=DEFAULT_RESOLUTION,
+                    workers=DEFAULT_WORKERS, complevel=DEFAULT_COMPLEVEL):
+    # Granules are read on a process pool (decompression and binning are CPU
+    # bound) and appended to one NetCDF file in date order as they arrive.
+    # Granules of the same date are merged into one timestep; granules
+    # without a date in their name are skipped.
+    dates = {path: granule_date(os.path.basename(path), None) for path in paths}
+    paths = sorted(paths, key=lambda path: (dates[path] is None, dates[path] or 0))
+
+    # Settle the variables once, from the first granule, so a bad choice
+    # fails here and every granule subsets the same grid
+    with h5py.File(paths[0], "r") as h5file:
+        variable_paths = select_variables(os.path.basename(paths[0]), discover(h5file), variable_paths)
+    if not variable_paths:
+        raise ValueError(f"{os.path.basename(paths[0])} has no locatable variables")
+    print(f"Subsetting {', '.join(variable_paths)}")
+
+    writer = None
+    grid_lats = grid_lons = None
+    day = None      # (time, merged grids) of the date being accumulated
+    skipped = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(subset_granule, path, bbox, variable_paths, resolution) for path in paths]
+        try:
+            for path, future in zip(paths, futures):
+                try:
+                    time_value, lats, lons, grids, attrs = future.result()
+                except (OSError, ValueError) as e:
+                    print(f"Skipping {os.path.basename(path)}: {e}")
+                    skipped.append(path)
+                    continue
+                if not grids:
+                    print(f"Skipping {os.path.basename(path)}: no data inside the bounding box")
+                    skipped.append(path)
+                    continue
+                if time_value is None:
+                    print(f"Skipping {os.path.basename(path)}: no date in the file name")
+                    skipped.append(path)
+                    continue
+
+                if writer is None:
+                    grid_lats, grid_lons = lats, lons
+                    writer = NetCDFWriter(
+                        output_path + ".part", lats, lons,
+                        {netcdf_name(name): attrs[name] for name in grids},
+                        complevel=complevel,
+                    )
+                elif not (np.array_equal(lats, grid_lats) and np.array_equal(lons, grid_lons)):
+                    print(f"Skipping {os.path.basename(path)}: its grid differs from the first granule's")
+                    skipped.append(path)
+                    continue
+
+                if day is not None and day[0] != time_value:
+                    writer.append(day[0], mean_grids(day[1]))
+                    day = None
+                if day is None:
+                    day = (time_value, {})
+                merge_grids(day[1], {netcdf_name(name): grid for name, grid in grids.items()})
+            if day is not None:
+                writer.append(day[0], mean_grids(day[1]))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            if writer is not None:
+                writer.close()
+                os.remove(output_path + ".part")
+            raise
+
+    if writer is None:
+        raise RuntimeError("No granule had data inside the bounding box")
+    writer.close()
+    os.replace(output_path + ".part", output_path)
+    return skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Subset HDF5/HDF-EOS5 granules into one NetCDF time series")
+    parser.add_argument("granules", nargs="+", help="granule files (.h5, .he5, .HDF5)")
+    parser.add_argument("--bbox", help="--bbox=lonmin,latmin,lonmax,latmax")
+    parser.add_argument(
+        "--variables", help="comma-separated dataset paths on one grid (default: the largest group sharing a grid)"
+    )
+    parser.add_argument("--list", action="store_true", help="list the locatable variables of the first granule")
+    parser.add_argument("--resolution", type=float, default=DEFAULT_RESOLUTION, help="grid cell size for swaths")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--output", help="NetCDF file to write")
+    args = parser.parse_args()
+
+    if args.list:
+        with h5py.File(args.granules[0], "r") as h5file:
+            for variable in discover(h5file).values():
+                print(f"{variable.path}  {variable.kind}  {variable.shape}  {variable.units or ''}")
+        sys.exit(0)
+
+    if not args.bbox:
+        parser.error("--bbox is required")
+    bbox = tuple(float(v) for v in args.bbox.split(","))
+    variable_paths = args.variables.split(",") if args.variables else None
+    output_path = args.output or os.path.join(OUTPUT_DIR, "subset.nc")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    skipped = subset_granules(args.granules, bbox, output_path, variable_paths, args.resolution, args.workers)
+    print(f"Wrote {output_path} ({len(args.granules) - len(skipped)} granules, {len(skipped)} skipped)")
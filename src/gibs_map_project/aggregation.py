@@ -0,0 +1,240 @@
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+# "none" keeps every timestep, "all" folds the whole request into one step
+PERIODS = ("none", "week", "month", "all")
+STATISTICS = ("mean", "min", "max", "count")
+PERCENTILE_PATTERN = re.compile(r"^p(\d+(?:\.\d+)?)$")
+MAX_FACTOR = 1000
+# Percentiles keep one count per colormap class and output cell; refuse
+# requests whose histograms would not fit
+MAX_HISTOGRAM_BYTES = 2 * 1024 ** 3
+HISTOGRAM_DTYPE = np.uint64
+PERCENTILE_ROWS = 64
+
+CELL_METHODS = {"mean": "mean", "min": "minimum", "max": "maximum", "count": "sum"}
+
+
+# ------------------------------
+# REQUEST PARAMETERS
+# ------------------------------
+def parse_aggregation(data):
+    # {"period": "month", "statistics": ["mean", "p90"], "factor": 4} -> dict,
+    # or None when the request has no aggregation
+    if data is None:
+        return None
+    if not isinstance(data, dict):
+        raise ValueError("aggregation must be an object")
+
+    period = data.get("period", "all")
+    if period not in PERIODS:
+        raise ValueError(f"aggregation period must be one of {', '.join(PERIODS)}")
+
+    statistics = data.get("statistics", ["mean"])
+    if isinstance(statistics, str):
+        statistics = [statistics]
+    if not statistics:
+        raise ValueError("aggregation needs at least one statistic")
+    for statistic in statistics:
+        match = PERCENTILE_PATTERN.match(str(statistic))
+        if statistic not in STATISTICS and not (match and 0 < float(match.group(1)) <= 100):
+            raise ValueError(f"Unknown statistic {statistic!r}: use {', '.join(STATISTICS)} or p1..p100")
+    if len(set(statistics)) != len(statistics):
+        raise ValueError("aggregation statistics must not repeat")
+
+    factor = int(data.get("factor", 1))
+    if not 1 <= factor <= MAX_FACTOR:
+        raise ValueError(f"aggregation factor must be between 1 and {MAX_FACTOR}")
+
+    return {"period": period, "statistics": list(statistics), "factor": factor}
+
+
+def percentile_of(statistic):
+    match = PERCENTILE_PATTERN.match(statistic)
+    return float(match.group(1)) if match else None
+
+
+# ------------------------------
+# TIME BINS
+# ------------------------------
+def bin_start(time_value, period, first_time):
+    time_value = pd.Timestamp(time_value)
+    if period == "none":
+        return time_value
+    if period == "week":
+        # ISO weeks, Monday to Sunday
+        return time_value.to_period("W-SUN").start_time
+    if period == "month":
+        return time_value.to_period("M").start_time
+    return pd.Timestamp(first_time)
+
+
+def block_coordinates(lats, lons, factor):
+    # Same convention as frame_coordinates: each output cell is labelled with
+    # the coordinate of its first input pixel
+    return lats[::factor], lons[::factor]
+
+
+# ------------------------------
+# RUNNING ACCUMULATORS
+# ------------------------------
+class RunningStats:
+    # Reduces one variable over a time bin and factor x factor pixel blocks.
+    # Only per-cell running sums, counts, extremes and (for percentiles)
+    # class histograms are kept, never the frames themselves.
+    def __init__(self, shape, factor, statistics, classes):
+        self.factor = factor
+        self.statistics = statistics
+        self.shape = (math.ceil(shape[0] / factor), math.ceil(shape[1] / factor))
+        self.padded = (self.shape[0] * factor, self.shape[1] * factor)
+
+        self.count = np.zeros(self.shape, dtype=np.int64)
+        self.total = np.zeros(self.shape, dtype=np.float64)
+        self.minimum = np.full(self.shape, np.inf, dtype=np.float32)
+        self.maximum = np.full(self.shape, -np.inf, dtype=np.float32)
+
+        self.classes = None
+        if any(percentile_of(s) is not None for s in statistics):
+            # Decoded values only ever take the colormap's values, so a count
+            # per class and cell gives exact percentiles
+            self.classes = classes
+            # Cell-major, so neighbouring pixels update neighbouring memory.
+            # 64-bit like count: factor 1000 puts 10^6 pixels in a cell per
+            # timestep, so a long bin would overflow 32-bit counts.
+            self.histogram = np.zeros((*self.shape, len(classes)), dtype=HISTOGRAM_DTYPE)
+            self.offsets = np.arange(self.shape[0] * self.shape[1]).reshape(self.shape) * len(classes)
+
+    def blocks(self, grid):
+        padded = grid
+        if grid.shape != self.padded:
+            padded = np.full(self.padded, np.nan, dtype=np.float32)
+            padded[:grid.shape[0], :grid.shape[1]] = grid
+        return padded.reshape(self.shape[0], self.factor, self.shape[1], self.factor)
+
+    def add(self, grid):
+        blocks = self.blocks(grid)
+        valid = ~np.isnan(blocks)
+        self.count += valid.sum(axis=(1, 3))
+        self.total += np.where(valid, blocks, 0).sum(axis=(1, 3), dtype=np.float64)
+        np.minimum(self.minimum, np.where(valid, blocks, np.inf).min(axis=(1, 3)), out=self.minimum)
+        np.maximum(self.maximum, np.where(valid, blocks, -np.inf).max(axis=(1, 3)), out=self.maximum)
+
+        if self.classes is not None:
+            # One pass per position inside the block: each pass touches every
+            # cell once, so plain fancy-index increments never collide
+            class_index = np.searchsorted(self.classes, blocks)
+            histogram = self.histogram.reshape(-1)
+            for dy in range(self.factor):
+                for dx in range(self.factor):
+                    ok = valid[:, dy, :, dx]
+                    histogram[self.offsets[ok] + class_index[:, dy, :, dx][ok]] += 1
+
+    def percentile(self, q, rows=PERCENTILE_ROWS):
+        # Inverted CDF: the smallest class value covering q percent of samples.
+        # Done a band of rows at a time to keep the cumulative counts small.
+        rank = np.maximum(np.ceil(self.count * (q / 100.0)), 1)
+        result = np.empty(self.shape, dtype=np.float32)
+        for row in range(0, self.shape[0], rows):
+            cumulative = np.cumsum(self.histogram[row:row + rows], axis=-1, dtype=np.int64)
+            index = (cumulative >= rank[row:row + rows, :, None]).argmax(axis=-1)
+            result[row:row + rows] = self.classes[index]
+        result[self.count == 0] = np.nan
+        return result
+
+    def result(self):
+        empty = self.count == 0
+        outputs = {}
+        for statistic in self.statistics:
+            if statistic == "mean":
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    grid = (self.total / self.count).astype(np.float32)
+            elif statistic == "min":
+                grid = self.minimum.copy()
+            elif statistic == "max":
+                grid = self.maximum.copy()
+            elif statistic == "count":
+                outputs[statistic] = self.count.astype(np.float32)
+                continue
+            else:
+                grid = self.percentile(percentile_of(statistic))
+            grid[empty] = np.nan
+            outputs[statistic] = grid
+        return outputs
+
+
+class Aggregator:
+    # Folds a time-ordered stream of {variable: grid} into time bins and
+    # hands back {variable_statistic: grid} for each bin as soon as it closes
+    def __init__(self, aggregation, variables, classes, first_time):
+        self.period = aggregation["period"]
+        self.factor = aggregation["factor"]
+        self.statistics = aggregation["statistics"]
+        self.variables = variables
+        self.classes = classes
+        self.first_time = first_time
+
+        self._bin = None
+        self._stats = {}
+
+    def check_memory(self, shape):
+        # Raises ValueError before any download when percentile histograms
+        # for this grid would be too large
+        if not any(percentile_of(s) is not None for s in self.statistics):
+            return
+        cells = math.ceil(shape[0] / self.factor) * math.ceil(shape[1] / self.factor)
+        needed = sum(len(classes) for classes in self.classes.values()) * cells * np.dtype(HISTOGRAM_DTYPE).itemsize
+        if needed > MAX_HISTOGRAM_BYTES:
+            raise ValueError(
+                f"Percentiles on this grid need {needed / 1024 ** 3:.1f} GiB of histograms "
+                f"(limit {MAX_HISTOGRAM_BYTES / 1024 ** 3:.1f} GiB); use a larger aggregation factor"
+            )
+
+    def output_variables(self):
+        outputs = {}
+        for name, attrs in self.variables.items():
+            for statistic in self.statistics:
+                attrs = dict(attrs)
+                if statistic in CELL_METHODS:
+                    method = CELL_METHODS[statistic]
+                else:
+                    method = f"percentile {percentile_of(statistic):g}"
+                axes = ("area: " if self.factor > 1 else "") + ("time: " if self.period != "none" else "")
+                attrs["cell_methods"] = f"{axes}{method}" if axes else None
+                attrs["statistic"] = statistic
+                if statistic == "count":
+                    attrs["units"] = "1"
+                    attrs["long_name"] = f"number of valid samples of {attrs.get('long_name') or name}"
+                outputs[f"{name}_{statistic}"] = attrs
+        return outputs
+
+    def add(self, time_value, grids):
+        # grids: {variable: (latitude, longitude) grid}, south to north.
+        # Returns [(bin time, outputs)] for the bin this time closed, if any.
+        finished = []
+        key = bin_start(time_value, self.period, self.first_time)
+        if self._bin is not None and key != self._bin:
+            finished = self.finish()
+        self._bin = key
+
+        for name, grid in grids.items():
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = RunningStats(grid.shape, self.factor, self.statistics, self.classes[name])
+            stats.add(grid)
+        return finished
+
+    def finish(self):
+        if not self._stats:
+            return []
+        outputs = {}
+        for name, stats in self._stats.items():
+            for statistic, grid in stats.result().items():
+                outputs[f"{name}_{statistic}"] = grid
+        self._stats = {}
+        return [(self._bin, outputs)]
@@ -0,0 +1,99 @@
+import math
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+import rasterio
+from affine import Affine
+
+from netcdf_writer import DEFAULT_COMPLEVEL
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+BLOCK_SIZE = 512
+# Overviews average the valid pixels; NaN stays nodata at every level
+OVERVIEW_RESAMPLING = "average"
+COG_TIME_FORMAT = "%Y%m%dT%H%M%S"
+
+
+def grid_transform(bbox, shape, factor=1):
+    # North-up transform of the written grid. Aggregated blocks start at the
+    # southern edge and pad northwards, so the top edge moves up with padding.
+    lonmin, latmin, lonmax, latmax = bbox
+    height, width = shape
+    pixel_x = (lonmax - lonmin) / width * factor
+    pixel_y = (latmax - latmin) / height * factor
+    rows = math.ceil(height / factor)
+    return Affine(pixel_x, 0.0, lonmin, 0.0, -pixel_y, latmin + rows * pixel_y)
+
+
+# ------------------------------
+# CLOUD-OPTIMIZED GEOTIFF WRITER
+# ------------------------------
+class COGWriter:
+    # Same interface as NetCDFWriter, writing one Cloud-Optimized GeoTIFF per
+    # timestep with one band per variable, internal tiles and overviews, so a
+    # GIS client can range-read just the window and zoom level it shows
+    def __init__(self, directory, prefix, transform, variables, complevel=DEFAULT_COMPLEVEL):
+        self.directory = directory
+        self.prefix = prefix
+        self.transform = transform
+        self.variables = variables
+        self.complevel = complevel
+        self.files = []
+        self.size = 0
+
+    def append(self, time_value, grids):
+        # grids maps variable name -> (latitude, longitude) array, south to north
+        index = self.size
+        time_value = pd.Timestamp(time_value)
+        filename = f"{self.prefix}_{time_value.strftime(COG_TIME_FORMAT)}.tif"
+        height, width = next(iter(grids.values())).shape
+
+        profile = {
+            "driver": "COG",
+            "width": width,
+            "height": height,
+            "count": len(self.variables),
+            "dtype": "float32",
+            "crs": "EPSG:4326",
+            "transform": self.transform,
+            "nodata": np.nan,
+            "blocksize": BLOCK_SIZE,
+            "overview_resampling": OVERVIEW_RESAMPLING,
+            "bigtiff": "IF_SAFER",
+        }
+        if self.complevel > 0:
+            profile.update(compress="ZSTD", level=self.complevel, predictor=3)
+
+        with rasterio.open(os.path.join(self.directory, filename), "w", **profile) as dataset:
+            dataset.update_tags(time=time_value.isoformat())
+            for band, (name, attrs) in enumerate(self.variables.items(), start=1):
+                grid = grids.get(name)
+                if grid is None:
+                    grid = np.full((height, width), np.nan, dtype=np.float32)
+                dataset.write(np.asarray(grid, dtype=np.float32)[::-1], band)
+                dataset.set_band_description(band, name)
+                dataset.update_tags(band, **{key: str(value) for key, value in attrs.items() if value is not None})
+
+        self.files.append(filename)
+        self.size += 1
+        return index
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def zip_files(directory, filenames, zip_path):
+    # Bundle for a single download; the GeoTIFFs stay in place for range reads
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for filename in filenames:
+            archive.write(os.path.join(directory, filename), filename)
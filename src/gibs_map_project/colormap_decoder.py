@@ -0,0 +1,135 @@
+import numpy as np
+
+# ------------------------------
+# COLORMAP PARSING
+# ------------------------------
+def parse_colormap(root):
+    title = None
+    units = "no unit available"
+
+    color_map_elements = root.findall(".//ColorMap")
+    if len(color_map_elements) >= 2:
+        second_cm = color_map_elements[1]
+        title = second_cm.attrib.get("title")
+        units = second_cm.attrib.get("units", "no unit available")
+
+    # Map RGB to value
+    color_map = {}
+    for entry in root.findall(".//ColorMapEntry"):
+        rgb = tuple(map(int, entry.attrib["rgb"].split(",")))
+
+        if entry.attrib.get("nodata") == "true":
+            continue
+
+        value_str = entry.attrib.get("value")
+        if value_str:
+            rng = value_str.strip("[]()").split(",")
+            if len(rng) == 1:
+                value = float(rng[0])
+            else:
+                if rng[0] == "-INF":
+                    value = float(rng[1])
+                elif rng[1] == "+INF":
+                    value = float(rng[0])
+                else:
+                    value = (float(rng[0]) + float(rng[1])) / 2
+
+            color_map[rgb] = value
+        else:
+            color_map[rgb] = None
+
+    return color_map, title, units
+
+
+# ------------------------------
+# LOOKUP TABLE
+# ------------------------------
+def build_lut(color_map):
+    # Sorted packed 24-bit RGB keys with their float values. Entries without a
+    # value (and nodata colours, which never make it into color_map) become NaN.
+    rgb_entries = [(rgb, value) for rgb, value in color_map.items() if len(rgb) == 3]
+
+    keys = np.array([(r << 16) | (g << 8) | b for (r, g, b), _ in rgb_entries], dtype=np.uint32)
+    values = np.array(
+        [np.nan if value is None else value for _, value in rgb_entries], dtype=np.float32
+    )
+
+    order = np.argsort(keys)
+    return keys[order], values[order]
+
+
+def pack_rgb(image):
+    rgb = np.asarray(image.convert("RGB"), dtype=np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+# ------------------------------
+# FRAME DECODING
+# ------------------------------
+def lookup_values(packed, lut, out):
+    # Fills out with the value of each packed RGB key, NaN where unmatched
+    keys, values = lut
+    out.fill(np.nan)
+    if keys.size == 0:
+        return out
+
+    idx = np.searchsorted(keys, packed)
+    np.minimum(idx, keys.size - 1, out=idx)
+    matched = keys[idx] == packed
+    out[matched] = values[idx[matched]]
+
+    return out
+
+
+def decode_frame(image, lut, out=None):
+    # out: optional float32 (height, width) array to decode into, e.g. a slot
+    # of a shared memory map
+    packed = pack_rgb(image)
+
+    if out is None:
+        out = np.empty(packed.shape, dtype=np.float32)
+    elif out.shape != packed.shape:
+        raise ValueError(f"Frame is {packed.shape[1]}x{packed.shape[0]}, expected {out.shape[1]}x{out.shape[0]}")
+
+    return lookup_values(packed, lut, out)
+
+
+def decode_pixels(image, lut, rows, cols):
+    # Values of just the given pixels; the PNG still has to be inflated, but
+    # the colormap lookup only runs on what was asked for
+    rgb = np.asarray(image.convert("RGB"))[rows, cols].astype(np.uint32)
+    packed = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+    return lookup_values(packed, lut, np.empty(packed.shape, dtype=np.float32))
+
+
+def decode_frame_reference(image, color_map):
+    # Pure-Python per-pixel path, kept to cross-check decode_frame
+    pixels = image.convert("RGB").load()
+    width, height = image.size
+
+    grid = np.full((height, width), np.nan, dtype=np.float32)
+    for y in range(height):
+        for x in range(width):
+            rgb = pixels[x, y][:3]
+            if rgb in color_map:
+                value = color_map[rgb]
+                if value is not None:
+                    grid[y, x] = value
+
+    return grid
+
+
+# ------------------------------
+# GRID COORDINATES
+# ------------------------------
+def frame_coordinates(bbox, width, height):
+    lonmin, latmin, lonmax, latmax = bbox
+
+    pixel_size_x = (lonmax - lonmin) / width
+    pixel_size_y = (latmax - latmin) / height
+
+    # Image rows run north to south, the grid is stored south to north
+    lats = latmax - np.arange(height - 1, -1, -1) * pixel_size_y
+    lons = lonmin + np.arange(width) * pixel_size_x
+
+    return lats, lons
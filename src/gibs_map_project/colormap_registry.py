@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import numpy as np
+import requests
+
+from colormap_decoder import parse_colormap, build_lut
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+REVALIDATE_SECONDS = 3600
+REQUEST_TIMEOUT = 60
+PREWARM_CONCURRENCY = 8
+
+
+class ColormapUnavailable(RuntimeError):
+    # The colormap could not be downloaded or parsed and no stored copy exists
+    pass
+
+
+class CompiledColorMap(NamedTuple):
+    keys: np.ndarray
+    values: np.ndarray
+    title: Optional[str]
+    units: str
+
+    @property
+    def lut(self):
+        return self.keys, self.values
+
+
+def compile_colormap(root):
+    color_map, title, units = parse_colormap(root)
+    keys, values = build_lut(color_map)
+    return CompiledColorMap(keys, values, title, units)
+
+
+# ------------------------------
+# COLORMAP REGISTRY
+# ------------------------------
+class ColorMapRegistry:
+    def __init__(self, directory, session=None, revalidate_seconds=REVALIDATE_SECONDS):
+        self.directory = directory
+        self.session = session or requests.Session()
+        self.revalidate_seconds = revalidate_seconds
+
+        # href -> (CompiledColorMap, metadata, last validation time)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._href_locks = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, href):
+        name = hashlib.sha256(href.encode()).hexdigest()
+        return os.path.join(self.directory, name + ".npz"), os.path.join(self.directory, name + ".json")
+
+    def _href_lock(self, href):
+        with self._lock:
+            return self._href_locks.setdefault(href, threading.Lock())
+
+    def _load(self, href):
+        array_path, meta_path = self._paths(href)
+        try:
+            with open(meta_path) as f:
+                metadata = json.load(f)
+            with np.load(array_path) as arrays:
+                compiled = CompiledColorMap(
+                    arrays["keys"], arrays["values"], metadata.get("title"), metadata["units"]
+                )
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+        return compiled, metadata
+
+    def _save(self, href, compiled, metadata):
+        array_path, meta_path = self._paths(href)
+
+        tmp_array_path = array_path + ".tmp.npz"
+        np.savez(tmp_array_path, keys=compiled.keys, values=compiled.values)
+        os.replace(tmp_array_path, array_path)
+
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(metadata, f, indent=4)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def get(self, href):
+        # Serves from memory while fresh, otherwise revalidates the persisted
+        # copy with a conditional GET and only re-parses on a 200
+        entry = self._entries.get(href)
+        if entry is not None and time.time() - entry[2] < self.revalidate_seconds:
+            return entry[0]
+
+        with self._href_lock(href):
+            entry = self._entries.get(href)
+            if entry is not None and time.time() - entry[2] < self.revalidate_seconds:
+                return entry[0]
+
+            if entry is None:
+                stored = self._load(href)
+                entry = (stored[0], stored[1], 0) if stored else None
+
+            headers = {}
+            if entry is not None:
+                if entry[1].get("etag"):
+                    headers["If-None-Match"] = entry[1]["etag"]
+                if entry[1].get("lastModified"):
+                    headers["If-Modified-Since"] = entry[1]["lastModified"]
+
+            try:
+                response = self.session.get(href, headers=headers, timeout=REQUEST_TIMEOUT)
+                if response.status_code != 304:
+                    response.raise_for_status()
+            except requests.RequestException as e:
+                if entry is None:
+                    raise ColormapUnavailable(f"Failed to download XML from {href}: {e}")
+                print(f"Could not revalidate colormap {href}, using stored copy: {e}")
+                self._entries[href] = (entry[0], entry[1], time.time())
+                return entry[0]
+
+            if response.status_code == 304:
+                compiled, metadata = entry[0], entry[1]
+            else:
+                try:
+                    compiled = compile_colormap(ET.fromstring(response.content))
+                except ET.ParseError as e:
+                    raise ColormapUnavailable(f"{href} is not a colormap XML: {e}")
+                metadata = {
+                    "href": href,
+                    "etag": response.headers.get("ETag"),
+                    "lastModified": response.headers.get("Last-Modified"),
+                    "title": compiled.title,
+                    "units": compiled.units,
+                }
+                self._save(href, compiled, metadata)
+
+            self._entries[href] = (compiled, metadata, time.time())
+            return compiled
+
+    # ------------------------------
+    # PREWARM
+    # ------------------------------
+    def prewarm(self, layers_info_path, concurrency=PREWARM_CONCURRENCY):
+        with open(layers_info_path) as f:
+            layers_info = json.load(f)
+
+        hrefs = sorted({
+            layer["MetadataHref"] for layer in layers_info.values()
+            if layer.get("MetadataHref", "").endswith(".xml")
+        })
+
+        def warm(href):
+            try:
+                self.get(href)
+                return True
+            except Exception as e:
+                print(f"Failed to prewarm colormap {href}: {e}")
+                return False
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            warmed = sum(executor.map(warm, hrefs))
+        print(f"Prewarmed {warmed}/{len(hrefs)} colormaps in {time.time() - start:.1f}s")
@@ -0,0 +1,633 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+from frame_downloader import download_frames, create_session, DEFAULT_CONCURRENCY, MAX_CONCURRENCY
+from frame_cache import FrameCache
+from colormap_decoder import frame_coordinates
+from colormap_registry import ColorMapRegistry
+from wmts_tiles import native_frames, native_level, pixel_window, check_window_size
+from aggregation import Aggregator, parse_aggregation, block_coordinates
+from parallel_decode import frame_decode_pool, decode_inline
+from vector_extraction import extract_vector, is_vector_layer, VECTOR_OUTPUT_FORMATS
+from netcdf_writer import NetCDFWriter, DEFAULT_COMPLEVEL
+from zarr_writer import ZarrWriter, store_lock, last_store_time, check_store, encode_time, zip_store
+from cog_writer import COGWriter, grid_transform, zip_files
+from time_extent import timesteps, extent_bounds, format_time, too_many_timesteps, MAX_TIMESTEPS
+from jobs import JobCancelled
+from metrics import (
+    JobStats, record_decode, record_append, record_file, log_job, profiled, PROFILING_ENABLED, PROFILE_KINDS,
+)
+
+# ------------------------------
+# PATHS
+# ------------------------------
+DATA_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../data"))
+JOBS_DIRECTORY = os.path.join(DATA_DIRECTORY, "jobs")
+CACHE_DIRECTORY = os.path.join(DATA_DIRECTORY, "cache", "frames")
+STORES_DIRECTORY = os.path.join(DATA_DIRECTORY, "stores")
+COLORMAP_DIRECTORY = os.path.join(DATA_DIRECTORY, "cache", "colormaps")
+LAYERS_INFO_PATH = os.path.join(os.path.dirname(__file__), "layers", "layers_info.json")
+DATE_FORMAT = "%Y-%m-%d"
+SCRATCH_RETENTION_SECONDS = 24 * 3600
+
+FRAME_SIZE = (2000, 2000)
+FRAME_FORMAT = "image/png"
+FRAME_CACHE_MAX_BYTES = 5 * 1024 ** 3
+
+# "wms" asks for one FRAME_SIZE GetMap image per date, "wmts" mosaics the
+# layer's tiles at its native TileMatrixSet resolution
+EXTRACTION_MODES = ("wms", "wmts")
+MAX_BATCH_LAYERS = 16
+# Batches run one download pool per layer; cap the threads of a whole job
+MAX_JOB_CONCURRENCY = 64
+
+# "zarr" writes a chunked store (appended to in place when a "store" name is
+# given), "cog" one Cloud-Optimized GeoTIFF per timestep
+RASTER_OUTPUT_FORMATS = ("netcdf", "zarr", "cog")
+STORE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Make sure jobs directory exists
+os.makedirs(JOBS_DIRECTORY, exist_ok=True)
+
+frame_cache = FrameCache(CACHE_DIRECTORY, FRAME_CACHE_MAX_BYTES)
+colormap_registry = ColorMapRegistry(COLORMAP_DIRECTORY)
+
+
+# ------------------------------
+# JOB SCRATCH SPACE
+# ------------------------------
+def job_directory(job_id):
+    return os.path.join(JOBS_DIRECTORY, job_id)
+
+
+def output_path(job):
+    filename = job.result["file"] if job.result else None
+    if not filename:
+        return None
+    return os.path.join(job_directory(job.id), filename)
+
+
+def remove_job_directory(job_id):
+    shutil.rmtree(job_directory(job_id), ignore_errors=True)
+
+
+def remove_stale_job_directories(max_age=SCRATCH_RETENTION_SECONDS):
+    # Scratch left behind by crashed or restarted servers
+    cutoff = time.time() - max_age
+    for name in os.listdir(JOBS_DIRECTORY):
+        path = os.path.join(JOBS_DIRECTORY, name)
+        if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# ------------------------------
+# LAYER METADATA
+# ------------------------------
+_layers_info = {"mtime": None, "layers": {}}
+_layers_info_lock = threading.Lock()
+
+
+def load_layers_info():
+    # Re-read layers_info.json only when gibs_wmts.py has rewritten it
+    with _layers_info_lock:
+        if not os.path.exists(LAYERS_INFO_PATH):
+            return {}
+        mtime = os.path.getmtime(LAYERS_INFO_PATH)
+        if _layers_info["mtime"] != mtime:
+            with open(LAYERS_INFO_PATH) as f:
+                _layers_info["layers"] = json.load(f)
+            _layers_info["mtime"] = mtime
+        return _layers_info["layers"]
+
+
+def layer_details(layer):
+    info = load_layers_info().get(layer)
+    if info is None:
+        raise ValueError(f"Unknown layer: {layer}")
+    return info
+
+
+def layer_timesteps(layer, start_date, end_date):
+    # Only the timesteps the layer's TimeExtent actually publishes inside the
+    # requested days; raises ValueError when there are none
+    window_start = pd.Timestamp(start_date)
+    window_end = pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+
+    info = load_layers_info().get(layer)
+    if info is None:
+        # Not in the catalog: fall back to one request per day
+        days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days + 1
+        if days > MAX_TIMESTEPS:
+            raise too_many_timesteps(days, MAX_TIMESTEPS)
+        return pd.date_range(start=start_date, end=end_date, freq="D")
+    if not info.get("TimeExtent"):
+        # Static layer, a single frame is all there is
+        return pd.DatetimeIndex([window_start])
+
+    steps = timesteps(info["TimeExtent"], window_start, window_end)
+    if len(steps) == 0:
+        first, last = extent_bounds(info["TimeExtent"])
+        raise ValueError(
+            f"{layer} has no data between {start_date} and {end_date} "
+            f"(available from {format_time(first)} to {format_time(last)})"
+        )
+    return steps
+
+
+# ------------------------------
+# CACHED FRAME DECODING
+# ------------------------------
+def decoded_frames(layer, bounding_box, time_range, lut, concurrency=DEFAULT_CONCURRENCY, stats=None,
+                   session=None, decode_pool=None, stream=0):
+    # Returns an iterator of (time, grid, error) in date order. Frames go
+    # through the concurrent downloader, which keeps the PNGs in the frame
+    # cache and starts fetching right away, so every layer of a batch
+    # downloads from the start. Only the PNG is cached: a decoded frame is
+    # ten times its size and decoding it again is cheap. With a
+    # FrameDecodePool the decode runs in worker processes and each grid is
+    # only valid until the next one is requested.
+    downloads = download_frames(
+        layer, bounding_box, time_range, size=FRAME_SIZE, image_format=FRAME_FORMAT,
+        concurrency=concurrency, session=session, cache=frame_cache, stats=stats,
+    )
+
+    def sources():
+        # ((time, frame), PNG bytes to decode or None)
+        for time_value in time_range:
+            frame = next(downloads)
+            yield (time_value, frame), frame.content if frame.error is None else None
+
+    def frames():
+        if decode_pool is None:
+            results = decode_inline(sources(), lut)
+        else:
+            results = decode_pool.decode(sources(), stream)
+
+        try:
+            for (time_value, frame), grid, seconds in results:
+                if frame.error is not None:
+                    yield time_value, None, frame.error
+                    continue
+
+                record_decode("wms", seconds, grid.size, stats)
+                yield time_value, grid, None
+        finally:
+            results.close()
+            downloads.close()
+
+    return frames()
+
+
+# ------------------------------
+# REQUEST PARAMETERS
+# ------------------------------
+def parse_layers(data):
+    # Either "layers": [name or {"layer", "metadataHref"}, ...] for a batch,
+    # or the single "layer" / "metadataHref" pair
+    raw = data.get("layers")
+    if raw is None:
+        raw = [{"layer": data.get("layer"), "metadataHref": data.get("metadataHref")}]
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("layers must be a non-empty list")
+    if len(raw) > MAX_BATCH_LAYERS:
+        raise ValueError(f"At most {MAX_BATCH_LAYERS} layers per request")
+
+    layers = []
+    for item in raw:
+        if isinstance(item, str):
+            item = {"layer": item}
+        if not isinstance(item, dict):
+            raise ValueError("each entry in layers must be a layer name or an object")
+
+        name = item.get("layer")
+        if not name:
+            raise ValueError("Missing required parameter: layer")
+        info = load_layers_info().get(name, {})
+        metadata_href = item.get("metadataHref")
+        if not metadata_href and "layers" in data:
+            # Batches may leave the colormap to the catalog
+            metadata_href = info.get("MetadataHref")
+        if not metadata_href and not is_vector_layer(info):
+            raise ValueError(f"Missing required parameter: metadata_href ({name})")
+        layers.append({"layer": name, "metadata_href": metadata_href, "vector": is_vector_layer(info)})
+
+    names = [layer["layer"] for layer in layers]
+    if len(set(names)) != len(names):
+        raise ValueError("layers must not repeat a layer")
+    return layers
+
+
+def parse_request(data):
+    # Raises ValueError/TypeError on malformed input so the route can answer 400
+    # before anything is queued
+    params = {
+        "layers": parse_layers(data),
+        "start_date": data.get("startDate"),
+        "end_date": data.get("endDate"),
+        "lonmin": float(data.get("lonmin")),
+        "latmin": float(data.get("latmin")),
+        "lonmax": float(data.get("lonmax")),
+        "latmax": float(data.get("latmax")),
+        "concurrency": int(data.get("concurrency", DEFAULT_CONCURRENCY)),
+        "mode": data.get("mode", "wms"),
+        "compression": int(data.get("compression", DEFAULT_COMPLEVEL)),
+        "profile": data.get("profile") or None,
+        "aggregation": parse_aggregation(data.get("aggregation")),
+        "format": data.get("format"),
+        "store": data.get("store") or None,
+    }
+    params["layer"] = params["layers"][0]["layer"]
+    params["metadata_href"] = params["layers"][0]["metadata_href"]
+    params["vector"] = any(layer["vector"] for layer in params["layers"])
+
+    if params["profile"] is not None:
+        if not PROFILING_ENABLED:
+            raise ValueError("profiling is disabled on this server (set GIBS_ENABLE_PROFILING=1)")
+        if params["profile"] not in PROFILE_KINDS:
+            raise ValueError(f"profile must be one of {', '.join(PROFILE_KINDS)}")
+
+    if not 0 <= params["compression"] <= 9:
+        raise ValueError("compression must be between 0 (off) and 9")
+
+    if not 1 <= params["concurrency"] <= MAX_CONCURRENCY:
+        raise ValueError(f"concurrency must be between 1 and {MAX_CONCURRENCY}")
+    if params["concurrency"] * len(params["layers"]) > MAX_JOB_CONCURRENCY:
+        raise ValueError(
+            f"concurrency x layers must not exceed {MAX_JOB_CONCURRENCY}; "
+            f"use at most {MAX_JOB_CONCURRENCY // len(params['layers'])} for {len(params['layers'])} layers"
+        )
+
+    if params["vector"]:
+        # Vector tiles are the only source for these layers, whatever mode
+        # the client picked; features go to a table, not a grid
+        if len(params["layers"]) > 1:
+            raise ValueError("Vector layers are extracted one at a time")
+        if params["aggregation"] is not None:
+            raise ValueError("aggregation only applies to raster layers")
+        params["mode"] = "vector"
+        params["format"] = params["format"] or VECTOR_OUTPUT_FORMATS[0]
+        if params["format"] not in VECTOR_OUTPUT_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(VECTOR_OUTPUT_FORMATS)}")
+        pixel_window(
+            (params["lonmin"], params["latmin"], params["lonmax"], params["latmax"]),
+            native_level(layer_details(params["layer"])["TileMatrixSet"]),
+        )
+    else:
+        params["format"] = params["format"] or RASTER_OUTPUT_FORMATS[0]
+        if params["format"] not in RASTER_OUTPUT_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(RASTER_OUTPUT_FORMATS)}")
+        if params["mode"] not in EXTRACTION_MODES:
+            raise ValueError(f"mode must be one of {', '.join(EXTRACTION_MODES)}")
+
+    if params["store"] is not None:
+        if params["format"] != "zarr":
+            raise ValueError("store only applies to the zarr format")
+        if not STORE_NAME_PATTERN.match(str(params["store"])):
+            raise ValueError("store must be 1-64 letters, digits, '-' or '_'")
+        if params["aggregation"] is not None and params["aggregation"]["period"] != "none":
+            raise ValueError("stores are appended per timestep; use aggregation period none")
+
+    if params["mode"] == "wmts":
+        # Layers of a batch have to share one native grid
+        matrix_sets = {layer_details(layer["layer"])["TileMatrixSet"] for layer in params["layers"]}
+        if len(matrix_sets) > 1:
+            raise ValueError(f"wmts batches need layers on one TileMatrixSet, got {', '.join(sorted(matrix_sets))}")
+        # Frames are assembled whole, so their size bounds the job's memory
+        check_window_size(pixel_window(
+            (params["lonmin"], params["latmin"], params["lonmax"], params["latmax"]),
+            native_level(matrix_sets.pop()),
+        ))
+
+    for key in ("start_date", "end_date"):
+        if not params[key]:
+            raise ValueError(f"Missing required parameter: {key}")
+
+    params["start_date"] = pd.Timestamp(params["start_date"]).strftime(DATE_FORMAT)
+    params["end_date"] = pd.Timestamp(params["end_date"]).strftime(DATE_FORMAT)
+    if params["start_date"] > params["end_date"]:
+        raise ValueError("startDate must not be after endDate")
+
+    # One shared time axis: every timestep any of the layers publishes
+    for layer in params["layers"]:
+        layer["timesteps"] = layer_timesteps(layer["layer"], params["start_date"], params["end_date"])
+    params["timesteps"] = params["layers"][0]["timesteps"]
+    for layer in params["layers"][1:]:
+        params["timesteps"] = params["timesteps"].union(layer["timesteps"])
+    if len(params["timesteps"]) > MAX_TIMESTEPS:
+        raise too_many_timesteps(len(params["timesteps"]), MAX_TIMESTEPS)
+
+    return params
+
+
+# ------------------------------
+# EXTRACTION PIPELINE
+# ------------------------------
+def run_extraction(job):
+    # Runs the extraction with per-job stats, optional profiling and one
+    # structured log record however the job ends
+    params = job.params
+    job.stats = JobStats()
+    started = time.time()
+    record = {
+        "jobId": job.id,
+        "layers": [layer["layer"] for layer in params["layers"]],
+        "mode": params["mode"],
+        "format": params["format"],
+        "startDate": params["start_date"],
+        "endDate": params["end_date"],
+        "bbox": [params["lonmin"], params["latmin"], params["lonmax"], params["latmax"]],
+        "timesteps": len(params["timesteps"]),
+        "status": "failed",
+        "error": None,
+        "profile": None,
+    }
+
+    try:
+        with profiled(params.get("profile"), job.id) as profile_path:
+            record["profile"] = profile_path
+            result = extract_vector_layer(job, job.stats) if params["vector"] else extract(job, job.stats)
+        record["status"] = "finished"
+        record["missingDates"] = len(result["missingDates"])
+        return result
+    except JobCancelled:
+        record["status"] = "cancelled"
+        raise
+    except Exception as e:
+        record["error"] = str(e)
+        raise
+    finally:
+        record["seconds"] = round(time.time() - started, 3)
+        record["stats"] = job.stats.to_dict()
+        log_job(record)
+
+
+def output_stem(job, suffix=""):
+    params = job.params
+    safe_layer = "".join(c if c.isalnum() or c in "-_" else "_" for c in params["layer"])
+    return f"{safe_layer}{suffix}_{params['start_date']}_{params['end_date']}_{job.id[:8]}"
+
+
+def extract_vector_layer(job, stats):
+    # Point features of an MVT layer, streamed into a GeoParquet file or a
+    # NetCDF point table
+    params = job.params
+    layer_info = layer_details(params["layer"])
+    print(params["layer"], params["start_date"], params["end_date"],
+          params["lonmin"], params["latmin"], params["lonmax"], params["latmax"])
+
+    scratch_directory = job_directory(job.id)
+    os.makedirs(scratch_directory, exist_ok=True)
+    filename = output_stem(job) + (".nc" if params["format"] == "netcdf" else ".parquet")
+    path = os.path.join(scratch_directory, filename)
+    partial_path = path + ".part"
+
+    try:
+        result = extract_vector(job, stats, layer_info, partial_path, cache=frame_cache)
+        if len(result["missingDates"]) == len(params["timesteps"]):
+            raise RuntimeError("Failed to download any tiles")
+        os.replace(partial_path, path)
+        record_file(os.path.getsize(path), stats)
+        print(f"{result['features']} features written to {filename}")
+    except BaseException:
+        remove_job_directory(job.id)
+        raise
+
+    return {"file": filename, **result}
+
+
+def variable_name(layer, layer_count):
+    # A single layer keeps the original "value" variable
+    if layer_count == 1:
+        return "value"
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in layer)
+
+
+def extract(job, stats):
+    params = job.params
+    layers = params["layers"]
+
+    lonmin, latmin = params["lonmin"], params["latmin"]
+    lonmax, latmax = params["lonmax"], params["latmax"]
+    bounding_box = (lonmin, latmin, lonmax, latmax)
+
+    print(", ".join(layer["layer"] for layer in layers), params["start_date"], params["end_date"], *bounding_box)
+
+    # ------------------------------
+    # COMPILED COLORMAPS
+    # ------------------------------
+    # The registry compiles each colormap once and shares it between layers
+    variables = {}
+    for layer in layers:
+        colormap = colormap_registry.get(layer["metadata_href"])
+        layer["lut"] = colormap.lut
+        layer["variable"] = variable_name(layer["layer"], len(layers))
+        variables[layer["variable"]] = {"units": colormap.units, "long_name": colormap.title,
+                                        "gibs_layer": layer["layer"]}
+        print(f"{layer['layer']}: {colormap.title} ({colormap.units})")
+
+    scratch_directory = job_directory(job.id)
+    os.makedirs(scratch_directory, exist_ok=True)
+
+    suffix = f"_plus{len(layers) - 1}" if len(layers) > 1 else ""
+    aggregation = params.get("aggregation")
+    if aggregation is not None:
+        suffix += f"_{aggregation['period']}" + (f"_x{aggregation['factor']}" if aggregation["factor"] > 1 else "")
+    stem = output_stem(job, suffix)
+    output_format = params["format"]
+    # Zarr stores and GeoTIFF sets are handed out as one zip
+    filename = stem + {"netcdf": ".nc", "zarr": ".zarr.zip", "cog": "_cog.zip"}[output_format]
+    path = os.path.join(scratch_directory, filename)
+    partial_path = path + ".part"
+    store_path = None
+    held_lock = None
+    time_range = params["timesteps"]
+
+    try:
+        if params["store"] is not None:
+            # Appending to a named store: wait for any other job on it, then
+            # only fetch the timesteps after its last one
+            store_path = os.path.join(STORES_DIRECTORY, f"{params['store']}.zarr")
+            lock = store_lock(store_path)
+            while not lock.acquire(timeout=1):
+                job.check_cancelled()
+            held_lock = lock
+
+            last_time = last_store_time(store_path)
+            if last_time is not None:
+                time_range = time_range[[encode_time(t) > last_time for t in time_range]]
+                for layer in layers:
+                    layer["timesteps"] = layer["timesteps"][[t in time_range for t in layer["timesteps"]]]
+            if time_range.empty:
+                print(f"{params['store']} is already up to date")
+                return {"file": None, "store": f"{params['store']}.zarr", "appended": 0,
+                        "missingDates": [], "missingByLayer": {layer["layer"]: [] for layer in layers}}
+
+        # ------------------------------
+        # OUTPUT GRID
+        # ------------------------------
+        # With an aggregation, frames are folded into running accumulators
+        # and only the reduced bins are written. NetCDF, Zarr and GeoTIFF
+        # writers take the same grids.
+        if params["mode"] == "wmts":
+            layer_infos = [layer_details(layer["layer"]) for layer in layers]
+            window = pixel_window(bounding_box, native_level(layer_infos[-1]["TileMatrixSet"]))
+            grid_bbox = window.bbox
+            grid_shape = window.shape
+        else:
+            grid_bbox = bounding_box
+            grid_shape = (FRAME_SIZE[1], FRAME_SIZE[0])
+
+        aggregator = None
+        output_variables = variables
+        factor = 1
+        if aggregation is not None:
+            classes = {}
+            for layer in layers:
+                values = layer["lut"][1]
+                classes[layer["variable"]] = np.unique(values[~np.isnan(values)])
+            aggregator = Aggregator(aggregation, variables, classes, time_range[0])
+            aggregator.check_memory(grid_shape)
+            output_variables = aggregator.output_variables()
+            factor = aggregation["factor"]
+
+        height, width = grid_shape
+        lats, lons = frame_coordinates(grid_bbox, width, height)
+        if aggregator is not None:
+            lats, lons = block_coordinates(lats, lons, factor)
+        if store_path is not None:
+            # A store on another grid or with other variables fails now,
+            # not after the first frame has been downloaded
+            check_store(store_path, lats, lons, output_variables)
+
+        # ------------------------------
+        # DOWNLOAD + DECODE FRAMES
+        # ------------------------------
+        # Every layer streams its own timesteps concurrently over one shared
+        # session; the loop below lines them up on the shared time axis
+        frame_count = sum(len(layer["timesteps"]) for layer in layers)
+        job.update("download", done=0, total=frame_count)
+        job.update("decode", done=0, total=frame_count)
+        job.update("write", done=0, total=len(time_range))
+        failed_dates = {layer["layer"]: [] for layer in layers}
+        decode_pool = None
+        frame_sources = []
+        session = create_session(params["concurrency"] * len(layers))
+
+        if params["mode"] == "wmts":
+            for layer, layer_info in zip(layers, layer_infos):
+                frame_sources.append(native_frames(
+                    session, layer_info, bounding_box, layer["timesteps"], layer["lut"],
+                    concurrency=params["concurrency"], cache=frame_cache, stats=stats,
+                ))
+        else:
+            if frame_count > 1:
+                # None when this job decodes inline (no pool, or no memory
+                # left in the shared budget)
+                decode_pool = frame_decode_pool(
+                    scratch_directory, (FRAME_SIZE[1], FRAME_SIZE[0]), [layer["lut"] for layer in layers],
+                    frames=max(len(layer["timesteps"]) for layer in layers),
+                )
+            for stream, layer in enumerate(layers):
+                frame_sources.append(decoded_frames(
+                    layer["layer"], bounding_box, layer["timesteps"], layer["lut"],
+                    concurrency=params["concurrency"], stats=stats, session=session,
+                    decode_pool=decode_pool, stream=stream,
+                ))
+
+        # ------------------------------
+        # STREAM FRAMES INTO THE OUTPUT
+        # ------------------------------
+        layer_times = [set(layer["timesteps"]) for layer in layers]
+        writer = None
+        appended = 0
+
+        def write(time_value, grids):
+            nonlocal writer, appended
+            if writer is None:
+                if output_format == "zarr":
+                    writer = ZarrWriter(
+                        store_path or os.path.join(scratch_directory, stem + ".zarr"), lats, lons, output_variables,
+                        complevel=params["compression"],
+                    )
+                elif output_format == "cog":
+                    writer = COGWriter(
+                        scratch_directory, stem, grid_transform(grid_bbox, grid_shape, factor), output_variables,
+                        complevel=params["compression"],
+                    )
+                else:
+                    writer = NetCDFWriter(partial_path, lats, lons, output_variables, complevel=params["compression"])
+
+            append_started = time.perf_counter()
+            writer.append(time_value, grids)
+            record_append(time.perf_counter() - append_started, stats)
+            appended += 1
+
+        try:
+            for time_value in time_range:
+                grids = {}
+                for layer, times, frame_source in zip(layers, layer_times, frame_sources):
+                    if time_value not in times:
+                        continue
+                    _, grid, error = next(frame_source)
+                    job.check_cancelled()
+                    job.advance("download")
+                    job.advance("decode")
+
+                    if error is not None:
+                        time_str = format_time(time_value)
+                        print(f"Failed to download {layer['layer']} for {time_str}: {error}")
+                        failed_dates[layer["layer"]].append(time_str)
+                        continue
+                    grids[layer["variable"]] = grid[::-1]
+
+                if grids and aggregator is not None:
+                    for bin_time, outputs in aggregator.add(time_value, grids):
+                        write(bin_time, outputs)
+                elif grids:
+                    write(time_value, grids)
+                job.advance("write")
+
+            if aggregator is not None:
+                for bin_time, outputs in aggregator.finish():
+                    write(bin_time, outputs)
+        finally:
+            for frame_source in frame_sources:
+                frame_source.close()
+            session.close()
+            if decode_pool is not None:
+                decode_pool.close()
+            if writer is not None:
+                writer.close()
+
+        if writer is None:
+            raise RuntimeError("Failed to download any images")
+
+        result = {"file": filename}
+        if store_path is not None:
+            result = {"file": None, "store": f"{params['store']}.zarr", "appended": appended}
+            print(f"{appended} timesteps appended to {store_path}")
+        else:
+            if output_format == "zarr":
+                zip_store(writer.path, partial_path)
+            elif output_format == "cog":
+                zip_files(scratch_directory, writer.files, partial_path)
+                result["files"] = writer.files
+            os.replace(partial_path, path)
+            record_file(os.path.getsize(path), stats)
+            print(f"{filename} created successfully")
+
+    except BaseException:
+        remove_job_directory(job.id)
+        raise
+    finally:
+        if held_lock is not None:
+            held_lock.release()
+
+    result["missingDates"] = sorted({time_str for dates in failed_dates.values() for time_str in dates})
+    result["missingByLayer"] = failed_dates
+    return result
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+
+RAW_SUFFIX = ".raw"
+# Decoded arrays cached by earlier versions; dropped when the index is built
+ARRAY_SUFFIX = ".npy"
+
+
+# ------------------------------
+# CACHE KEYS
+# ------------------------------
+def frame_key(layer, time_str, bbox, size, image_format):
+    parts = [layer, time_str, ",".join(repr(float(v)) for v in bbox), "x".join(map(str, size)), image_format]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def tile_key(layer, time_str, matrix_set, level, row, col):
+    parts = [layer, time_str, matrix_set, str(level), str(row), str(col)]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+# ------------------------------
+# FRAME CACHE
+# ------------------------------
+class FrameCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        # Rebuild the LRU order from file mtimes, which are bumped on every hit
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith((".tmp", ARRAY_SUFFIX)):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+
+        self._evict()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name[:2], name)
+
+    def _lookup(self, name):
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+
+        path = self._path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._discard(name)
+            return None
+        return path
+
+    def _store(self, name, write):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._discard(name)
+            self._entries[name] = size
+            self._total_bytes += size
+            self._evict()
+
+    def _discard(self, name):
+        size = self._entries.pop(name, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self):
+        # Called with the lock held; the newest entry is never evicted
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    # ------------------------------
+    # RAW FRAME BYTES
+    # ------------------------------
+    def get_bytes(self, key):
+        path = self._lookup(key + RAW_SUFFIX)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put_bytes(self, key, content):
+        def write(path):
+            with open(path, "wb") as f:
+                f.write(content)
+
+        self._store(key + RAW_SUFFIX, write)
+
+    def get_or_fetch(self, key, fetch):
+        # Concurrent callers asking for the same missing key share one fetch
+        content = self.get_bytes(key)
+        if content is not None:
+            return content
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            content = fetch()
+            self.put_bytes(key, content)
+            future.set_result(content)
+            return content
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    # ------------------------------
+    # STATS
+    # ------------------------------
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / lookups if lookups else None,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "maxBytes": self.max_bytes,
+            }
@@ -0,0 +1,185 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import NamedTuple, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from frame_cache import frame_key
+from metrics import record_download
+from time_extent import format_time
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+WMS_URL = "https://gibs.earthdata.nasa.gov/wms/epsg4326/best/wms.cgi"
+
+DEFAULT_CONCURRENCY = 8
+# Upper bound on client-supplied concurrency: one thread and one pooled
+# connection per unit
+MAX_CONCURRENCY = 32
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 0.5
+REQUEST_TIMEOUT = 60
+
+
+class Frame(NamedTuple):
+    time: object
+    content: Optional[bytes]
+    error: Optional[str]
+
+
+# ------------------------------
+# HTTP SESSION
+# ------------------------------
+def create_session(concurrency=DEFAULT_CONCURRENCY):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_with_retries(session, url, params=None, headers=None,
+                       max_retries=MAX_RETRIES, backoff=BACKOFF_SECONDS, timeout=REQUEST_TIMEOUT):
+    # Retries 5xx responses, timeouts and dropped connections with exponential
+    # backoff; 4xx responses are raised straight away
+    for attempt in range(max_retries + 1):
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=timeout)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            error = e
+        else:
+            if response.status_code < 500:
+                response.raise_for_status()
+                return response
+            error = requests.HTTPError(
+                f"{response.status_code} Server Error for url: {response.url}", response=response
+            )
+
+        if attempt < max_retries:
+            time.sleep(backoff * 2 ** attempt)
+
+    raise error
+
+
+# ------------------------------
+# ORDERED CONCURRENT MAP
+# ------------------------------
+def ordered_map(func, items, concurrency=DEFAULT_CONCURRENCY):
+    # Like executor.map, but keeps at most 2 * concurrency results buffered so
+    # a slow consumer does not pile up every downloaded frame in memory. The
+    # first window is submitted right away, not on the first next(), so maps
+    # created together (one per layer of a batch) fetch together.
+    return OrderedResults(func, items, concurrency)
+
+
+class OrderedResults:
+    def __init__(self, func, items, concurrency):
+        self._func = func
+        self._items = iter(items)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._pending = deque()
+        for item in islice(self._items, max(1, concurrency * 2)):
+            self._pending.append(self._executor.submit(func, item))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._pending:
+            self.close()
+            raise StopIteration
+        try:
+            result = self._pending.popleft().result()
+            for item in islice(self._items, 1):
+                self._pending.append(self._executor.submit(self._func, item))
+        except BaseException:
+            self.close()
+            raise
+        return result
+
+    def close(self, wait=True):
+        # Cancels what has not started; unlike a generator's, this works
+        # before the first next() too
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=wait)
+
+    def __del__(self):
+        self.close(wait=False)
+
+
+# ------------------------------
+# WMS FRAMES
+# ------------------------------
+def getmap_params(layer, bbox, time_str, size, image_format):
+    return {
+        "SERVICE": "WMS",
+        "REQUEST": "GetMap",
+        "VERSION": "1.1.1",
+        "LAYERS": layer,
+        "STYLES": "",
+        "SRS": "EPSG:4326",
+        "BBOX": ",".join(str(v) for v in bbox),
+        "WIDTH": size[0],
+        "HEIGHT": size[1],
+        "FORMAT": image_format,
+        "TRANSPARENT": "TRUE",
+        "TIME": time_str,
+    }
+
+
+def download_frame(session, layer, bbox, time_str, size=(2000, 2000), image_format="image/png", url=WMS_URL,
+                   stats=None):
+    params = getmap_params(layer, bbox, time_str, size, image_format)
+    started = time.perf_counter()
+    response = fetch_with_retries(session, url, params=params)
+
+    # GIBS reports WMS errors as a 200 with an XML ServiceException body
+    content_type = response.headers.get("Content-Type", "")
+    if not content_type.startswith("image/"):
+        raise ValueError(f"WMS returned {content_type or 'no content type'}: {response.text[:200]}")
+
+    record_download("wms", time.perf_counter() - started, len(response.content), stats)
+    return response.content
+
+
+def download_frames(layer, bbox, time_range, size=(2000, 2000), image_format="image/png",
+                    concurrency=DEFAULT_CONCURRENCY, session=None, url=WMS_URL, cache=None, stats=None):
+    # Returns an iterator of one Frame per time value, in the order of
+    # time_range; the first downloads start before it is iterated. Failed
+    # dates come back with error set instead of aborting the whole download.
+    # Only real network fetches are recorded in stats, cache hits are not.
+    own_session = session is None
+    if own_session:
+        session = create_session(concurrency)
+
+    def fetch(time_value):
+        time_str = format_time(time_value)
+        try:
+            def get():
+                return download_frame(session, layer, bbox, time_str, size, image_format, url, stats)
+
+            if cache is None:
+                content = get()
+            else:
+                content = cache.get_or_fetch(frame_key(layer, time_str, bbox, size, image_format), get)
+            return Frame(time_value, content, None)
+        except Exception as e:
+            return Frame(time_value, None, str(e))
+
+    frames = ordered_map(fetch, time_range, concurrency)
+    if not own_session:
+        return frames
+
+    def closing():
+        try:
+            yield from frames
+        finally:
+            frames.close()
+            session.close()
+
+    return closing()
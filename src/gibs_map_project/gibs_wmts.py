@@ -1,9 +1,10 @@
 import os
-from io import BytesIO
-import requests
 import json
-import urllib.request
-from owslib.wms import WebMapService
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
 import lxml.etree as xmltree
 
 # ------------------------------
@@ -15,98 +16,263 @@ XLINK_NAMESPACE = "{http://www.w3.org/1999/xlink}"
 
 # Where the JSON files should go
 LAYERS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "layers"))
-os.makedirs(LAYERS_DIR, exist_ok=True)
+LAYERS_INFO_PATH = os.path.join(LAYERS_DIR, "layers_info.json")
+ALL_LAYERS_PATH = os.path.join(LAYERS_DIR, "all_layers.json")
+
+# Conditional GET state and vector metadata cache
+CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../data/cache/wmts"))
+CAPABILITIES_STATE_PATH = os.path.join(CACHE_DIR, "capabilities_state.json")
+VECTOR_METADATA_DIR = os.path.join(CACHE_DIR, "vector_metadata")
 
 # WMTS capabilities URL
 WMTS_URL = 'http://gibs.earthdata.nasa.gov/wmts/epsg4326/best/wmts.cgi?SERVICE=WMTS&REQUEST=GetCapabilities'
 
+VECTOR_METADATA_CONCURRENCY = 8
+VECTOR_METADATA_MAX_AGE = 7 * 24 * 3600
+REQUEST_TIMEOUT = 120
+
+
 # ------------------------------
-# FETCH WMTS CAPABILITIES
+# JSON HELPERS
 # ------------------------------
-response = requests.get(WMTS_URL)
-wmts_tree = xmltree.fromstring(response.content)
+def read_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    # Write next to the target and rename, so readers never see half a file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
 
-all_layers = []
-layer_info = {}
 
 # ------------------------------
-# PARSE CAPABILITIES
+# PARSE ONE LAYER
 # ------------------------------
-for child in wmts_tree.iter():
-    for layer in child.findall(f"./{WMTS_NAMESPACE}Layer"):
-        if f"{WMTS_NAMESPACE}Layer" == layer.tag:
-            layer_data = {}
-            layer_identifier = layer.find(f"{OWS_NAMESPACE}Identifier")
-            if layer_identifier is not None:
-                layer_name = layer_identifier.text
-                all_layers.append(layer_name)
-                layer_data['Layer'] = layer_name
-
-                bounding_box_element = layer.find(f"{OWS_NAMESPACE}WGS84BoundingBox")
-                if bounding_box_element is not None:
-                    layer_data['BoundingBox'] = {
-                        'crs': bounding_box_element.get('crs'),
-                        'UpperCorner': bounding_box_element.find(f"{OWS_NAMESPACE}UpperCorner").text,
-                        'LowerCorner': bounding_box_element.find(f"{OWS_NAMESPACE}LowerCorner").text
-                    }
-
-                tile_matrix_set_element = layer.find(f"{WMTS_NAMESPACE}TileMatrixSetLink")
-                if tile_matrix_set_element is not None:
-                    layer_data['TileMatrixSet'] = tile_matrix_set_element.find(f"{WMTS_NAMESPACE}TileMatrixSet").text
-
-                time_extent_element = layer.find(f"{WMTS_NAMESPACE}Dimension")
-                if time_extent_element is not None:
-                    time_extent = []
-                    time_values = time_extent_element.findall(f"{WMTS_NAMESPACE}Value")
-                    if time_values is not None:
-                        for value in time_values:
-                            time_extent.append(value.text)
-                        layer_data['TimeExtent'] = time_extent
-
-                format_element = layer.find(f"{WMTS_NAMESPACE}Format")
-                if format_element is not None:
-                    layer_data['Format'] = format_element.text
-
-                style_element = layer.find(f"{WMTS_NAMESPACE}Style")
-                if style_element is not None:
-                    style_identifier = style_element.find(f"{OWS_NAMESPACE}Identifier")
-                    if style_identifier is not None:
-                        layer_data['Style'] = style_identifier.text
-
-                    legend_urls = style_element.findall(f"{WMTS_NAMESPACE}LegendURL")
-                    for legend_url in legend_urls:
-                        if legend_url.get(f"{XLINK_NAMESPACE}role") == 'http://earthdata.nasa.gov/gibs/legend-type/horizontal':
-                            layer_data['HorizontalLegendHref'] = legend_url.get(f"{XLINK_NAMESPACE}href")
-
-                resource_url_element = layer.find(f"{WMTS_NAMESPACE}ResourceURL")
-                if resource_url_element is not None:
-                    layer_data['Template'] = resource_url_element.get('template')
-
-                for metadata_element in layer.findall(f"{OWS_NAMESPACE}Metadata"):
-                    if "vector-metadata" in metadata_element.get(f"{XLINK_NAMESPACE}href"):
-                        vector_metadata_url = metadata_element.get(f"{XLINK_NAMESPACE}href")
-                        layer_data['VectorMetadata'] = vector_metadata_url
-
-                        response = urllib.request.urlopen(vector_metadata_url)
-                        data = json.loads(response.read())
-                        layer_data['VectorProperties'] = data['mvt_properties']
-                        break
-
-                # Last Metadata xlink:href
-                last_metadata_href = None
-                for metadata_element in reversed(list(layer.findall(f"{OWS_NAMESPACE}Metadata"))):
-                    last_metadata_href = metadata_element.get(f"{XLINK_NAMESPACE}href")
-                    break
-                if last_metadata_href:
-                    layer_data['MetadataHref'] = last_metadata_href
-
-                layer_info[layer_name] = layer_data
+def parse_layer(layer):
+    layer_identifier = layer.find(f"{OWS_NAMESPACE}Identifier")
+    if layer_identifier is None:
+        return None
+
+    layer_name = layer_identifier.text
+    layer_data = {'Layer': layer_name}
+
+    bounding_box_element = layer.find(f"{OWS_NAMESPACE}WGS84BoundingBox")
+    if bounding_box_element is not None:
+        layer_data['BoundingBox'] = {
+            'crs': bounding_box_element.get('crs'),
+            'UpperCorner': bounding_box_element.find(f"{OWS_NAMESPACE}UpperCorner").text,
+            'LowerCorner': bounding_box_element.find(f"{OWS_NAMESPACE}LowerCorner").text
+        }
+
+    tile_matrix_set_element = layer.find(f"{WMTS_NAMESPACE}TileMatrixSetLink")
+    if tile_matrix_set_element is not None:
+        layer_data['TileMatrixSet'] = tile_matrix_set_element.find(f"{WMTS_NAMESPACE}TileMatrixSet").text
+
+    time_extent_element = layer.find(f"{WMTS_NAMESPACE}Dimension")
+    if time_extent_element is not None:
+        time_values = time_extent_element.findall(f"{WMTS_NAMESPACE}Value")
+        layer_data['TimeExtent'] = [value.text for value in time_values]
+
+    format_element = layer.find(f"{WMTS_NAMESPACE}Format")
+    if format_element is not None:
+        layer_data['Format'] = format_element.text
+
+    style_element = layer.find(f"{WMTS_NAMESPACE}Style")
+    if style_element is not None:
+        style_identifier = style_element.find(f"{OWS_NAMESPACE}Identifier")
+        if style_identifier is not None:
+            layer_data['Style'] = style_identifier.text
+
+        legend_urls = style_element.findall(f"{WMTS_NAMESPACE}LegendURL")
+        for legend_url in legend_urls:
+            if legend_url.get(f"{XLINK_NAMESPACE}role") == 'http://earthdata.nasa.gov/gibs/legend-type/horizontal':
+                layer_data['HorizontalLegendHref'] = legend_url.get(f"{XLINK_NAMESPACE}href")
+
+    resource_url_element = layer.find(f"{WMTS_NAMESPACE}ResourceURL")
+    if resource_url_element is not None:
+        layer_data['Template'] = resource_url_element.get('template')
+
+    metadata_hrefs = [m.get(f"{XLINK_NAMESPACE}href") for m in layer.findall(f"{OWS_NAMESPACE}Metadata")]
+    metadata_hrefs = [href for href in metadata_hrefs if href]
+
+    for href in metadata_hrefs:
+        if "vector-metadata" in href:
+            layer_data['VectorMetadata'] = href
+            # Filled in once all vector metadata has been fetched
+            layer_data['VectorProperties'] = None
+            break
+
+    # Last Metadata xlink:href
+    if metadata_hrefs:
+        layer_data['MetadataHref'] = metadata_hrefs[-1]
+
+    return layer_data
+
 
 # ------------------------------
-# SAVE JSON FILES TO LAYERS FOLDER
+# STREAMING CAPABILITIES PARSE
 # ------------------------------
-with open(os.path.join(LAYERS_DIR, 'layers_info.json'), 'w') as f:
-    json.dump(layer_info, f, indent=4)
+def iter_layers(source):
+    # iterparse keeps only the current Layer in memory: each one is cleared
+    # once parsed, together with the siblings already handled before it
+    context = xmltree.iterparse(
+        source, events=("end",), tag=(f"{WMTS_NAMESPACE}Layer", f"{WMTS_NAMESPACE}TileMatrixSet")
+    )
+    for _, element in context:
+        if element.tag == f"{WMTS_NAMESPACE}Layer":
+            layer_data = parse_layer(element)
+            if layer_data is not None:
+                yield layer_data
+        elif element.getparent().tag != f"{WMTS_NAMESPACE}Contents":
+            # TileMatrixSet reference inside a Layer's TileMatrixSetLink
+            continue
+
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+# ------------------------------
+# VECTOR METADATA
+# ------------------------------
+def fetch_vector_properties(session, url):
+    # Cached per URL; revalidated with the stored ETag once it is older than
+    # VECTOR_METADATA_MAX_AGE
+    cache_path = os.path.join(VECTOR_METADATA_DIR, hashlib.sha256(url.encode()).hexdigest() + ".json")
+    cached = read_json(cache_path)
+    if cached is not None and time.time() - cached["fetched"] < VECTOR_METADATA_MAX_AGE:
+        return cached["mvt_properties"]
+
+    headers = {}
+    if cached is not None and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+
+    response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304:
+        cached["fetched"] = time.time()
+        write_json(cache_path, cached)
+        return cached["mvt_properties"]
+
+    response.raise_for_status()
+    properties = response.json()['mvt_properties']
+    write_json(cache_path, {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "fetched": time.time(),
+        "mvt_properties": properties,
+    })
+    return properties
+
+
+def fill_vector_properties(session, layer_info, previous_info, concurrency=VECTOR_METADATA_CONCURRENCY):
+    vector_layers = [data for data in layer_info.values() if 'VectorMetadata' in data]
+
+    def fetch(layer_data):
+        try:
+            return fetch_vector_properties(session, layer_data['VectorMetadata'])
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Failed to fetch vector metadata for {layer_data['Layer']}: {e}")
+            return previous_info.get(layer_data['Layer'], {}).get('VectorProperties')
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for layer_data, properties in zip(vector_layers, executor.map(fetch, vector_layers)):
+            if properties is None:
+                del layer_data['VectorProperties']
+            else:
+                layer_data['VectorProperties'] = properties
+
+
+# ------------------------------
+# DIFF-BASED UPDATE
+# ------------------------------
+def diff_layers(old_info, new_info):
+    return {
+        'added': [name for name in new_info if name not in old_info],
+        'removed': [name for name in old_info if name not in new_info],
+        'changed': [name for name in new_info if name in old_info and old_info[name] != new_info[name]],
+    }
+
+
+def merge_layers(old_info, new_info):
+    # Keep the existing order for layers that are still published, append new
+    # ones at the end
+    merged = {name: new_info[name] for name in old_info if name in new_info}
+    for name, data in new_info.items():
+        if name not in merged:
+            merged[name] = data
+    return merged
+
+
+# ------------------------------
+# REFRESH JOB
+# ------------------------------
+def refresh_capabilities(url=WMTS_URL, force=False, concurrency=VECTOR_METADATA_CONCURRENCY):
+    os.makedirs(LAYERS_DIR, exist_ok=True)
+    os.makedirs(VECTOR_METADATA_DIR, exist_ok=True)
+
+    previous_info = read_json(LAYERS_INFO_PATH, {})
+    previous_all_layers = read_json(ALL_LAYERS_PATH)
+    state = read_json(CAPABILITIES_STATE_PATH, {})
+
+    headers = {}
+    if not force and previous_info and previous_all_layers is not None and state.get('url') == url:
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('lastModified'):
+            headers['If-Modified-Since'] = state['lastModified']
+
+    session = requests.Session()
+    start = time.time()
+
+    with session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code == 304:
+            print("WMTS capabilities unchanged, layers JSON is up to date")
+            return {'added': [], 'removed': [], 'changed': [], 'unchanged': True}
+        response.raise_for_status()
+
+        response.raw.decode_content = True
+        layer_info = {}
+        all_layers = []
+        for layer_data in iter_layers(response.raw):
+            all_layers.append(layer_data['Layer'])
+            layer_info[layer_data['Layer']] = layer_data
+
+        new_state = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'lastModified': response.headers.get('Last-Modified'),
+        }
+
+    fill_vector_properties(session, layer_info, previous_info, concurrency)
+    session.close()
+
+    # ------------------------------
+    # SAVE JSON FILES TO LAYERS FOLDER
+    # ------------------------------
+    diff = diff_layers(previous_info, layer_info)
+    if diff['added'] or diff['removed'] or diff['changed']:
+        write_json(LAYERS_INFO_PATH, merge_layers(previous_info, layer_info))
+    if all_layers != previous_all_layers:
+        write_json(ALL_LAYERS_PATH, all_layers)
+    write_json(CAPABILITIES_STATE_PATH, new_state)
+
+    print(
+        f"Parsed {len(layer_info)} layers in {time.time() - start:.1f}s: "
+        f"{len(diff['added'])} added, {len(diff['removed'])} removed, {len(diff['changed'])} changed"
+    )
+    diff['unchanged'] = False
+    return diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh layers JSON from the GIBS WMTS capabilities")
+    parser.add_argument("--force", action="store_true", help="ignore the stored ETag and re-download")
+    args = parser.parse_args()
 
-with open(os.path.join(LAYERS_DIR, 'all_layers.json'), 'w') as f:
-    json.dump(all_layers, f, indent=4)
+    refresh_capabilities(force=args.force)
@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+JOB_WORKERS = 2
+JOB_QUEUE_SIZE = 16
+JOB_RETENTION_SECONDS = 24 * 3600
+# How long cancelled jobs get to reach their next check_cancelled() at shutdown
+CANCEL_GRACE_SECONDS = 30
+
+STAGES = ("download", "decode", "write")
+FINAL_STATES = ("finished", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+# ------------------------------
+# JOB
+# ------------------------------
+class Job:
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = "queued"
+        self.progress = {stage: {"done": 0, "total": 0} for stage in STAGES}
+        self.result = None
+        self.error = None
+        self.stats = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+        self._cancel_event = threading.Event()
+        self._changed = threading.Condition()
+        self.version = 0
+
+    def _notify(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def set_status(self, status, error=None):
+        self.status = status
+        self.error = error
+        if status == "running":
+            self.started = time.time()
+        elif status in FINAL_STATES:
+            self.finished = time.time()
+        self._notify()
+
+    def update(self, stage, done=None, total=None):
+        if total is not None:
+            self.progress[stage]["total"] = total
+        if done is not None:
+            self.progress[stage]["done"] = done
+        self._notify()
+
+    def advance(self, stage, step=1):
+        self.progress[stage]["done"] += step
+        self._notify()
+
+    def cancel(self):
+        self._cancel_event.set()
+        self._notify()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def wait_for_change(self, version, timeout=None):
+        with self._changed:
+            if self.version == version:
+                self._changed.wait(timeout)
+            return self.version
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "progress": {stage: dict(counts) for stage, counts in self.progress.items()},
+            "result": self.result,
+            "error": self.error,
+            "stats": self.stats.to_dict() if self.stats is not None else None,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+# ------------------------------
+# JOB MANAGER
+# ------------------------------
+class JobManager:
+    def __init__(self, runner, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE, on_remove=None):
+        self._runner = runner
+        self._on_remove = on_remove
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.accepting = True
+
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, params):
+        if not self.accepting:
+            raise QueueFull("Server is shutting down, not accepting new jobs")
+        self._prune()
+
+        job = Job(params)
+        with self._lock:
+            self._jobs[job.id] = job
+
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull(f"Job queue is full ({self._queue.maxsize} jobs waiting)")
+
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.status not in FINAL_STATES:
+            job.cancel()
+            if job.status == "queued":
+                job.set_status("cancelled")
+        return job
+
+    def active(self):
+        # Jobs still queued or running
+        with self._lock:
+            return [job for job in self._jobs.values() if job.status not in FINAL_STATES]
+
+    def healthy(self):
+        return all(thread.is_alive() for thread in self._threads)
+
+    def drain(self, timeout=None, poll=0.5):
+        # Stops taking new jobs and waits for queued and running ones to end.
+        # Whatever is left after timeout is cancelled and given
+        # CANCEL_GRACE_SECONDS to stop. Returns the jobs that had to be cancelled.
+        self.accepting = False
+        deadline = None if timeout is None else time.time() + timeout
+        while self.active() and (deadline is None or time.time() < deadline):
+            time.sleep(poll)
+
+        cancelled = self.active()
+        for job in cancelled:
+            self.cancel(job.id)
+        grace_deadline = time.time() + CANCEL_GRACE_SECONDS
+        while self.active() and time.time() < grace_deadline:
+            time.sleep(poll)
+        return cancelled
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        with self._lock:
+            expired = [j for j in self._jobs.values() if j.finished and j.finished < cutoff]
+            for job in expired:
+                del self._jobs[job.id]
+
+        if self._on_remove is not None:
+            for job in expired:
+                self._on_remove(job)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job.cancelled:
+                    continue
+
+                job.set_status("running")
+                try:
+                    job.result = self._runner(job)
+                except JobCancelled:
+                    job.set_status("cancelled")
+                except Exception as e:
+                    traceback.print_exc()
+                    job.set_status("failed", error=str(e))
+                else:
+                    job.set_status("finished")
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,244 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+
+import pandas as pd
+
+from time_extent import parse_time_extent, interval_timesteps
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EPOCH = pd.Timestamp("1970-01-01")
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE layers (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    format TEXT,
+    tile_matrix_set TEXT,
+    lonmin REAL, latmin REAL, lonmax REAL, latmax REAL,
+    time_start REAL, time_end REAL,
+    detail TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE layers_fts USING fts5(name, content='layers', content_rowid='id');
+-- One row per TimeExtent interval, in days since EPOCH
+CREATE VIRTUAL TABLE layer_times USING rtree(id, day_start, day_end, +layer_id INTEGER, +extent TEXT);
+CREATE VIRTUAL TABLE layer_boxes USING rtree(id, lonmin, lonmax, latmin, latmax);
+"""
+
+
+class CatalogUnavailable(Exception):
+    pass
+
+
+def epoch_days(timestamp):
+    return (pd.Timestamp(timestamp) - EPOCH) / pd.Timedelta(days=1)
+
+
+def parse_bbox(layer_data):
+    bounding_box = layer_data.get("BoundingBox")
+    if not bounding_box:
+        return None
+    lonmin, latmin = map(float, bounding_box["LowerCorner"].split())
+    lonmax, latmax = map(float, bounding_box["UpperCorner"].split())
+    return lonmin, latmin, lonmax, latmax
+
+
+@lru_cache(maxsize=65536)
+def has_timestep(extent, day):
+    # SQL function: does this TimeExtent interval publish a timestep on day?
+    # Cached, since the count and page queries ask the same questions
+    interval, = parse_time_extent([extent])
+    day = pd.Timestamp(day)
+    return len(interval_timesteps(interval, day, day + pd.Timedelta(days=1) - pd.Timedelta(seconds=1))) > 0
+
+
+def fts_query(text):
+    # Every word the user typed must prefix-match a token of the layer name;
+    # "modis terra" and "MODIS_Terra" both find MODIS_Terra_* layers
+    words = re.findall(r"[A-Za-z0-9]+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+# ------------------------------
+# LAYER CATALOG
+# ------------------------------
+class LayerCatalog:
+    # SQLite index over layers_info.json: FTS5 on layer names, R*Trees over the
+    # TimeExtent intervals and bounding boxes. Rebuilt whenever gibs_wmts.py
+    # rewrites the JSON, so searches never touch the JSON itself.
+    def __init__(self, db_path, layers_info_path):
+        self.db_path = db_path
+        self.layers_info_path = layers_info_path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Bumped on every rebuild; threads reopen (and close their old
+        # connection) when theirs is from an earlier generation
+        self._generation = 0
+        self._source_mtime = None
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.generation != self._generation:
+            # sqlite3 connections can only be closed by their own thread
+            connection.close()
+            connection = None
+        if connection is None:
+            connection = sqlite3.connect(self.db_path)
+            connection.row_factory = sqlite3.Row
+            connection.create_function("has_timestep", 2, has_timestep, deterministic=True)
+            self._local.connection = connection
+            self._local.generation = self._generation
+        return connection
+
+    def _stored_mtime(self):
+        try:
+            row = self._connection().execute("SELECT value FROM meta WHERE key = 'source_mtime'").fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        return float(row["value"]) if row else None
+
+    @property
+    def ready(self):
+        # True once a layers_info.json has been indexed
+        return self._source_mtime is not None
+
+    def refresh(self):
+        # Cheap when nothing changed: one stat() plus, after a restart, one query
+        if not os.path.exists(self.layers_info_path):
+            return
+        mtime = os.path.getmtime(self.layers_info_path)
+        if mtime == self._source_mtime:
+            return
+
+        with self._lock:
+            if mtime == self._source_mtime:
+                return
+            if self._stored_mtime() != mtime:
+                self._rebuild(mtime)
+            self._source_mtime = mtime
+
+    def refresh_or_raise(self):
+        # Queries need an indexed layers_info.json; without one the tables
+        # do not exist yet
+        self.refresh()
+        if not self.ready:
+            raise CatalogUnavailable("The layer catalog is not available yet (no layers_info.json indexed)")
+
+    def _rebuild(self, mtime):
+        with open(self.layers_info_path) as f:
+            layers_info = json.load(f)
+
+        # Build into a fresh file and swap it in, so readers on other threads
+        # keep a consistent snapshot until they reconnect
+        tmp_path = f"{self.db_path}.{threading.get_ident()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.executescript(SCHEMA)
+            interval_id = 0
+            for layer_id, (name, layer_data) in enumerate(layers_info.items(), start=1):
+                bbox = parse_bbox(layer_data)
+                extent_values = layer_data.get("TimeExtent") or []
+                try:
+                    intervals = parse_time_extent(extent_values)
+                except ValueError:
+                    extent_values, intervals = [], []
+
+                time_start = epoch_days(min(i.start for i in intervals)) if intervals else None
+                time_end = epoch_days(max(i.end for i in intervals)) if intervals else None
+                connection.execute(
+                    "INSERT INTO layers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (layer_id, name, layer_data.get("Format"), layer_data.get("TileMatrixSet"),
+                     *(bbox or (None,) * 4), time_start, time_end, json.dumps(layer_data)),
+                )
+                connection.execute("INSERT INTO layers_fts (rowid, name) VALUES (?, ?)", (layer_id, name))
+                if bbox is not None:
+                    lonmin, latmin, lonmax, latmax = bbox
+                    connection.execute(
+                        "INSERT INTO layer_boxes VALUES (?, ?, ?, ?, ?)", (layer_id, lonmin, lonmax, latmin, latmax)
+                    )
+                for value, interval in zip(extent_values, intervals):
+                    interval_id += 1
+                    # A few published intervals run backwards; index their span
+                    day_start, day_end = sorted((epoch_days(interval.start), epoch_days(interval.end)))
+                    connection.execute(
+                        "INSERT INTO layer_times VALUES (?, ?, ?, ?, ?)",
+                        (interval_id, day_start, day_end, layer_id, value),
+                    )
+            connection.execute("INSERT INTO meta VALUES ('source_mtime', ?)", (repr(mtime),))
+            connection.commit()
+        finally:
+            connection.close()
+
+        os.replace(tmp_path, self.db_path)
+        self._generation += 1
+        print(f"Indexed {len(layers_info)} layers into {self.db_path}")
+
+    # ------------------------------
+    # QUERIES
+    # ------------------------------
+    def search(self, query="", date=None, bbox=None, offset=0, limit=DEFAULT_PAGE_SIZE):
+        # date: layers with a published timestep on that day (UTC)
+        # bbox: (lonmin, latmin, lonmax, latmax) the layer's extent must cover
+        self.refresh_or_raise()
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        offset = max(0, int(offset))
+
+        joins, conditions, params = [], [], []
+        if fts_query(query):
+            joins.append("JOIN layers_fts ON layers_fts.rowid = layers.id")
+            conditions.append("layers_fts MATCH ?")
+            params.append(fts_query(query))
+
+        if bbox is not None:
+            lonmin, latmin, lonmax, latmax = bbox
+            # The R*Tree narrows the candidates, the REAL columns give the exact answer
+            conditions.append(
+                "layers.id IN (SELECT id FROM layer_boxes"
+                " WHERE lonmin <= ? AND lonmax >= ? AND latmin <= ? AND latmax >= ?)"
+            )
+            params += [lonmin, lonmax, latmin, latmax]
+            conditions.append("layers.lonmin <= ? AND layers.lonmax >= ? AND layers.latmin <= ? AND layers.latmax >= ?")
+            params += [lonmin, lonmax, latmin, latmax]
+
+        if date is not None:
+            # The R*Tree finds the intervals spanning the day, has_timestep
+            # keeps those whose cadence actually lands on it
+            day = pd.Timestamp(date).normalize()
+            conditions.append(
+                "layers.id IN (SELECT layer_id FROM layer_times WHERE day_start <= ? AND day_end >= ?"
+                " AND has_timestep(extent, ?))"
+            )
+            params += [epoch_days(day + pd.Timedelta(days=1)), epoch_days(day), day.isoformat()]
+
+        where = " ".join(joins)
+        if conditions:
+            where += " WHERE " + " AND ".join(conditions)
+
+        connection = self._connection()
+        total = connection.execute(f"SELECT COUNT(*) FROM layers {where}", params).fetchone()[0]
+        rows = connection.execute(
+            f"SELECT layers.name, layers.format, layers.tile_matrix_set FROM layers {where}"
+            " ORDER BY layers.id LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        )
+        layers = [
+            {"layer": row["name"], "format": row["format"], "tileMatrixSet": row["tile_matrix_set"]}
+            for row in rows
+        ]
+        return {"total": total, "offset": offset, "limit": limit, "layers": layers}
+
+    def detail(self, name):
+        self.refresh_or_raise()
+        row = self._connection().execute("SELECT detail FROM layers WHERE name = ?", (name,)).fetchone()
+        return json.loads(row["detail"]) if row else None
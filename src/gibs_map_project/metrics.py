@@ -0,0 +1,277 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+LOG_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../data/logs"))
+JOB_LOG_PATH = os.path.join(LOG_DIRECTORY, "jobs.jsonl")
+PROFILE_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../data/profiles"))
+
+# Per-request profiling is refused unless this is set in the environment
+PROFILING_ENABLED = os.environ.get("GIBS_ENABLE_PROFILING") == "1"
+PROFILE_KINDS = ("cprofile", "tracemalloc")
+TRACEMALLOC_FRAMES = 25
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8, 1e9)
+JOB_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+# ------------------------------
+# PROMETHEUS-STYLE METRICS
+# ------------------------------
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(key)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', format_value(bound)),))} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {series['sum']!r}")
+                lines.append(f"{self.name}_count{format_labels(key)} {series['count']}")
+        return lines
+
+
+FRAME_DOWNLOAD_SECONDS = Histogram(
+    "gibs_frame_download_seconds", "Network time per WMS frame or WMTS tile, retries included",
+    LATENCY_BUCKETS, ("source",),
+)
+FRAME_DOWNLOAD_BYTES = Histogram(
+    "gibs_frame_download_bytes", "Size of each downloaded WMS frame or WMTS tile", SIZE_BUCKETS, ("source",),
+)
+FRAME_DECODE_SECONDS = Histogram(
+    "gibs_frame_decode_seconds", "PNG decode plus colormap lookup per frame or tile", LATENCY_BUCKETS, ("source",),
+)
+PIXELS_DECODED = Counter("gibs_pixels_decoded_total", "Pixels turned into values", ("source",))
+FEATURES_DECODED = Counter("gibs_features_decoded_total", "Point features decoded from vector tiles", ("source",))
+NETCDF_APPEND_SECONDS = Histogram(
+    "gibs_netcdf_append_seconds", "Time to compress and append one timestep to the NetCDF file", LATENCY_BUCKETS,
+)
+NETCDF_FILE_BYTES = Histogram("gibs_netcdf_file_bytes", "Size of each finished NetCDF file", SIZE_BUCKETS)
+JOBS = Counter("gibs_jobs_total", "Extraction jobs by outcome", ("mode", "status"))
+JOB_SECONDS = Histogram("gibs_job_duration_seconds", "Wall time of extraction jobs", JOB_BUCKETS, ("mode",))
+
+METRICS = (
+    FRAME_DOWNLOAD_SECONDS, FRAME_DOWNLOAD_BYTES, FRAME_DECODE_SECONDS, PIXELS_DECODED, FEATURES_DECODED,
+    NETCDF_APPEND_SECONDS, NETCDF_FILE_BYTES, JOBS, JOB_SECONDS,
+)
+
+
+def render(gauges=None):
+    # Text exposition format; gauges maps name -> (help, value) for values
+    # that are read at scrape time, like the frame cache stats
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    for name, (help_text, value) in (gauges or {}).items():
+        if value is None:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {format_value(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+# ------------------------------
+# PER-JOB STATS
+# ------------------------------
+class JobStats:
+    # Totals for one job, next to the process-wide metrics above
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.downloads = 0
+        self.download_seconds = 0.0
+        self.download_bytes = 0
+        self.decodes = 0
+        self.decode_seconds = 0.0
+        self.pixels = 0
+        self.features = 0
+        self.appends = 0
+        self.append_seconds = 0.0
+        self.file_bytes = None
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "downloads": self.downloads,
+                "downloadSeconds": round(self.download_seconds, 3),
+                "downloadBytes": self.download_bytes,
+                "decodes": self.decodes,
+                "decodeSeconds": round(self.decode_seconds, 3),
+                "pixels": self.pixels,
+                "features": self.features,
+                "appends": self.appends,
+                "appendSeconds": round(self.append_seconds, 3),
+                "fileBytes": self.file_bytes,
+            }
+
+
+def record_download(source, seconds, nbytes, stats=None):
+    FRAME_DOWNLOAD_SECONDS.observe(seconds, source=source)
+    FRAME_DOWNLOAD_BYTES.observe(nbytes, source=source)
+    if stats is not None:
+        with stats._lock:
+            stats.downloads += 1
+            stats.download_seconds += seconds
+            stats.download_bytes += nbytes
+
+
+def record_decode(source, seconds, pixels, stats=None):
+    FRAME_DECODE_SECONDS.observe(seconds, source=source)
+    PIXELS_DECODED.inc(pixels, source=source)
+    if stats is not None:
+        with stats._lock:
+            stats.decodes += 1
+            stats.decode_seconds += seconds
+            stats.pixels += pixels
+
+
+def record_features(source, seconds, features, stats=None):
+    # Vector tiles: counted in features, not pixels
+    FRAME_DECODE_SECONDS.observe(seconds, source=source)
+    FEATURES_DECODED.inc(features, source=source)
+    if stats is not None:
+        with stats._lock:
+            stats.decodes += 1
+            stats.decode_seconds += seconds
+            stats.features += features
+
+
+def record_append(seconds, stats=None):
+    NETCDF_APPEND_SECONDS.observe(seconds)
+    if stats is not None:
+        with stats._lock:
+            stats.appends += 1
+            stats.append_seconds += seconds
+
+
+def record_file(nbytes, stats=None):
+    NETCDF_FILE_BYTES.observe(nbytes)
+    if stats is not None:
+        with stats._lock:
+            stats.file_bytes = nbytes
+
+
+# ------------------------------
+# STRUCTURED JOB LOG
+# ------------------------------
+_log_lock = threading.Lock()
+
+
+def log_job(record):
+    # One JSON object per line, so the log can be grepped or loaded with pandas
+    JOBS.inc(mode=record.get("mode"), status=record["status"])
+    if record.get("seconds") is not None:
+        JOB_SECONDS.observe(record["seconds"], mode=record.get("mode"))
+
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        os.makedirs(LOG_DIRECTORY, exist_ok=True)
+        with open(JOB_LOG_PATH, "a") as f:
+            f.write(line + "\n")
+    print(line)
+
+
+# ------------------------------
+# PROFILING HOOKS
+# ------------------------------
+# One profile of each kind at a time: tracemalloc is process-wide, and from
+# Python 3.12 on so is cProfile
+_profile_locks = {kind: threading.Lock() for kind in PROFILE_KINDS}
+
+
+@contextmanager
+def profiled(kind, name):
+    # Yields the dump path, or None when profiling is off or another job holds
+    # this kind of profiler. cProfile only sees the calling thread, i.e. the
+    # job's own decode and write work, not the download pool.
+    if kind is None:
+        yield None
+        return
+    if not _profile_locks[kind].acquire(blocking=False):
+        print(f"{kind} is busy with another job, not profiling {name}")
+        yield None
+        return
+
+    os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+    started = time.time()
+    try:
+        if kind == "cprofile":
+            path = os.path.join(PROFILE_DIRECTORY, f"{name}.prof")
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield path
+            finally:
+                profiler.disable()
+                profiler.dump_stats(path)
+            print(f"cProfile: {time.time() - started:.1f}s, stats {path}")
+        else:
+            path = os.path.join(PROFILE_DIRECTORY, f"{name}.tracemalloc")
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            try:
+                yield path
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                snapshot.dump(path)
+            print(f"tracemalloc: peak {peak / 1024 ** 2:.1f} MiB over {time.time() - started:.1f}s, snapshot {path}")
+    finally:
+        _profile_locks[kind].release()
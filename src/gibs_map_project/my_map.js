@@ -4,7 +4,11 @@ window.onload = function () {
         IMAGE: 'image/png'
     };
 
-    const LAYERS_INFO_JSON = 'layers/layers_info.json';
+    // The API is served from the same origin as this page
+    const API_BASE = '';
+    const LAYER_PAGE_SIZE = 100;
+    const SEARCH_DEBOUNCE_MS = 250;
+    const JOB_STAGES = ['download', 'decode', 'write'];
 
     let tileLayerResolutions = [0.5625, 0.28125, 0.140625, 0.0703125, 0.03515625, 0.017578125, 0.0087890625, 0.00439453125, 0.002197265625];
     let tileResolutions = [0.28125, 0.140625, 0.0703125, 0.03515625, 0.017578125, 0.0087890625, 0.00439453125, 0.002197265625, 0.0010986328125, 0.00054931640625];
@@ -14,7 +18,6 @@ window.onload = function () {
     let tileOrigin = [-180, 90]
     let baseUrl = 'https://gibs.earthdata.nasa.gov/wmts/epsg4326/best/wmts.cgi?';
 
-    let layerInformation = {};
     let selectedLayer;
     let currentUrl;
     let vectorLayer;
@@ -27,6 +30,9 @@ window.onload = function () {
     let map;
     let startDate
     let endDate
+    let currentJobId = null;
+    let layerSearch = { offset: 0, total: 0, request: 0 };
+    let searchTimer = null;
 
     function calculateMinDays(timeExtent) {
         if (!timeExtent || timeExtent.length === 0) {
@@ -201,15 +207,51 @@ window.onload = function () {
         }
     }
 
-    function showDownloadPanel() {
+    function showDownloadPanel(text) {
         var downloadPanel = document.getElementById('download-panel');
-        downloadPanel.innerText = 'GENERATING NETCDF FILE...';
+        document.getElementById('download-status').innerText = text || 'GENERATING NETCDF FILE...';
         downloadPanel.style.display = 'block';
     }
 
     function hideDownloadPanel() {
         var downloadPanel = document.getElementById('download-panel');
         downloadPanel.style.display = 'none';
+        currentJobId = null;
+    }
+
+    function formatJobProgress(job) {
+        let parts = JOB_STAGES.map(stage => {
+            let counts = job.progress[stage];
+            return stage.toUpperCase() + ' ' + counts.done + '/' + counts.total;
+        });
+        return job.status.toUpperCase() + ' - ' + parts.join(' | ');
+    }
+
+    function followJob(jobId) {
+        currentJobId = jobId;
+        let events = new EventSource(API_BASE + '/jobs/' + jobId + '/events');
+
+        events.onmessage = function (event) {
+            let job = JSON.parse(event.data);
+            showDownloadPanel(formatJobProgress(job));
+
+            if (job.status === 'finished') {
+                events.close();
+                hideDownloadPanel();
+                showFinishedPanel();
+                window.location.href = API_BASE + '/jobs/' + jobId + '/result';
+            } else if (job.status === 'failed' || job.status === 'cancelled') {
+                events.close();
+                console.error('Job ' + job.status + ':', job.error);
+                hideDownloadPanel();
+            }
+        };
+
+        events.onerror = function (error) {
+            console.error('Lost job progress stream:', error);
+            events.close();
+            hideDownloadPanel();
+        };
     }
 
     function showFinishedPanel() {
@@ -221,21 +263,61 @@ window.onload = function () {
         }, 5000); 
     }
 
-    fetch(LAYERS_INFO_JSON)
-    .then(response => response.json())
-    .then(layersInfo => {
-        layerInformation = layersInfo;
+    function layerSearchUrl(offset) {
+        let params = new URLSearchParams({
+            q: document.getElementById('layer-search').value,
+            offset: offset,
+            limit: LAYER_PAGE_SIZE
+        });
+        if (document.getElementById('layer-filter').checked) {
+            let date = document.getElementById('start-date').value;
+            let bbox = ['lonmin', 'latmin', 'lonmax', 'latmax'].map(id => parseFloat(document.getElementById(id).value));
+            if (date) params.set('date', date);
+            if (!bbox.some(isNaN)) params.set('bbox', bbox.join(','));
+        }
+        return API_BASE + '/layers?' + params.toString();
+    }
+
+    function searchLayers(append) {
+        // Only the newest search is allowed to touch the list
+        let request = ++layerSearch.request;
+        let offset = append ? layerSearch.offset : 0;
+
+        fetch(layerSearchUrl(offset))
+        .then(response => response.json())
+        .then(page => {
+            if (request !== layerSearch.request) return;
+            if (!append) {
+                select.innerHTML = '';
+                let placeholder = document.createElement('option');
+                placeholder.value = '';
+                placeholder.text = page.total + ' layers';
+                select.appendChild(placeholder);
+            }
+
+            page.layers.forEach(item => {
+                let option = document.createElement('option');
+                option.value = item.layer;
+                option.text = item.layer;
+                select.appendChild(option);
+            });
 
-        Object.keys(layersInfo).forEach(item => {
-            let option = document.createElement('option');
-            option.value = item;
-            option.text = item;
-            select.appendChild(option);
+            layerSearch.offset = offset + page.layers.length;
+            layerSearch.total = page.total;
+            document.getElementById('more-layers-button').style.display =
+                layerSearch.offset < layerSearch.total ? 'block' : 'none';
+        })
+        .catch(error => {
+            console.error('Error searching layers:', error);
         });
-    })
-    .catch(error => {
-        console.error('Error loading layers_info.json file:', error);
-    });
+    }
+
+    function scheduleLayerSearch() {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => searchLayers(false), SEARCH_DEBOUNCE_MS);
+    }
+
+    searchLayers(false);
 
     // Map Initialization
     let base = new ol.layer.Tile({
@@ -319,7 +401,22 @@ window.onload = function () {
 
     select.addEventListener('change', function () {
         let selectedLayerIndex = select.value;
-        selectedLayer = layerInformation[selectedLayerIndex];
+        if (!selectedLayerIndex) return;
+
+        // Layer detail is loaded lazily, one layer at a time
+        fetch(API_BASE + '/layers/' + encodeURIComponent(selectedLayerIndex))
+        .then(response => response.ok ? response.json() : null)
+        .then(layerInfo => {
+            if (select.value !== selectedLayerIndex) return;
+            selectLayer(selectedLayerIndex, layerInfo);
+        })
+        .catch(error => {
+            console.error('Error loading layer details:', error);
+        });
+    });
+
+    function selectLayer(selectedLayerIndex, layerInfo) {
+        selectedLayer = layerInfo;
         if (selectedLayer) {
             let slider = document.getElementById('day-slider');
             let minDays = calculateMinDays(selectedLayer.TimeExtent);
@@ -351,7 +448,7 @@ window.onload = function () {
         } else {
             console.error('Layer information not found for selected layer:', selectedLayerIndex);
         }
-    });
+    }
 
     const timeButton = document.getElementById('time-button');
     timeButton.addEventListener('click', function () {
@@ -413,25 +510,25 @@ window.onload = function () {
             lonmin: lonmin,
             latmin: latmin,
             lonmax: lonmax,
-            latmax: latmax
+            latmax: latmax,
+            mode: document.getElementById('mode-select').value
         };
 
-        fetch('http://localhost:5000/save_data', { 
+        fetch(API_BASE + '/save_data', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify(data) 
             })
-            .then(response => {
-                if (response.ok) {
-                    console.log('Data sent successfully');
-                    // you can handle the response here
-                    hideDownloadPanel(); 
-                    showFinishedPanel();
+            .then(response => response.json().then(job => ({ ok: response.ok, job: job })))
+            .then(({ ok, job }) => {
+                if (ok) {
+                    console.log('Job submitted:', job.jobId);
+                    followJob(job.jobId);
                 } else {
-                    console.error('Failed to send data');
-                    hideDownloadPanel(); 
+                    console.error('Failed to submit job:', job.error);
+                    hideDownloadPanel();
                 }
             })
             .catch(error => {
@@ -439,6 +536,14 @@ window.onload = function () {
                 hideDownloadPanel(); 
             });
     });
+
+    document.getElementById('cancel-button').addEventListener('click', function () {
+        if (!currentJobId) {
+            return;
+        }
+        fetch(API_BASE + '/jobs/' + currentJobId + '/cancel', { method: 'POST' })
+            .catch(error => console.error('Error cancelling job:', error));
+    });
     
     document.getElementById('view-button').addEventListener('click', function () {
         lonmin = parseFloat(document.getElementById('lonmin').value);
@@ -462,21 +567,18 @@ window.onload = function () {
 
     document.getElementById('start-date').addEventListener('change', saveDates);
 
+    document.getElementById('start-date').addEventListener('change', function () {
+        if (document.getElementById('layer-filter').checked) scheduleLayerSearch();
+    });
+
     document.getElementById('end-date').addEventListener('change', saveDates);
 
-    const searchInput = document.getElementById('layer-search');
-    searchInput.addEventListener('input', function () {
-        const searchText = searchInput.value.toLowerCase();
-        const options = select.options;
-        for (let i = 0; i < options.length; i++) {
-            const option = options[i];
-            const optionText = option.text.toLowerCase();
-            if (optionText.includes(searchText)) {
-                option.style.display = 'block';
-            } else {
-                option.style.display = 'none';
-            }
-        }
+    document.getElementById('layer-search').addEventListener('input', scheduleLayerSearch);
+
+    document.getElementById('layer-filter').addEventListener('change', scheduleLayerSearch);
+
+    document.getElementById('more-layers-button').addEventListener('click', function () {
+        searchLayers(true);
     });
 
     var displayFeatureInfo = function (event) {
@@ -1,23 +1,31 @@
+import gzip
+import json
 import os
-from flask import Flask, request
-from flask_cors import CORS
-import requests
+import threading
 import pandas as pd
-import xml.etree.ElementTree as ET
-from PIL import Image
-import xarray as xr
-from owslib.wms import WebMapService
-from tqdm import tqdm
-
-# ------------------------------
-# PATHS
-# ------------------------------
-DATA_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../data"))
-IMAGES_DIRECTORY = os.path.join(DATA_DIRECTORY, "images")
-DATE_FORMAT = "%Y-%m-%d"
-
-# Make sure image directory exists
-os.makedirs(IMAGES_DIRECTORY, exist_ok=True)
+import requests
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file, send_from_directory
+from flask_cors import CORS
+from extraction import (
+    parse_request,
+    run_extraction,
+    output_path,
+    job_directory,
+    remove_job_directory,
+    remove_stale_job_directories,
+    frame_cache,
+    colormap_registry,
+    LAYERS_INFO_PATH,
+    DATA_DIRECTORY,
+    STORES_DIRECTORY,
+)
+from colormap_registry import ColormapUnavailable
+from jobs import JobManager, QueueFull, FINAL_STATES
+from parallel_decode import start_decode_pool
+from layer_catalog import LayerCatalog, CatalogUnavailable, DEFAULT_PAGE_SIZE
+from timeseries import parse_timeseries_request, sample_timeseries, render_timeseries
+from static_assets import StaticAssets
+import metrics
 
 # ------------------------------
 # FLASK APP
@@ -25,27 +33,48 @@ os.makedirs(IMAGES_DIRECTORY, exist_ok=True)
 app = Flask(__name__)
 CORS(app)
 
-# ------------------------------
-# XML DOWNLOAD
-# ------------------------------
-def download_xml(metadata_href):
-    try:
-        response = requests.get(metadata_href)
-        if response.status_code == 200:
-            filename = os.path.basename(metadata_href)
-            xml_path = os.path.join(DATA_DIRECTORY, filename)
+SSE_KEEPALIVE_SECONDS = 15
+PREWARM_COLORMAPS = True
+GZIP_MIN_BYTES = 1024
+GZIP_MIMETYPES = ("application/json", "text/csv")
+CATALOG_PATH = os.path.join(DATA_DIRECTORY, "cache", "catalog", "layers.sqlite")
 
-            with open(xml_path, "wb") as f:
-                f.write(response.content)
+# Fork the decode workers first, while this is still the only thread
+start_decode_pool()
+remove_stale_job_directories()
+job_manager = JobManager(run_extraction, on_remove=lambda job: remove_job_directory(job.id))
+layer_catalog = LayerCatalog(CATALOG_PATH, LAYERS_INFO_PATH)
+static_assets = StaticAssets()
+threading.Thread(target=layer_catalog.refresh, daemon=True).start()
 
-            return filename
-        else:
-            print(f"Failed to download XML from {metadata_href}")
-            return None
+# Compile every layer's colormap in the background so the first extraction
+# for a layer does not pay the download and parse
+if PREWARM_COLORMAPS and os.path.exists(LAYERS_INFO_PATH):
+    threading.Thread(target=colormap_registry.prewarm, args=(LAYERS_INFO_PATH,), daemon=True).start()
 
-    except Exception as e:
-        print(f"Error downloading XML: {e}")
-        return None
+
+# ------------------------------
+# GZIP JSON RESPONSES
+# ------------------------------
+@app.after_request
+def gzip_response(response):
+    # Only buffered JSON and CSV bodies: SSE streams and send_file pass through
+    if (
+        response.direct_passthrough
+        or response.mimetype not in GZIP_MIMETYPES
+        or "gzip" not in request.headers.get("Accept-Encoding", "")
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+
+    response.set_data(gzip.compress(body, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
 
 
 # ------------------------------
@@ -62,184 +91,247 @@ def handle_options():
 
 
 # ------------------------------
-# MAIN PROCESSING ROUTE
+# JOB SUBMISSION
 # ------------------------------
 @app.route("/save_data", methods=["POST"])
 def save_data():
-    data = request.json
-
-    layer = data.get("layer")
-    start_date = data.get("startDate")
-    end_date = data.get("endDate")
-    lonmin = float(data.get("lonmin"))
-    latmin = float(data.get("latmin"))
-    lonmax = float(data.get("lonmax"))
-    latmax = float(data.get("latmax"))
-    metadata_href = data.get("metadataHref")
-
-    print(layer, start_date, end_date, lonmin, latmin, lonmax, latmax, metadata_href)
-
-    # ------------------------------
-    # DOWNLOAD XML
-    # ------------------------------
-    xml_filename = download_xml(metadata_href)
-    if xml_filename is None:
-        return "Failed to download XML", 500
-
-    xml_path = os.path.join(DATA_DIRECTORY, xml_filename)
-
-    # ------------------------------
-    # GET WMS CLIENT
-    # ------------------------------
-    wms = WebMapService(
-        "https://gibs.earthdata.nasa.gov/wms/epsg4326/best/wms.cgi?", version="1.1.1"
-    )
-
-    # ------------------------------
-    # DOWNLOAD IMAGES
-    # ------------------------------
-    time_range = pd.date_range(start=start_date, end=end_date, freq="D")
-    pbar_images = tqdm(total=len(time_range), desc="Downloading images")
-
-    for time_value in time_range:
-        time_str = time_value.strftime(DATE_FORMAT)
-
-        img = wms.getmap(
-            layers=[layer],
-            srs="epsg:4326",
-            bbox=(lonmin, latmin, lonmax, latmax),
-            size=(2000, 2000),
-            time=time_str,
-            format="image/png",
-            transparent=True,
-        )
+    try:
+        params = parse_request(request.json or {})
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        job = job_manager.submit(params)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify(job.to_dict()), 202
+
+
+# ------------------------------
+# JOB STATUS / EVENTS / CANCEL
+# ------------------------------
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    def stream():
+        version = -1
+        while True:
+            new_version = job.wait_for_change(version, timeout=SSE_KEEPALIVE_SECONDS)
+            if new_version == version:
+                yield ": keep-alive\n\n"
+                continue
+
+            version = new_version
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.status in FINAL_STATES:
+                break
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(stream()), mimetype="text/event-stream", headers=headers)
 
-        filename = f"image_{layer}_{time_str}.png"
-        image_path = os.path.join(IMAGES_DIRECTORY, filename)
-
-        with open(image_path, "wb") as f:
-            f.write(img.read())
-
-        pbar_images.update(1)
-
-    pbar_images.close()
-
-    # ------------------------------
-    # PARSE XML COLORMAP
-    # ------------------------------
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-
-    title = None
-    units = "no unit available"
-
-    color_map_elements = root.findall(".//ColorMap")
-    if len(color_map_elements) >= 2:
-        second_cm = color_map_elements[1]
-        title = second_cm.attrib.get("title")
-        units = second_cm.attrib.get("units", "no unit available")
 
-    print("Title:", title)
-    print("Units:", units)
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
 
-    # Map RGB to value
-    color_map = {}
-    for entry in root.findall(".//ColorMapEntry"):
-        rgb = tuple(map(int, entry.attrib["rgb"].split(",")))
 
-        if entry.attrib.get("nodata") == "true":
-            continue
+# ------------------------------
+# JOB RESULT DOWNLOAD
+# ------------------------------
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.status != "finished":
+        return jsonify({"error": f"Job is {job.status}"}), 409
+
+    if job.result and job.result.get("store"):
+        store = job.result["store"]
+        return jsonify({"error": f"Job appended to a store, read it from /stores/{store}/", "store": store}), 409
+
+    path = output_path(job)
+    if path is None or not os.path.exists(path):
+        return jsonify({"error": "Result file is no longer available"}), 410
+
+    # conditional=True answers Range / If-None-Match requests with 206 / 304
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path), conditional=True)
+
+
+@app.route("/jobs/<job_id>/files/<filename>", methods=["GET"])
+def job_file(job_id, filename):
+    # Single GeoTIFFs of a cog job, so GIS clients can range-read one
+    # window of one date instead of downloading the zip
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.status != "finished" or filename not in (job.result or {}).get("files", []):
+        return jsonify({"error": "Unknown file"}), 404
+    return send_from_directory(job_directory(job.id), filename, conditional=True)
+
+
+# ------------------------------
+# ZARR STORES
+# ------------------------------
+@app.route("/stores/<path:key>", methods=["GET"])
+def store_key(key):
+    # Serves store keys (zarr.json metadata and chunks) as plain files, so
+    # zarr/xarray/dask read a store over HTTP chunk by chunk
+    return send_from_directory(STORES_DIRECTORY, key, conditional=True)
+
 
-        value_str = entry.attrib.get("value")
-        if value_str:
-            rng = value_str.strip("[]()").split(",")
-            if len(rng) == 1:
-                value = float(rng[0])
-            else:
-                if rng[0] == "-INF":
-                    value = float(rng[1])
-                elif rng[1] == "+INF":
-                    value = float(rng[0])
-                else:
-                    value = (float(rng[0]) + float(rng[1])) / 2
+# ------------------------------
+# POINT / SMALL-AREA TIME SERIES
+# ------------------------------
+@app.route("/timeseries", methods=["POST"])
+def timeseries():
+    # Answered directly rather than as a job: the work scales with the tiles
+    # under the points, not with the area between them
+    try:
+        params = parse_timeseries_request(request.json or {})
+    except (TypeError, ValueError, KeyError) as e:
+        return jsonify({"error": str(e)}), 400
 
-            color_map[rgb] = value
-        else:
-            color_map[rgb] = None
+    try:
+        table, missing = sample_timeseries(params)
+        body, mimetype, filename = render_timeseries(table, params)
+    except (ColormapUnavailable, requests.RequestException) as e:
+        # GIBS (or the colormap host) failed, not the request
+        return jsonify({"error": str(e)}), 502
 
-    # ------------------------------
-    # PROCESS IMAGES → DATAFRAME
-    # ------------------------------
-    df_list = []
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if missing:
+        headers["X-Missing-Dates"] = ",".join(missing)
+    return Response(body, mimetype=mimetype, headers=headers)
+
+
+# ------------------------------
+# LAYER CATALOG
+# ------------------------------
+@app.route("/layers", methods=["GET"])
+def search_layers():
+    # /layers?q=modis+terra&date=2024-01-01&bbox=lonmin,latmin,lonmax,latmax&offset=0&limit=50
+    try:
+        bbox = request.args.get("bbox")
+        if bbox:
+            bbox = tuple(float(v) for v in bbox.split(","))
+            if len(bbox) != 4:
+                raise ValueError("bbox must be lonmin,latmin,lonmax,latmax")
+        date = request.args.get("date") or None
+        if date is not None:
+            pd.Timestamp(date)
+        result = layer_catalog.search(
+            query=request.args.get("q", ""),
+            date=date,
+            bbox=bbox or None,
+            offset=request.args.get("offset", 0),
+            limit=request.args.get("limit", DEFAULT_PAGE_SIZE),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except CatalogUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(result)
 
-    bounding_box = (lonmin, latmin, lonmax, latmax)
-    image_files = [f for f in os.listdir(IMAGES_DIRECTORY) if f.endswith(".png")]
-    pbar_proc = tqdm(total=len(image_files), desc="Processing images")
 
-    for filename in image_files:
-        image_path = os.path.join(IMAGES_DIRECTORY, filename)
-        image = Image.open(image_path)
-        pixels = image.load()
-        width, height = image.size
+@app.route("/layers/<path:name>", methods=["GET"])
+def layer_detail(name):
+    try:
+        detail = layer_catalog.detail(name)
+    except CatalogUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    if detail is None:
+        return jsonify({"error": "Unknown layer"}), 404
+    return jsonify(detail)
 
-        date_str = filename.split("_")[-1].split(".")[0]
 
-        pixel_size_x = (lonmax - lonmin) / width
-        pixel_size_y = (latmax - latmin) / height
+# ------------------------------
+# FRAME CACHE STATS
+# ------------------------------
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(frame_cache.stats())
 
-        rows = []
-        for y in range(height):
-            for x in range(width):
-                rgb = pixels[x, y][:3]
-                if rgb in color_map:
-                    value = color_map[rgb]
-                    lon = lonmin + (x * pixel_size_x)
-                    lat = latmax - (y * pixel_size_y)
-                    rows.append(
-                        {
-                            "latitude": lat,
-                            "longitude": lon,
-                            "time": date_str + " 00:00:00",
-                            "value": value,
-                        }
-                    )
 
-        df_list.append(pd.DataFrame(rows))
-        pbar_proc.update(1)
+# ------------------------------
+# PROMETHEUS METRICS
+# ------------------------------
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    cache = frame_cache.stats()
+    gauges = {
+        "gibs_frame_cache_hits": ("Frame cache hits since start", cache["hits"]),
+        "gibs_frame_cache_misses": ("Frame cache misses since start", cache["misses"]),
+        "gibs_frame_cache_coalesced": ("Fetches that waited on an identical in-flight fetch", cache["coalesced"]),
+        "gibs_frame_cache_evictions": ("Frame cache evictions since start", cache["evictions"]),
+        "gibs_frame_cache_entries": ("Entries in the frame cache", cache["entries"]),
+        "gibs_frame_cache_bytes": ("Bytes in the frame cache", cache["bytes"]),
+    }
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
 
-    pbar_proc.close()
 
-    df = pd.concat(df_list, ignore_index=True)
+# ------------------------------
+# HEALTH / READINESS
+# ------------------------------
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # The process answers; used for liveness probes
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # Ready once the layer catalog is indexed and the job workers are up;
+    # not ready while draining, so load balancers stop sending new work
+    checks = {
+        "layers": layer_catalog.ready,
+        "jobWorkers": job_manager.healthy(),
+        "acceptingJobs": job_manager.accepting,
+    }
+    ready = all(checks.values())
+    body = {"status": "ready" if ready else "not ready", "checks": checks, "activeJobs": len(job_manager.active())}
+    return jsonify(body), 200 if ready else 503
 
-    # ------------------------------
-    # WRITE NETCDF
-    # ------------------------------
-    nc_path = os.path.join(DATA_DIRECTORY, "output.nc")
-    ds = xr.Dataset.from_dataframe(df.set_index(["latitude", "longitude", "time"]))
 
-    ds["value"].attrs["units"] = units
-    ds["value"].attrs["long_name"] = title
-
-    ds.to_netcdf(nc_path)
-
-    print("====================================")
-    print("| NetCDF file created successfully |")
-    print("====================================")
-
-    # ------------------------------
-    # CLEANUP XML + IMAGES
-    # ------------------------------
-    if os.path.exists(xml_path):
-        os.remove(xml_path)
-
-    for f in image_files:
-        os.remove(os.path.join(IMAGES_DIRECTORY, f))
-
-    return "Data processed and saved successfully"
+# ------------------------------
+# STATIC FRONTEND
+# ------------------------------
+# index.html, my_map.js, css/, lib/ and layers_info.json come from the same
+# origin as the API, gzipped and with ETag / Cache-Control
+@app.route("/", methods=["GET"])
+@app.route("/index.html", methods=["GET"])
+@app.route("/my_map.js", methods=["GET"])
+@app.route("/layers/layers_info.json", methods=["GET"])
+@app.route("/css/<path:name>", methods=["GET"])
+@app.route("/lib/<path:name>", methods=["GET"])
+def frontend(name=None):
+    path = request.path.lstrip("/")
+    response = static_assets.response(path, request)
+    if response is None:
+        return jsonify({"error": "Not found"}), 404
+    return response
 
 
 # ------------------------------
 # FLASK ENTRY POINT
 # ------------------------------
+# Development only; serve.py runs the production server. No debug mode: its
+# reloader imports this module again, forking the decode pool a second time,
+# and the Werkzeug debugger runs arbitrary code for whoever can reach it.
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)
+    app.run(port=5000, threaded=True)
@@ -0,0 +1,77 @@
+import netCDF4
+import numpy as np
+import pandas as pd
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+DEFAULT_COMPLEVEL = 4
+CHUNK_SIZE = 256
+TIME_UNITS = "days since 1970-01-01 00:00:00"
+TIME_CALENDAR = "standard"
+
+
+# ------------------------------
+# STREAMING NETCDF WRITER
+# ------------------------------
+class NetCDFWriter:
+    # Creates the file up front with an unlimited time dimension and fixed
+    # latitude/longitude axes, then appends one (latitude, longitude) grid per
+    # variable and timestep, so memory stays at one frame for any date range.
+    def __init__(self, path, lats, lons, variables, complevel=DEFAULT_COMPLEVEL, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.size = 0
+        self._ds = netCDF4.Dataset(path, "w", format="NETCDF4")
+
+        self._ds.createDimension("time", None)
+        self._ds.createDimension("latitude", len(lats))
+        self._ds.createDimension("longitude", len(lons))
+
+        self._time = self._ds.createVariable("time", "f8", ("time",))
+        self._time.units = TIME_UNITS
+        self._time.calendar = TIME_CALENDAR
+        self._time.standard_name = "time"
+
+        latitude = self._ds.createVariable("latitude", "f8", ("latitude",))
+        latitude.units = "degrees_north"
+        latitude.standard_name = "latitude"
+        latitude[:] = lats
+
+        longitude = self._ds.createVariable("longitude", "f8", ("longitude",))
+        longitude.units = "degrees_east"
+        longitude.standard_name = "longitude"
+        longitude[:] = lons
+
+        chunks = (1, min(chunk_size, len(lats)), min(chunk_size, len(lons)))
+        self._variables = {}
+        for name, attrs in variables.items():
+            variable = self._ds.createVariable(
+                name, "f4", ("time", "latitude", "longitude"),
+                zlib=complevel > 0, complevel=complevel, shuffle=complevel > 0,
+                chunksizes=chunks, fill_value=np.float32(np.nan),
+            )
+            for key, value in attrs.items():
+                if value is not None:
+                    variable.setncattr(key, value)
+            self._variables[name] = variable
+
+    def append(self, time_value, grids):
+        # grids maps variable name -> (latitude, longitude) array, south to north
+        index = self.size
+        self._time[index] = netCDF4.date2num(
+            pd.Timestamp(time_value).to_pydatetime(), TIME_UNITS, TIME_CALENDAR
+        )
+        for name, grid in grids.items():
+            self._variables[name][index, :, :] = grid
+        self.size += 1
+        return index
+
+    def close(self):
+        if self._ds.isopen():
+            self._ds.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,234 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from colormap_decoder import decode_frame
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+# Worker processes of the process-wide pool; 1 (or a platform without fork)
+# decodes in each job's own thread, exactly as before
+DECODE_WORKERS = int(os.environ.get("GIBS_DECODE_WORKERS", os.cpu_count() or 1))
+# Upper bound on decoded frames held in memory maps at once, shared by every
+# job; a job that finds it used up decodes in its own thread
+DECODE_MEMORY_LIMIT_BYTES = int(os.environ.get("GIBS_DECODE_MEMORY_MB", 1024)) * 1024 ** 2
+# Frames a stream keeps in flight per worker: enough to keep the workers
+# busy, few enough that the first write (and a cancel) is not held up behind
+# a whole batch of decodes
+DECODE_WINDOW_PER_WORKER = 2
+FRAMES_FILENAME = "decoded_frames.f32"
+
+# Workers are forked rather than spawned: spawn re-imports the server's main
+# module in every child, which would start a second Flask app and job manager.
+# They are forked once, by start_decode_pool() at startup, before the server
+# starts any thread.
+START_METHOD = "fork"
+
+# Register the image plugins now, so forked workers never import anything
+Image.init()
+
+
+def parallel_decoding_available(workers=DECODE_WORKERS):
+    return workers > 1 and START_METHOD in multiprocessing.get_all_start_methods()
+
+
+# ------------------------------
+# WORKER SIDE
+# ------------------------------
+def _decode_into_slot(path, shape, slot, lut, content):
+    # Decoded values go straight into the job's memory map; only the timing
+    # travels back through the pipe. Opening the map is a couple of syscalls,
+    # next to a PNG decode it costs nothing.
+    started = time.perf_counter()
+    frames = np.memmap(path, dtype=np.float32, mode="r+", shape=shape)
+    try:
+        with Image.open(BytesIO(content)) as image:
+            decode_frame(image, lut, out=frames[slot])
+    finally:
+        del frames
+    return time.perf_counter() - started
+
+
+# ------------------------------
+# PROCESS-WIDE POOL
+# ------------------------------
+class DecodePool:
+    # One process pool for every job, plus the memory budget their decoded
+    # frames share. Jobs reserve slots from the budget for as long as they
+    # decode (see FrameDecodePool) and give them back when they close.
+    def __init__(self, workers=DECODE_WORKERS, memory_limit=DECODE_MEMORY_LIMIT_BYTES):
+        self.workers = workers
+        self.memory_limit = memory_limit
+        self._reserved = 0
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD),
+        )
+        # A fork pool starts every worker on its first task; do it now, while
+        # the caller still controls which threads exist
+        self._executor.submit(os.getpid).result()
+
+    @property
+    def reserved_bytes(self):
+        return self._reserved
+
+    def reserve(self, frame_bytes, streams, wanted):
+        # Up to wanted slots per stream, fewer when the budget is short;
+        # returns the slots per stream granted, 0 when not even one fits
+        with self._lock:
+            available = (self.memory_limit - self._reserved) // frame_bytes // streams
+            slots = int(max(0, min(wanted, available)))
+            self._reserved += slots * streams * frame_bytes
+        return slots
+
+    def release(self, nbytes):
+        with self._lock:
+            self._reserved -= nbytes
+
+    def submit(self, *args):
+        return self._executor.submit(_decode_into_slot, *args)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def start_decode_pool(workers=DECODE_WORKERS, memory_limit=DECODE_MEMORY_LIMIT_BYTES):
+    # Call at startup, before any other thread exists: forking a process that
+    # already runs threads copies their locks in whatever state they are in.
+    # Outside the server (benchmarks, scripts) the pool starts on first use.
+    global _pool
+    with _pool_lock:
+        if _pool is None and parallel_decoding_available(workers):
+            _pool = DecodePool(workers, memory_limit)
+        return _pool
+
+
+def stop_decode_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+# ------------------------------
+# ONE JOB'S SHARE OF THE POOL
+# ------------------------------
+class FrameDecodePool:
+    # A job's slots in the process-wide pool, backed by a (slot, latitude,
+    # longitude) float32 memory map in the job's scratch directory. There is
+    # one stream per colormap (one per layer of a batch), each with its own
+    # ring of slots, reused once each frame has been consumed.
+    def __init__(self, pool, directory, frame_shape, luts, stream_slots):
+        self._pool = pool
+        self._luts = list(luts)
+        self.stream_slots = stream_slots
+        self.shape = (stream_slots * len(self._luts), *frame_shape)
+        self.nbytes = self.shape[0] * frame_shape[0] * frame_shape[1] * 4
+        self.path = os.path.join(directory, FRAMES_FILENAME)
+        try:
+            self._frames = np.memmap(self.path, dtype=np.float32, mode="w+", shape=self.shape)
+        except BaseException:
+            pool.release(self.nbytes)
+            raise
+
+    def decode(self, items, stream=0):
+        # items yields (tag, png bytes or None); yields (tag, grid, seconds) in
+        # the same order, with (tag, None, None) for items without content.
+        # A grid is a view into the shared map and is only valid until the
+        # next item is requested from this stream.
+        first = stream * self.stream_slots
+        free = deque(range(first, first + self.stream_slots))
+        pending = deque()
+
+        def next_result():
+            tag, slot, future = pending.popleft()
+            if future is None:
+                return tag, None, None, slot
+            seconds = future.result()
+            return tag, self._frames[slot], seconds, slot
+
+        try:
+            for tag, content in items:
+                # Items without content (cached or failed frames) count
+                # against the window too, so they cannot pile up either
+                while len(pending) >= self.stream_slots or (content is not None and not free):
+                    tag_done, grid, seconds, slot = next_result()
+                    yield tag_done, grid, seconds
+                    if slot is not None:
+                        free.append(slot)
+
+                if content is None:
+                    pending.append((tag, None, None))
+                else:
+                    slot = free.popleft()
+                    future = self._pool.submit(self.path, self.shape, slot, self._luts[stream], content)
+                    pending.append((tag, slot, future))
+
+            while pending:
+                tag_done, grid, seconds, _ = next_result()
+                yield tag_done, grid, seconds
+        finally:
+            for _, _, future in pending:
+                if future is not None:
+                    future.cancel()
+            # Wait out decodes already running, so none writes into the map
+            # after it is gone
+            for _, _, future in pending:
+                if future is not None and not future.cancelled():
+                    future.exception()
+
+    def close(self):
+        if self._frames is None:
+            return
+        del self._frames
+        self._frames = None
+        self._pool.release(self.nbytes)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def frame_decode_pool(directory, frame_shape, luts, frames):
+    # This job's share of the process-wide pool, or None to decode inline:
+    # no pool on this platform, or the memory budget is taken by other jobs
+    pool = start_decode_pool()
+    if pool is None:
+        return None
+    frame_bytes = frame_shape[0] * frame_shape[1] * 4
+    window = min(DECODE_WINDOW_PER_WORKER * pool.workers, max(1, frames))
+    slots = pool.reserve(frame_bytes, len(luts), window)
+    if slots == 0:
+        return None
+    return FrameDecodePool(pool, directory, frame_shape, luts, slots)
+
+
+def decode_inline(items, lut):
+    # Single-process counterpart of FrameDecodePool.decode
+    for tag, content in items:
+        if content is None:
+            yield tag, None, None
+            continue
+        started = time.perf_counter()
+        with Image.open(BytesIO(content)) as image:
+            grid = decode_frame(image, lut)
+        yield tag, grid, time.perf_counter() - started
@@ -0,0 +1,60 @@
+import os
+import signal
+import threading
+
+from waitress import create_server
+
+from netcdf_generator import app, job_manager
+from parallel_decode import stop_decode_pool
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+HOST = os.environ.get("GIBS_HOST", "127.0.0.1")
+PORT = int(os.environ.get("GIBS_PORT", 5000))
+# Each open job-events stream holds a thread, so leave plenty for them on top
+# of regular requests; extractions run on the job workers, not these threads
+SERVER_THREADS = int(os.environ.get("GIBS_SERVER_THREADS", 32))
+# How long running and queued extractions get to finish on shutdown before
+# they are cancelled
+DRAIN_SECONDS = float(os.environ.get("GIBS_DRAIN_SECONDS", 600))
+
+
+# ------------------------------
+# PRODUCTION SERVER
+# ------------------------------
+def serve(host=HOST, port=PORT, threads=SERVER_THREADS, drain_seconds=DRAIN_SECONDS):
+    # One process, so every request sees the same job manager, frame cache
+    # and catalog. SIGTERM / SIGINT stop new jobs (/save_data answers 503 and
+    # /readyz turns 503) while progress and results stay available, wait for
+    # the running jobs, then exit.
+    server = create_server(app, host=host, port=port, threads=threads, channel_timeout=120)
+    stopping = threading.Event()
+
+    def shutdown(signum, frame):
+        if stopping.is_set():
+            # A second signal skips the drain
+            print("Stopping now")
+            os._exit(1)
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    thread = threading.Thread(target=server.run, name="waitress", daemon=True)
+    thread.start()
+    print(f"Serving API and frontend on http://{host}:{port}/ with {threads} threads")
+
+    stopping.wait()
+    active = len(job_manager.active())
+    print(f"Shutting down: draining {active} job(s), up to {drain_seconds:.0f}s")
+    cancelled = job_manager.drain(timeout=drain_seconds)
+    if cancelled:
+        print(f"Cancelled {len(cancelled)} job(s) that did not finish in time")
+    server.close()
+    stop_decode_pool()
+    print("Done.")
+
+
+if __name__ == "__main__":
+    serve()
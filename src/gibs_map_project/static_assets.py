@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Response
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+FRONTEND_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+INDEX_FILE = "index.html"
+# Everything else in this directory is server code and is never served
+FRONTEND_FILES = ("index.html", "my_map.js", "layers/layers_info.json")
+FRONTEND_DIRECTORIES = ("css", "lib")
+
+# lib/ paths carry the library version, so browsers may keep them for good;
+# the rest revalidates with its ETag on every load
+IMMUTABLE_DIRECTORIES = ("lib",)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+GZIP_MIN_BYTES = 1024
+GZIP_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+# ------------------------------
+# STATIC ASSETS
+# ------------------------------
+class StaticAssets:
+    # Serves the frontend from memory: each file is read, hashed and gzipped
+    # once per modification, then answered with ETag / 304 and Cache-Control
+    def __init__(self, root=FRONTEND_DIRECTORY, files=FRONTEND_FILES, directories=FRONTEND_DIRECTORIES):
+        self.root = root
+        self.files = set(files)
+        self.directories = tuple(directories)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def allowed(self, name):
+        parts = name.split("/")
+        if any(part in ("", ".", "..") for part in parts):
+            return False
+        return name in self.files or (len(parts) > 1 and parts[0] in self.directories)
+
+    def _entry(self, name):
+        path = os.path.join(self.root, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry["version"] == version:
+                return entry
+
+        with open(path, "rb") as f:
+            body = f.read()
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        gzipped = None
+        if len(body) >= GZIP_MIN_BYTES and mimetype.startswith(GZIP_TYPES):
+            gzipped = gzip.compress(body, compresslevel=9)
+
+        entry = {
+            "version": version,
+            "body": body,
+            "gzipped": gzipped,
+            "mimetype": mimetype,
+            "etag": hashlib.sha256(body).hexdigest()[:20],
+            "cache_control": (
+                IMMUTABLE_CACHE_CONTROL if name.split("/")[0] in IMMUTABLE_DIRECTORIES else REVALIDATE_CACHE_CONTROL
+            ),
+        }
+        with self._lock:
+            self._entries[name] = entry
+        return entry
+
+    def response(self, name, request):
+        # Returns None when name is not part of the frontend
+        name = name or INDEX_FILE
+        if not self.allowed(name):
+            return None
+        entry = self._entry(name)
+        if entry is None:
+            return None
+
+        use_gzip = entry["gzipped"] is not None and "gzip" in request.accept_encodings
+        # Each encoding is its own representation, so it gets its own ETag
+        etag = entry["etag"] + ("-gzip" if use_gzip else "")
+        headers = {"Cache-Control": entry["cache_control"], "Vary": "Accept-Encoding"}
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(entry["gzipped"] if use_gzip else entry["body"], mimetype=entry["mimetype"],
+                                headers=headers)
+            if use_gzip:
+                response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(etag)
+        return response
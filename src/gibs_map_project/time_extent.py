@@ -0,0 +1,130 @@
+import re
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# ------------------------------
+# ISO 8601 DURATIONS
+# ------------------------------
+DURATION_PATTERN = re.compile(
+    r"^P(?:(?P<years>\d+)Y)?(?:(?P<months>\d+)M)?(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?"
+    r"(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$"
+)
+
+DATE_FORMAT = "%Y-%m-%d"
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# One frame (or set of tiles) per timestep: about 13 years of a daily layer,
+# or a month of a 10-minute one
+MAX_TIMESTEPS = 5000
+
+
+class TimeInterval(NamedTuple):
+    start: pd.Timestamp
+    end: pd.Timestamp
+    months: int
+    step: pd.Timedelta
+
+
+def parse_duration(duration):
+    match = DURATION_PATTERN.match(duration)
+    if match is None or duration in ("P", "PT"):
+        raise ValueError(f"Unsupported ISO 8601 duration: {duration}")
+
+    parts = {key: int(value or 0) for key, value in match.groupdict().items()}
+    months = parts["years"] * 12 + parts["months"]
+    step = pd.Timedelta(
+        weeks=parts["weeks"], days=parts["days"],
+        hours=parts["hours"], minutes=parts["minutes"], seconds=parts["seconds"],
+    )
+    return months, step
+
+
+def parse_timestamp(value):
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+    return timestamp
+
+
+def parse_time_extent(time_extent):
+    intervals = []
+    for value in time_extent:
+        start, end, period = value.split("/")
+        months, step = parse_duration(period)
+        intervals.append(TimeInterval(parse_timestamp(start), parse_timestamp(end), months, step))
+    return intervals
+
+
+# ------------------------------
+# TIMESTEP ENUMERATION
+# ------------------------------
+def too_many_timesteps(count, max_steps):
+    return ValueError(
+        f"The date range covers {count} timesteps of this layer (limit {max_steps}); request a shorter range"
+    )
+
+
+def interval_timesteps(interval, window_start, window_end, max_steps=MAX_TIMESTEPS):
+    lower = max(interval.start, window_start)
+    upper = min(interval.end, window_end)
+    if lower > upper:
+        return pd.DatetimeIndex([])
+
+    if interval.months == 0:
+        # Fixed step: jump straight to the first and last index in the window
+        if interval.step <= pd.Timedelta(0):
+            return pd.DatetimeIndex([interval.start]) if lower <= interval.start <= upper else pd.DatetimeIndex([])
+        first = -((interval.start - lower) // interval.step)
+        last = (upper - interval.start) // interval.step
+        # Counted before anything is built, so PT1M over years fails fast
+        if last - first + 1 > max_steps:
+            raise too_many_timesteps(last - first + 1, max_steps)
+        return pd.DatetimeIndex(interval.start + pd.to_timedelta(np.arange(first, last + 1) * interval.step.value))
+
+    # Calendar months (plus any extra days): skip whole periods before the window
+    elapsed_months = (lower.year - interval.start.year) * 12 + lower.month - interval.start.month
+    k = max(0, elapsed_months // interval.months - 1)
+
+    steps = []
+    while True:
+        # Offset from the interval start each time so month-end starts don't drift
+        current = interval.start + pd.DateOffset(months=k * interval.months) + k * interval.step
+        if current > upper:
+            break
+        if current >= lower:
+            steps.append(current)
+            if len(steps) > max_steps:
+                raise too_many_timesteps(f"more than {max_steps}", max_steps)
+        k += 1
+    return pd.DatetimeIndex(steps)
+
+
+def timesteps(time_extent, window_start, window_end, max_steps=MAX_TIMESTEPS):
+    # Valid timesteps of a layer's TimeExtent that fall inside [window_start,
+    # window_end], sorted and without duplicates where intervals touch. Raises
+    # ValueError past max_steps.
+    window_start = parse_timestamp(window_start)
+    window_end = parse_timestamp(window_end)
+
+    index = pd.DatetimeIndex([])
+    for interval in parse_time_extent(time_extent):
+        index = index.union(interval_timesteps(interval, window_start, window_end, max_steps))
+        if len(index) > max_steps:
+            raise too_many_timesteps(len(index), max_steps)
+    return index
+
+
+def extent_bounds(time_extent):
+    intervals = parse_time_extent(time_extent)
+    return min(i.start for i in intervals), max(i.end for i in intervals)
+
+
+def format_time(time_value):
+    # GIBS accepts plain dates for daily and coarser layers; sub-daily layers
+    # need the full UTC timestamp
+    time_value = pd.Timestamp(time_value)
+    if time_value == time_value.normalize():
+        return time_value.strftime(DATE_FORMAT)
+    return time_value.strftime(DATETIME_FORMAT)
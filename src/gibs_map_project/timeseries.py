@@ -0,0 +1,318 @@
+import math
+import os
+import tempfile
+import time
+from collections import defaultdict
+from io import BytesIO
+
+import netCDF4
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from colormap_decoder import decode_pixels
+from extraction import layer_details, layer_timesteps, colormap_registry, frame_cache, DATE_FORMAT
+from frame_downloader import create_session, ordered_map, MAX_CONCURRENCY
+from metrics import record_decode
+from netcdf_writer import TIME_UNITS, TIME_CALENDAR
+from time_extent import format_time
+from vector_extraction import is_vector_layer
+from wmts_tiles import TILE_SIZE, ORIGIN_LON, ORIGIN_LAT, native_level, level_resolution, fetch_tile
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+DEFAULT_CONCURRENCY = 16
+MAX_TARGETS = 500
+# Pixels one polygon may cover; this endpoint is for stations and small areas
+MAX_POLYGON_PIXELS = 10000
+# Tile requests one query may need (distinct tiles x timesteps). The query
+# runs on a request thread, so this keeps it to about a minute; longer series
+# go through /save_data as a job
+MAX_TILE_REQUESTS = 2000
+OUTPUT_FORMATS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "netcdf": "application/x-netcdf",
+}
+
+
+# ------------------------------
+# TARGET PIXELS
+# ------------------------------
+def point_pixel(lon, lat, resolution):
+    max_rows = round(180 / resolution)
+    max_cols = round(360 / resolution)
+    row = min(max_rows - 1, max(0, math.floor((ORIGIN_LAT - lat) / resolution)))
+    col = min(max_cols - 1, max(0, math.floor((lon - ORIGIN_LON) / resolution)))
+    return row, col
+
+
+def inside(ring, x, y):
+    # Even-odd rule over pixel centres, vectorised over x/y
+    result = np.zeros(x.shape, dtype=bool)
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        crosses = (y0 > y) != (y1 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        result ^= crosses & (x < x_cross)
+    return result
+
+
+def polygon_pixels(ring, resolution):
+    # Global (rows, cols) whose centres fall inside the ring; a polygon smaller
+    # than a pixel falls back to the pixel under its centroid
+    lons = [lon for lon, _ in ring]
+    lats = [lat for _, lat in ring]
+    row0, col0 = point_pixel(min(lons), max(lats), resolution)
+    row1, col1 = point_pixel(max(lons), min(lats), resolution)
+    if (row1 - row0 + 1) * (col1 - col0 + 1) > MAX_POLYGON_PIXELS:
+        raise ValueError(f"Polygon covers more than {MAX_POLYGON_PIXELS} pixels; use /save_data for large areas")
+
+    rows, cols = np.mgrid[row0:row1 + 1, col0:col1 + 1]
+    x = ORIGIN_LON + (cols + 0.5) * resolution
+    y = ORIGIN_LAT - (rows + 0.5) * resolution
+    mask = inside(ring, x, y)
+    if not mask.any():
+        row, col = point_pixel(sum(lons) / len(lons), sum(lats) / len(lats), resolution)
+        return np.array([row]), np.array([col])
+    return rows[mask], cols[mask]
+
+
+def parse_targets(data, resolution):
+    # [{"id", "lat", "lon"}] points and [{"id", "coordinates": [[lon, lat], ...]}]
+    # polygons -> [{"id", "lat", "lon", "rows", "cols"}]
+    points = data.get("points") or []
+    polygons = data.get("polygons") or []
+    if not isinstance(points, list) or not isinstance(polygons, list):
+        raise ValueError("points and polygons must be lists")
+    if not points and not polygons:
+        raise ValueError("Give at least one point or polygon")
+    if len(points) + len(polygons) > MAX_TARGETS:
+        raise ValueError(f"At most {MAX_TARGETS} points and polygons per request")
+
+    targets = []
+    for i, point in enumerate(points):
+        lat, lon = float(point["lat"]), float(point["lon"])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"Point {point.get('id', i)} is outside -180..180 / -90..90")
+        row, col = point_pixel(lon, lat, resolution)
+        targets.append({
+            "id": str(point.get("id", f"point{i}")), "lat": lat, "lon": lon,
+            "rows": np.array([row]), "cols": np.array([col]),
+        })
+
+    for i, polygon in enumerate(polygons):
+        ring = [(float(lon), float(lat)) for lon, lat in polygon["coordinates"]]
+        if len(ring) < 3:
+            raise ValueError(f"Polygon {polygon.get('id', i)} needs at least 3 vertices")
+        if ring[0] == ring[-1]:
+            ring = ring[:-1]
+        rows, cols = polygon_pixels(ring, resolution)
+        targets.append({
+            "id": str(polygon.get("id", f"polygon{i}")),
+            "lat": float(np.mean([lat for _, lat in ring])), "lon": float(np.mean([lon for lon, _ in ring])),
+            "rows": rows, "cols": cols,
+        })
+
+    ids = [target["id"] for target in targets]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Point and polygon ids must be unique")
+    return targets
+
+
+def tile_samples(targets):
+    # {(tile_row, tile_col): (target indices, rows in tile, cols in tile)}
+    grouped = defaultdict(lambda: ([], [], []))
+    for index, target in enumerate(targets):
+        for row, col in zip(target["rows"], target["cols"]):
+            entry = grouped[(int(row) // TILE_SIZE, int(col) // TILE_SIZE)]
+            entry[0].append(index)
+            entry[1].append(int(row) % TILE_SIZE)
+            entry[2].append(int(col) % TILE_SIZE)
+    return {tile: tuple(np.array(values) for values in entry) for tile, entry in grouped.items()}
+
+
+# ------------------------------
+# REQUEST PARAMETERS
+# ------------------------------
+def parse_timeseries_request(data):
+    # Raises ValueError/TypeError so the route can answer 400
+    layer = data.get("layer")
+    if not layer:
+        raise ValueError("Missing required parameter: layer")
+    info = layer_details(layer)
+    if not info.get("Template") or is_vector_layer(info):
+        raise ValueError(f"{layer} is not a raster tile layer")
+    metadata_href = data.get("metadataHref") or info.get("MetadataHref")
+    if not metadata_href:
+        raise ValueError(f"{layer} has no colormap to invert")
+
+    for key in ("startDate", "endDate"):
+        if not data.get(key):
+            raise ValueError(f"Missing required parameter: {key}")
+    start_date = pd.Timestamp(data["startDate"]).strftime(DATE_FORMAT)
+    end_date = pd.Timestamp(data["endDate"]).strftime(DATE_FORMAT)
+    if start_date > end_date:
+        raise ValueError("startDate must not be after endDate")
+
+    output_format = data.get("format", "csv")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(OUTPUT_FORMATS)}")
+    concurrency = int(data.get("concurrency", DEFAULT_CONCURRENCY))
+    if not 1 <= concurrency <= MAX_CONCURRENCY:
+        raise ValueError(f"concurrency must be between 1 and {MAX_CONCURRENCY}")
+
+    level = native_level(info["TileMatrixSet"])
+    targets = parse_targets(data, level_resolution(level))
+    samples = tile_samples(targets)
+    steps = layer_timesteps(layer, start_date, end_date)
+    if len(samples) * len(steps) > MAX_TILE_REQUESTS:
+        raise ValueError(
+            f"This needs {len(samples) * len(steps)} tile requests (limit {MAX_TILE_REQUESTS}); "
+            "shorten the date window, split the points or use /save_data"
+        )
+
+    return {
+        "layer": layer,
+        "layer_info": info,
+        "metadata_href": metadata_href,
+        "start_date": start_date,
+        "end_date": end_date,
+        "level": level,
+        "targets": targets,
+        "samples": samples,
+        "timesteps": steps,
+        "format": output_format,
+        "concurrency": concurrency,
+    }
+
+
+# ------------------------------
+# SAMPLING
+# ------------------------------
+def sample_timeseries(params):
+    # Fetches only the tiles under the targets, concurrently over one session,
+    # and returns a (id, time, value, pixels) DataFrame. Polygons get the mean
+    # of their valid pixels; pixels counts the valid pixels behind each value.
+    lut = colormap_registry.get(params["metadata_href"]).lut
+    layer_info, level = params["layer_info"], params["level"]
+    targets, samples = params["targets"], params["samples"]
+    steps = params["timesteps"]
+
+    totals = np.zeros((len(targets), len(steps)), dtype=np.float64)
+    counts = np.zeros((len(targets), len(steps)), dtype=np.int64)
+    failed = np.zeros((len(targets), len(steps)), dtype=bool)
+
+    def fetch(task):
+        step, tile = task
+        try:
+            content = fetch_tile(session, layer_info, format_time(steps[step]), level, *tile, cache=frame_cache)
+            indices, rows, cols = samples[tile]
+            started = time.perf_counter()
+            with Image.open(BytesIO(content)) as image:
+                values = decode_pixels(image, lut, rows, cols)
+            record_decode("points", time.perf_counter() - started, len(values))
+            return task, values, None
+        except Exception as e:
+            return task, None, str(e)
+
+    tasks = ((step, tile) for step in range(len(steps)) for tile in samples)
+    session = create_session(params["concurrency"])
+    try:
+        for (step, tile), values, error in ordered_map(fetch, tasks, params["concurrency"]):
+            if error is not None:
+                print(f"Failed to fetch tile {tile} of {params['layer']} for {format_time(steps[step])}: {error}")
+                failed[samples[tile][0], step] = True
+                continue
+            valid = ~np.isnan(values)
+            indices = samples[tile][0]
+            np.add.at(totals[:, step], indices[valid], values[valid])
+            np.add.at(counts[:, step], indices[valid], 1)
+    finally:
+        session.close()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (totals / counts).astype(np.float32)
+    # A polygon with one of its tiles missing has no trustworthy mean
+    means[failed] = np.nan
+    counts[failed] = 0
+
+    table = pd.DataFrame({
+        "id": np.repeat([target["id"] for target in targets], len(steps)),
+        "time": np.tile(pd.DatetimeIndex(steps).values, len(targets)),
+        "value": means.ravel(),
+        "pixels": counts.ravel(),
+    })
+    missing = [format_time(steps[step]) for step in np.flatnonzero(failed.any(axis=0))]
+    return table, missing
+
+
+# ------------------------------
+# OUTPUT
+# ------------------------------
+def timeseries_netcdf(table, params, units, title):
+    # CF discrete sampling geometry: one time series per point or polygon
+    targets = params["targets"]
+    steps = pd.DatetimeIndex(params["timesteps"])
+    fd, path = tempfile.mkstemp(suffix=".nc")
+    os.close(fd)
+    try:
+        with netCDF4.Dataset(path, "w", format="NETCDF4") as ds:
+            ds.featureType = "timeSeries"
+            ds.source_layer = params["layer"]
+            ds.createDimension("station", len(targets))
+            ds.createDimension("time", len(steps))
+
+            station = ds.createVariable("station_id", str, ("station",))
+            station.cf_role = "timeseries_id"
+            station[:] = np.array([target["id"] for target in targets], dtype=object)
+
+            for name, units_name, key in (("latitude", "degrees_north", "lat"), ("longitude", "degrees_east", "lon")):
+                variable = ds.createVariable(name, "f8", ("station",))
+                variable.units = units_name
+                variable.standard_name = name
+                variable[:] = [target[key] for target in targets]
+
+            time_variable = ds.createVariable("time", "f8", ("time",))
+            time_variable.units = TIME_UNITS
+            time_variable.calendar = TIME_CALENDAR
+            time_variable.standard_name = "time"
+            time_variable[:] = netCDF4.date2num(list(steps.to_pydatetime()), TIME_UNITS, TIME_CALENDAR)
+
+            value = ds.createVariable("value", "f4", ("station", "time"), fill_value=np.float32(np.nan))
+            value.coordinates = "time latitude longitude"
+            if units is not None:
+                value.units = units
+            if title is not None:
+                value.long_name = title
+            value[:] = table["value"].to_numpy().reshape(len(targets), len(steps))
+
+            pixels = ds.createVariable("pixels", "i4", ("station", "time"))
+            pixels.long_name = "number of valid pixels behind value"
+            pixels[:] = table["pixels"].to_numpy().reshape(len(targets), len(steps))
+
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def render_timeseries(table, params):
+    # -> (body bytes, mime type, file name)
+    output_format = params["format"]
+    safe_layer = "".join(c if c.isalnum() or c in "-_" else "_" for c in params["layer"])
+    extension = {"csv": "csv", "parquet": "parquet", "netcdf": "nc"}[output_format]
+    filename = f"{safe_layer}_{params['start_date']}_{params['end_date']}_timeseries.{extension}"
+
+    if output_format == "csv":
+        body = table.to_csv(index=False, date_format="%Y-%m-%dT%H:%M:%SZ").encode()
+    elif output_format == "parquet":
+        buffer = BytesIO()
+        table.to_parquet(buffer, index=False)
+        body = buffer.getvalue()
+    else:
+        colormap = colormap_registry.get(params["metadata_href"])
+        body = timeseries_netcdf(table, params, colormap.units, colormap.title)
+
+    return body, OUTPUT_FORMATS[output_format], filename
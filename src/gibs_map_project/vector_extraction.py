@@ -0,0 +1,408 @@
+import json
+import struct
+import time
+
+import mapbox_vector_tile
+import netCDF4
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+
+from frame_downloader import create_session, ordered_map, DEFAULT_CONCURRENCY
+from metrics import record_features
+from netcdf_writer import TIME_UNITS, TIME_CALENDAR
+from time_extent import format_time
+from wmts_tiles import TILE_SIZE, ORIGIN_LON, ORIGIN_LAT, fetch_tile, native_level, level_resolution, pixel_window, window_tiles
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+VECTOR_FORMAT = "application/vnd.mapbox-vector-tile"
+VECTOR_OUTPUT_FORMATS = ("parquet", "netcdf")
+# Rows buffered before a Parquet row group / NetCDF append
+BATCH_ROWS = 50000
+# Property types from the layer's vector metadata; "datetime" values are kept
+# as the strings GIBS publishes
+PROPERTY_TYPES = {"int": "int", "float": "float", "string": "string", "datetime": "string"}
+# Columns every output has; properties with the same name get a suffix
+POINT_COLUMNS = ("time", "longitude", "latitude", "geometry")
+
+
+def is_vector_layer(info):
+    return info.get("Format") == VECTOR_FORMAT
+
+
+# ------------------------------
+# PROPERTY SCHEMA
+# ------------------------------
+def property_schema(layer_info):
+    # [(name, "int" | "float" | "string")] from VectorProperties, or None when
+    # the layer has none and the schema has to come from the features
+    properties = layer_info.get("VectorProperties")
+    if not properties:
+        return None
+    return [(p["Identifier"], PROPERTY_TYPES.get(p.get("DataType"), "string")) for p in properties]
+
+
+def infer_schema(property_sets, schema=()):
+    # Widens schema with every property seen; a name seen with both ints and
+    # floats becomes float, with anything else mixed in a string
+    schema = dict(schema)
+    for properties in property_sets:
+        for name, value in properties.items():
+            if isinstance(value, int):
+                kind = "int"
+            elif isinstance(value, float):
+                kind = "float"
+            else:
+                kind = "string"
+            if schema.get(name, kind) != kind:
+                kind = "float" if {kind, schema[name]} == {"int", "float"} else "string"
+            schema[name] = kind
+    return sorted(schema.items())
+
+
+def column_name(name):
+    return f"{name}_property" if name in POINT_COLUMNS else name
+
+
+def fits(value, kind):
+    if kind == "int":
+        return isinstance(value, int) or (isinstance(value, float) and value.is_integer())
+    if kind == "float":
+        return isinstance(value, (int, float))
+    return True
+
+
+def column_values(features, name, kind):
+    values = [properties.get(name) for _, _, _, properties in features]
+    if kind == "int":
+        return [int(v) if v is not None and fits(v, kind) else None for v in values]
+    if kind == "float":
+        return [float(v) if v is not None and fits(v, kind) else None for v in values]
+    return [None if v is None else str(v) for v in values]
+
+
+def schema_misfits(features, schema, unknown, conflicts):
+    # Collects properties the schema has no column for and counts values
+    # that do not fit their column's type; both are written as missing
+    kinds = dict(schema)
+    for _, _, _, properties in features:
+        for name, value in properties.items():
+            kind = kinds.get(name)
+            if kind is None:
+                unknown.add(name)
+            elif value is not None and not fits(value, kind):
+                conflicts[name] = conflicts.get(name, 0) + 1
+
+
+# ------------------------------
+# TILE DECODING
+# ------------------------------
+def fetch_vector_tile(session, layer_info, time_str, level, row, col, cache=None, stats=None):
+    try:
+        return fetch_tile(session, layer_info, time_str, level, row, col, cache, stats)
+    except requests.HTTPError as e:
+        # GIBS answers 404 for tiles without features
+        if e.response is None or e.response.status_code != 404:
+            raise
+        return b""
+
+
+def tile_properties(content):
+    # Properties of every point feature in a tile, buffer included
+    if not content:
+        return []
+    tile = mapbox_vector_tile.decode(content)
+    return [
+        feature["properties"]
+        for tile_layer in tile.values() for feature in tile_layer["features"]
+        if feature["geometry"]["type"] in ("Point", "MultiPoint")
+    ]
+
+
+def tile_points(content, row, col, level, bbox):
+    # Decodes one MVT tile into (lon, lat, properties) for the points that
+    # the tile owns and that fall inside bbox. MVT tiles repeat features near
+    # their edges in a buffer; only the tile whose extent contains a point
+    # (half-open on the east/south side) keeps it, so no point is written
+    # twice. Returns (points, skipped non-point features).
+    span = TILE_SIZE * level_resolution(level)
+    lon0 = ORIGIN_LON + col * span
+    lat0 = ORIGIN_LAT - row * span
+    lonmin, latmin, lonmax, latmax = bbox
+
+    points = []
+    skipped = 0
+    if not content:
+        return points, skipped
+
+    tile = mapbox_vector_tile.decode(content, default_options={"y_coord_down": True})
+    for tile_layer in tile.values():
+        extent = tile_layer.get("extent", 4096)
+        for feature in tile_layer["features"]:
+            geometry = feature["geometry"]
+            if geometry["type"] == "Point":
+                coordinates = [geometry["coordinates"]]
+            elif geometry["type"] == "MultiPoint":
+                coordinates = geometry["coordinates"]
+            else:
+                skipped += 1
+                continue
+
+            for x, y in coordinates:
+                if not (0 <= x < extent and 0 <= y < extent):
+                    continue
+                lon = lon0 + x / extent * span
+                lat = lat0 - y / extent * span
+                if lonmin <= lon <= lonmax and latmin <= lat <= latmax:
+                    points.append((lon, lat, feature["properties"]))
+    return points, skipped
+
+
+# ------------------------------
+# COLUMNAR WRITERS
+# ------------------------------
+def point_wkb(lon, lat):
+    # Little-endian WKB Point
+    return struct.pack("<BIdd", 1, 1, lon, lat)
+
+
+class GeoParquetWriter:
+    # Streams (time, lon, lat, properties) rows into a GeoParquet file, one
+    # row group per batch
+    ARROW_TYPES = {"int": pa.int64(), "float": pa.float64(), "string": pa.string()}
+
+    def __init__(self, path, schema):
+        self.schema = schema
+        fields = [
+            pa.field("time", pa.timestamp("s")),
+            pa.field("longitude", pa.float64()),
+            pa.field("latitude", pa.float64()),
+            pa.field("geometry", pa.binary()),
+        ] + [pa.field(column_name(name), self.ARROW_TYPES[kind]) for name, kind in schema]
+        geo = {
+            "version": "1.0.0",
+            "primary_column": "geometry",
+            "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Point"]}},
+        }
+        self._schema = pa.schema(fields, metadata={b"geo": json.dumps(geo).encode()})
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+
+    def write(self, features):
+        columns = {
+            "time": [pd.Timestamp(t).to_pydatetime() for t, _, _, _ in features],
+            "longitude": [lon for _, lon, _, _ in features],
+            "latitude": [lat for _, _, lat, _ in features],
+            "geometry": [point_wkb(lon, lat) for _, lon, lat, _ in features],
+        }
+        for name, kind in self.schema:
+            columns[column_name(name)] = column_values(features, name, kind)
+        self._writer.write_table(pa.Table.from_pydict(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class PointTableWriter:
+    # Streams rows into a NetCDF point table (CF featureType "point") with an
+    # unlimited obs dimension
+    NETCDF_TYPES = {"int": "i8", "float": "f8", "string": str}
+    FILL_VALUES = {"int": np.int64(-9999), "float": np.float64(np.nan), "string": None}
+
+    def __init__(self, path, schema, layer):
+        self.schema = schema
+        self.size = 0
+        self._ds = netCDF4.Dataset(path, "w", format="NETCDF4")
+        self._ds.featureType = "point"
+        self._ds.source_layer = layer
+        self._ds.createDimension("obs", None)
+
+        self._time = self._ds.createVariable("time", "f8", ("obs",))
+        self._time.units = TIME_UNITS
+        self._time.calendar = TIME_CALENDAR
+        self._time.standard_name = "time"
+        self._lat = self._ds.createVariable("latitude", "f8", ("obs",))
+        self._lat.units = "degrees_north"
+        self._lat.standard_name = "latitude"
+        self._lon = self._ds.createVariable("longitude", "f8", ("obs",))
+        self._lon.units = "degrees_east"
+        self._lon.standard_name = "longitude"
+
+        self._properties = {}
+        for name, kind in schema:
+            variable_name = "".join(c if c.isalnum() or c == "_" else "_" for c in column_name(name))
+            variable = self._ds.createVariable(
+                variable_name, self.NETCDF_TYPES[kind], ("obs",), fill_value=self.FILL_VALUES[kind]
+            )
+            variable.coordinates = "time latitude longitude"
+            self._properties[name] = (variable, kind)
+
+    def write(self, features):
+        index = slice(self.size, self.size + len(features))
+        times = [pd.Timestamp(t).to_pydatetime() for t, _, _, _ in features]
+        self._time[index] = netCDF4.date2num(times, TIME_UNITS, TIME_CALENDAR)
+        self._lon[index] = [lon for _, lon, _, _ in features]
+        self._lat[index] = [lat for _, _, lat, _ in features]
+        for name, (variable, kind) in self._properties.items():
+            values = column_values(features, name, kind)
+            if kind == "string":
+                variable[index] = np.array(["" if v is None else v for v in values], dtype=object)
+            else:
+                fill = self.FILL_VALUES[kind]
+                variable[index] = np.array([fill if v is None else v for v in values])
+        self.size += len(features)
+
+    def close(self):
+        if self._ds.isopen():
+            self._ds.close()
+
+
+# ------------------------------
+# VECTOR EXTRACTION
+# ------------------------------
+def extract_vector(job, stats, layer_info, path, cache=None):
+    # Walks every tile under the bbox for every timestep, concurrently and in
+    # order, and streams the points into path. Memory stays at one batch of
+    # rows plus the tiles in flight. Returns the result dict for the job.
+    params = job.params
+    bbox = (params["lonmin"], params["latmin"], params["lonmax"], params["latmax"])
+    level = native_level(layer_info["TileMatrixSet"])
+    tile_rows, tile_cols = window_tiles(pixel_window(bbox, level))
+    time_range = params["timesteps"]
+    tiles_per_step = len(tile_rows) * len(tile_cols)
+
+    job.update("download", done=0, total=len(time_range) * tiles_per_step)
+    job.update("decode", done=0, total=len(time_range) * tiles_per_step)
+    job.update("write", done=0, total=len(time_range))
+
+    def fetch(task):
+        time_value, row, col = task
+        try:
+            content = fetch_vector_tile(session, layer_info, format_time(time_value), level, row, col, cache, stats)
+            started = time.perf_counter()
+            points, skipped = tile_points(content, row, col, level, bbox)
+            record_features("mvt", time.perf_counter() - started, len(points), stats)
+            return task, points, skipped, None
+        except Exception as e:
+            return task, None, 0, str(e)
+
+    def sample(time_value):
+        # Properties in the first tile of a timestep; the tile goes through
+        # the cache, so the main pass does not fetch it again
+        try:
+            content = fetch_vector_tile(
+                session, layer_info, format_time(time_value), level, tile_rows[0], tile_cols[0], cache, stats
+            )
+            return tile_properties(content)
+        except Exception:
+            return []
+
+    concurrency = params.get("concurrency", DEFAULT_CONCURRENCY)
+    session = create_session(concurrency)
+    schema = property_schema(layer_info)
+    inferred = schema is None
+    if inferred:
+        # No VectorProperties: the columns come from the first tile of every
+        # timestep, widened once more by the first batch of rows
+        samples = ordered_map(sample, time_range, concurrency)
+        try:
+            schema = infer_schema(properties for property_sets in samples for properties in property_sets)
+        finally:
+            samples.close()
+    writer = None
+    batch = []
+    seen = set()
+    current_time = None
+    failed_tiles = 0
+    # A date is missing when none of its tiles could be fetched, and partial
+    # when only some could: its points from the others are still written
+    failed_dates, partial_dates = [], []
+    features = skipped_features = 0
+    unknown_properties, conflicts = set(), {}
+
+    def flush():
+        nonlocal writer, schema
+        if not batch:
+            return
+        if writer is None:
+            if inferred:
+                schema = infer_schema((properties for _, _, _, properties in batch), schema)
+            if params["format"] == "netcdf":
+                writer = PointTableWriter(path, schema, layer_info["Layer"])
+            else:
+                writer = GeoParquetWriter(path, schema)
+        schema_misfits(batch, schema, unknown_properties, conflicts)
+        writer.write(batch)
+        batch.clear()
+
+    def finish_date():
+        if failed_tiles == tiles_per_step:
+            failed_dates.append(format_time(current_time))
+        elif failed_tiles:
+            partial_dates.append(format_time(current_time))
+        job.advance("write")
+
+    tasks = ((t, row, col) for t in time_range for row in tile_rows for col in tile_cols)
+    results = ordered_map(fetch, tasks, concurrency)
+    try:
+        for (time_value, row, col), points, skipped, error in results:
+            job.check_cancelled()
+            job.advance("download")
+            job.advance("decode")
+
+            if time_value != current_time:
+                if current_time is not None:
+                    finish_date()
+                current_time = time_value
+                failed_tiles = 0
+                seen.clear()
+
+            if error is not None:
+                if not failed_tiles:
+                    time_str = format_time(time_value)
+                    print(f"Failed to fetch {layer_info['Layer']} tile {row}/{col} for {time_str}: {error}")
+                failed_tiles += 1
+                continue
+
+            skipped_features += skipped
+            for lon, lat, properties in points:
+                # Producers that round coordinates can still leave exact
+                # duplicates in neighbouring tiles
+                key = (round(lon, 7), round(lat, 7), json.dumps(properties, sort_keys=True, default=str))
+                if key in seen:
+                    continue
+                seen.add(key)
+                batch.append((time_value, lon, lat, properties))
+                features += 1
+            if len(batch) >= BATCH_ROWS:
+                flush()
+
+        if current_time is not None:
+            finish_date()
+        flush()
+        if writer is None:
+            # No points at all: still hand back a valid, empty table
+            schema = schema or []
+            writer = PointTableWriter(path, schema, layer_info["Layer"]) if params["format"] == "netcdf" \
+                else GeoParquetWriter(path, schema)
+    finally:
+        # Stop the fetches still queued or in flight before their session goes
+        results.close()
+        session.close()
+        if writer is not None:
+            writer.close()
+
+    if skipped_features:
+        print(f"Skipped {skipped_features} line/polygon features of {layer_info['Layer']}: only points are exported")
+    if unknown_properties or conflicts:
+        print(
+            f"{layer_info['Layer']}: properties without a column: {', '.join(sorted(unknown_properties)) or 'none'}; "
+            f"values of the wrong type: {conflicts or 'none'}"
+        )
+    return {
+        "features": features, "skippedFeatures": skipped_features, "missingDates": failed_dates,
+        "partialDates": partial_dates, "droppedProperties": sorted(unknown_properties), "conflictingValues": conflicts,
+    }
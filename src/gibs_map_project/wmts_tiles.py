@@ -0,0 +1,216 @@
+import math
+import time
+from io import BytesIO
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from colormap_decoder import decode_frame
+from frame_cache import tile_key
+from frame_downloader import fetch_with_retries, ordered_map, DEFAULT_CONCURRENCY
+from metrics import record_download, record_decode
+from time_extent import format_time
+
+# ------------------------------
+# EPSG:4326 TILE GRID
+# ------------------------------
+TILE_SIZE = 512
+# Native pixels one WMTS frame may cover: a frame is held whole (float32) and
+# the writers and aggregator take it whole, so this is 256 MiB per copy
+MAX_NATIVE_PIXELS = 64 * 1024 ** 2
+LEVEL0_RESOLUTION = 0.5625
+ORIGIN_LON = -180.0
+ORIGIN_LAT = 90.0
+
+# Deepest TileMatrix of each GIBS EPSG:4326 TileMatrixSet
+MATRIX_SET_LEVELS = {
+    "2km": 5,
+    "1km": 6,
+    "500m": 7,
+    "250m": 8,
+    "125m": 9,
+    "62.5m": 10,
+    "31.25m": 11,
+    "15.625m": 12,
+}
+
+
+class PixelWindow(NamedTuple):
+    level: int
+    resolution: float
+    row0: int
+    row1: int
+    col0: int
+    col1: int
+
+    @property
+    def shape(self):
+        return self.row1 - self.row0, self.col1 - self.col0
+
+    @property
+    def bbox(self):
+        return (
+            ORIGIN_LON + self.col0 * self.resolution,
+            ORIGIN_LAT - self.row1 * self.resolution,
+            ORIGIN_LON + self.col1 * self.resolution,
+            ORIGIN_LAT - self.row0 * self.resolution,
+        )
+
+
+def native_level(matrix_set):
+    try:
+        return MATRIX_SET_LEVELS[matrix_set]
+    except KeyError:
+        raise ValueError(f"Unsupported TileMatrixSet: {matrix_set}")
+
+
+def level_resolution(level):
+    return LEVEL0_RESOLUTION / 2 ** level
+
+
+def pixel_window(bbox, level):
+    # Global pixel rows/cols at this level that cover the bbox, snapped outwards
+    lonmin, latmin, lonmax, latmax = bbox
+    resolution = level_resolution(level)
+    max_rows = round(180 / resolution)
+    max_cols = round(360 / resolution)
+
+    col0 = max(0, math.floor((lonmin - ORIGIN_LON) / resolution))
+    col1 = min(max_cols, math.ceil((lonmax - ORIGIN_LON) / resolution))
+    row0 = max(0, math.floor((ORIGIN_LAT - latmax) / resolution))
+    row1 = min(max_rows, math.ceil((ORIGIN_LAT - latmin) / resolution))
+
+    if col1 <= col0 or row1 <= row0:
+        raise ValueError(f"Bounding box {bbox} does not intersect the tile grid")
+
+    return PixelWindow(level, resolution, row0, row1, col0, col1)
+
+
+def check_window_size(window, max_pixels=MAX_NATIVE_PIXELS):
+    height, width = window.shape
+    if height * width > max_pixels:
+        side = math.sqrt(max_pixels) * window.resolution
+        raise ValueError(
+            f"The bounding box covers {width}x{height} native pixels at level {window.level} "
+            f"({window.resolution:g} degrees per pixel), more than {max_pixels}; keep it within about "
+            f"{side:.1f}x{side:.1f} degrees or use mode wms"
+        )
+    return window
+
+
+def window_tiles(window):
+    tile_rows = range(window.row0 // TILE_SIZE, (window.row1 - 1) // TILE_SIZE + 1)
+    tile_cols = range(window.col0 // TILE_SIZE, (window.col1 - 1) // TILE_SIZE + 1)
+    return tile_rows, tile_cols
+
+
+def tile_url(template, matrix_set, time_str, level, row, col):
+    return (
+        template.replace("{Time}", time_str)
+        .replace("{TileMatrixSet}", matrix_set)
+        .replace("{TileMatrix}", str(level))
+        .replace("{TileRow}", str(row))
+        .replace("{TileCol}", str(col))
+    )
+
+
+# ------------------------------
+# TILE FETCH + DECODE
+# ------------------------------
+def fetch_tile(session, layer_info, time_str, level, row, col, cache=None, stats=None):
+    url = tile_url(layer_info["Template"], layer_info["TileMatrixSet"], time_str, level, row, col)
+
+    def get():
+        started = time.perf_counter()
+        content = fetch_with_retries(session, url).content
+        record_download("wmts", time.perf_counter() - started, len(content), stats)
+        return content
+
+    if cache is None:
+        return get()
+    key = tile_key(layer_info["Layer"], time_str, layer_info["TileMatrixSet"], level, row, col)
+    return cache.get_or_fetch(key, get)
+
+
+def decoded_tile(session, layer_info, time_str, level, row, col, lut, cache=None, stats=None):
+    # Only the PNG goes into the cache; the decode is redone on every use
+    content = fetch_tile(session, layer_info, time_str, level, row, col, cache, stats)
+    started = time.perf_counter()
+    with Image.open(BytesIO(content)) as image:
+        grid = decode_frame(image, lut)
+    record_decode("wmts", time.perf_counter() - started, grid.size, stats)
+    return grid
+
+
+# ------------------------------
+# MOSAIC
+# ------------------------------
+def iter_native_bands(session, layer_info, bbox, time_range, lut,
+                      concurrency=DEFAULT_CONCURRENCY, cache=None, stats=None):
+    # Yields (time, row_offset, band, error) for each tile row of each date, in
+    # order. A band is one tile row cropped to the bbox window, so memory stays
+    # at one band plus the tiles in flight however large the area is. A failed
+    # tile fails its whole date: (time, None, None, error) is yielded once.
+    level = native_level(layer_info["TileMatrixSet"])
+    window = pixel_window(bbox, level)
+    tile_rows, tile_cols = window_tiles(window)
+    width = window.col1 - window.col0
+
+    def fetch(task):
+        time_value, row, col = task
+        try:
+            grid = decoded_tile(session, layer_info, format_time(time_value), level, row, col, lut, cache, stats)
+            return task, grid, None
+        except Exception as e:
+            return task, None, str(e)
+
+    tasks = ((t, row, col) for t in time_range for row in tile_rows for col in tile_cols)
+    results = ordered_map(fetch, tasks, concurrency)
+
+    failed_time = None
+    band = None
+    for (time_value, row, col), grid, error in results:
+        if time_value == failed_time:
+            continue
+        if error is not None:
+            failed_time = time_value
+            yield time_value, None, None, error
+            continue
+
+        band_row0 = max(window.row0, row * TILE_SIZE)
+        band_row1 = min(window.row1, (row + 1) * TILE_SIZE)
+        if col == tile_cols[0]:
+            band = np.full((band_row1 - band_row0, width), np.nan, dtype=np.float32)
+
+        col0 = max(window.col0, col * TILE_SIZE)
+        col1 = min(window.col1, (col + 1) * TILE_SIZE)
+        band[:, col0 - window.col0:col1 - window.col0] = grid[
+            band_row0 - row * TILE_SIZE:band_row1 - row * TILE_SIZE,
+            col0 - col * TILE_SIZE:col1 - col * TILE_SIZE,
+        ]
+
+        if col == tile_cols[-1]:
+            yield time_value, band_row0 - window.row0, band, None
+
+
+def native_frames(session, layer_info, bbox, time_range, lut, concurrency=DEFAULT_CONCURRENCY, cache=None,
+                  stats=None):
+    # Assembles the bands of each date into one north-up frame
+    window = pixel_window(bbox, native_level(layer_info["TileMatrixSet"]))
+    frame = None
+
+    for time_value, row_offset, band, error in iter_native_bands(
+        session, layer_info, bbox, time_range, lut, concurrency, cache, stats
+    ):
+        if error is not None:
+            frame = None
+            yield time_value, None, error
+            continue
+
+        if row_offset == 0:
+            frame = np.empty(window.shape, dtype=np.float32)
+        frame[row_offset:row_offset + band.shape[0]] = band
+
+        if row_offset + band.shape[0] == window.shape[0]:
+            yield time_value, frame, None
@@ -0,0 +1,157 @@
+import os
+import shutil
+import threading
+import warnings
+import zipfile
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import zarr
+from zarr.codecs import BloscCodec
+from zarr.errors import ZarrUserWarning
+
+from netcdf_writer import DEFAULT_COMPLEVEL, TIME_UNITS, TIME_CALENDAR
+
+# ------------------------------
+# SETTINGS
+# ------------------------------
+# Variables get one timestep per chunk in time, so a new date never rewrites
+# an old chunk, and square spatial chunks dask can read in parallel
+CHUNK_SIZE = 512
+# The time coordinate stays in one chunk (32 KiB at most), so readers load it
+# with a single request; each append rewrites that one small chunk
+TIME_CHUNK = 4096
+
+# One job per store at a time; jobs appending to the same store queue up
+_store_locks = {}
+_store_locks_lock = threading.Lock()
+
+
+def store_lock(path):
+    with _store_locks_lock:
+        return _store_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def encode_time(time_value):
+    return netCDF4.date2num(pd.Timestamp(time_value).to_pydatetime(), TIME_UNITS, TIME_CALENDAR)
+
+
+def check_store(path, lats, lons, variables):
+    # Raises ValueError when an existing store cannot take this grid and
+    # these variables; a path without a store passes
+    if not os.path.exists(os.path.join(path, "zarr.json")):
+        return
+    group = zarr.open_group(path, mode="r", use_consolidated=False)
+    if not (np.array_equal(group["latitude"][:], lats) and np.array_equal(group["longitude"][:], lons)):
+        raise ValueError(f"{os.path.basename(path)} was written on a different grid")
+    stored = set(group.array_keys()) - {"time", "latitude", "longitude"}
+    if stored != set(variables):
+        raise ValueError(
+            f"{os.path.basename(path)} holds {', '.join(sorted(stored))}, not {', '.join(sorted(variables))}"
+        )
+
+
+def last_store_time(path):
+    # Encoded time of the last step in an existing store, None for a new one
+    if not os.path.exists(os.path.join(path, "zarr.json")):
+        return None
+    times = zarr.open_group(path, mode="r", use_consolidated=False)["time"][:]
+    return float(times[-1]) if len(times) else None
+
+
+# ------------------------------
+# STREAMING ZARR WRITER
+# ------------------------------
+class ZarrWriter:
+    # Same interface as NetCDFWriter, writing a chunked, compressed Zarr store
+    # with xarray-style dimension names and CF time attributes. An existing
+    # store is appended to: its grid and variables must match, and only
+    # timesteps after its last one are added, so earlier chunks are never
+    # rewritten. Callers hold store_lock(path) while appending.
+    def __init__(self, path, lats, lons, variables, complevel=DEFAULT_COMPLEVEL, chunk_size=CHUNK_SIZE):
+        self.path = path
+        if os.path.exists(os.path.join(path, "zarr.json")):
+            self._open(lats, lons, variables)
+        else:
+            self._create(lats, lons, variables, complevel, chunk_size)
+        self.size = self._time.shape[0]
+
+    def _create(self, lats, lons, variables, complevel, chunk_size):
+        self._group = zarr.open_group(self.path, mode="w")
+        self._group.attrs["Conventions"] = "CF-1.8"
+
+        self._time = self._group.create_array(
+            "time", shape=(0,), chunks=(TIME_CHUNK,), dtype="f8", dimension_names=["time"], fill_value=np.nan,
+        )
+        self._time.attrs.update({"units": TIME_UNITS, "calendar": TIME_CALENDAR, "standard_name": "time"})
+
+        for name, values, units in (("latitude", lats, "degrees_north"), ("longitude", lons, "degrees_east")):
+            axis = self._group.create_array(name, shape=(len(values),), dtype="f8", dimension_names=[name])
+            axis[:] = values
+            axis.attrs.update({"units": units, "standard_name": name})
+
+        compressors = [BloscCodec(cname="zstd", clevel=complevel, shuffle="shuffle")] if complevel > 0 else None
+        chunks = (1, min(chunk_size, len(lats)), min(chunk_size, len(lons)))
+        self._variables = {}
+        for name, attrs in variables.items():
+            variable = self._group.create_array(
+                name, shape=(0, len(lats), len(lons)), chunks=chunks, dtype="f4",
+                dimension_names=["time", "latitude", "longitude"], fill_value=np.nan, compressors=compressors,
+            )
+            variable.attrs.update({key: value for key, value in attrs.items() if value is not None})
+            self._variables[name] = variable
+
+    def _open(self, lats, lons, variables):
+        check_store(self.path, lats, lons, variables)
+        self._group = zarr.open_group(self.path, mode="r+", use_consolidated=False)
+
+        self._time = self._group["time"]
+        self._variables = {name: self._group[name] for name in variables}
+        # Data is appended before its time, so a job that died mid-append
+        # leaves variables one step long; trim them back
+        for variable in self._variables.values():
+            if variable.shape[0] != self._time.shape[0]:
+                variable.resize((self._time.shape[0], *variable.shape[1:]))
+
+    def append(self, time_value, grids):
+        # grids maps variable name -> (latitude, longitude) array, south to
+        # north. Variables without a grid this step get a NaN frame.
+        index = self.size
+        for name, variable in self._variables.items():
+            grid = grids.get(name)
+            if grid is None:
+                variable.resize((index + 1, *variable.shape[1:]))
+            else:
+                variable.append(np.asarray(grid, dtype=np.float32)[None], axis=0)
+        self._time.append(np.array([encode_time(time_value)]))
+        self.size += 1
+        return index
+
+    def close(self):
+        # Every append is already on disk; refresh the consolidated metadata
+        # so readers open the store with a single request
+        if self._group is not None:
+            with warnings.catch_warnings():
+                # Consolidated metadata is a zarr-python extension in format 3
+                warnings.simplefilter("ignore", ZarrUserWarning)
+                zarr.consolidate_metadata(self.path)
+            self._group = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def zip_store(path, zip_path):
+    # Chunks are already compressed, so the archive just stores them.
+    # Readers open it through zarr's ZipStore without unpacking:
+    #   xr.open_zarr(zarr.storage.ZipStore(zip_path, mode="r"))
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for root, _, files in os.walk(path):
+            for filename in files:
+                full_path = os.path.join(root, filename)
+                archive.write(full_path, os.path.relpath(full_path, path))
+    shutil.rmtree(path)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The projects are flat script directories with sibling imports; put them,
+# and the benchmark stand-ins, on the path the way running them would
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("src/earthdata_project", "src/gibs_map_project", "benchmarks"):
+    sys.path.insert(0, os.path.join(REPO_DIR, directory))
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from lxml import etree
+from PIL import Image
+
+from colormap_decoder import build_lut, decode_frame, decode_frame_reference, parse_colormap
+
+COLORMAP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ColorMaps>
+<ColorMap title="No Data"><Entries>
+<ColorMapEntry rgb="0,0,0" transparent="true" nodata="true"/>
+</Entries></ColorMap>
+<ColorMap title="Test Field" units="K"><Entries>
+<ColorMapEntry rgb="10,0,200" transparent="false" value="[-INF,0)"/>
+<ColorMapEntry rgb="20,40,0" transparent="false" value="[0,1)"/>
+<ColorMapEntry rgb="30,0,90" transparent="false" value="[1,3)"/>
+<ColorMapEntry rgb="40,250,7" transparent="false" value="[3,+INF)"/>
+<ColorMapEntry rgb="50,50,50" transparent="false" value="5"/>
+<ColorMapEntry rgb="60,1,2" transparent="false"/>
+</Entries></ColorMap>
+</ColorMaps>
+"""
+
+# Colour -> value decode_frame must give it; NaN for nodata, entries without
+# a value and colours the colormap does not know
+EXPECTED = {
+    (10, 0, 200): 0.0,  # [-INF,0): the finite end
+    (20, 40, 0): 0.5,  # interval midpoint
+    (30, 0, 90): 2.0,
+    (40, 250, 7): 3.0,  # [3,+INF): the finite end
+    (50, 50, 50): 5.0,
+    (60, 1, 2): np.nan,
+    (0, 0, 0): np.nan,
+    (255, 255, 255): np.nan,
+}
+COLORS = np.array(list(EXPECTED), dtype=np.uint8)
+SHAPE = (12, 16)
+
+
+def color_map():
+    color_map, title, units = parse_colormap(etree.fromstring(COLORMAP))
+    assert (title, units) == ("Test Field", "K")
+    return color_map
+
+
+def color_indices():
+    indices = np.random.default_rng(7).integers(0, len(COLORS), SHAPE)
+    # Every colour at least once
+    indices.reshape(-1)[:len(COLORS)] = np.arange(len(COLORS))
+    return indices
+
+
+def image(mode):
+    indices = color_indices()
+    if mode == "P":
+        palette = Image.fromarray(indices.astype(np.uint8), "P")
+        palette.putpalette(COLORS.reshape(-1).tolist())
+        return palette
+    rgb = COLORS[indices]
+    if mode == "RGBA":
+        alpha = np.random.default_rng(8).integers(0, 256, (*SHAPE, 1), dtype=np.uint8)
+        return Image.fromarray(np.concatenate([rgb, alpha], axis=-1), "RGBA")
+    return Image.fromarray(rgb, "RGB")
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "P"])
+def test_decode_frame_matches_reference(mode):
+    frame = image(mode)
+    expected = np.array(list(EXPECTED.values()), dtype=np.float32)[color_indices()]
+
+    grid = decode_frame(frame, build_lut(color_map()))
+    np.testing.assert_array_equal(grid, decode_frame_reference(frame, color_map()))
+    np.testing.assert_array_equal(grid, expected)
+
+
+def test_decode_frame_into_out():
+    frame = image("RGB")
+    out = np.zeros(SHAPE, dtype=np.float32)
+    assert decode_frame(frame, build_lut(color_map()), out=out) is out
+    np.testing.assert_array_equal(out, decode_frame_reference(frame, color_map()))
+
+    with pytest.raises(ValueError, match="expected 15x12"):
+        decode_frame(frame, build_lut(color_map()), out=np.zeros((12, 15), dtype=np.float32))
+
+
+def test_empty_colormap_decodes_to_nan():
+    grid = decode_frame(image("RGB"), build_lut({}))
+    assert np.isnan(grid).all()
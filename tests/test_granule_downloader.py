@@ -0,0 +1,155 @@
+import hashlib
+import os
+
+import pytest
+import requests
+
+import granule_downloader
+from granule_downloader import PARTIAL_SUFFIX, download_granule, download_granules
+from earthdata_standin import GranuleServer, synthetic_granule
+
+GRANULE = "MOD021KM.A2024001.0000.061.hdf"
+BODY = synthetic_granule(200_000)
+SHA256 = ("sha256", hashlib.sha256(BODY).hexdigest())
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    # Small chunks so a dropped connection leaves a partial file behind
+    monkeypatch.setattr(granule_downloader, "CHUNK_SIZE", 4096)
+    monkeypatch.setattr(granule_downloader, "BACKOFF_SECONDS", 0)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(files=None, **faults):
+        server = GranuleServer(files or {GRANULE: BODY}, **faults).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download_verifies_checksum(serve, tmp_path):
+    server = serve()
+    result = download_granule(requests.Session(), server.url(GRANULE), str(tmp_path), SHA256)
+
+    assert result.status == "downloaded"
+    assert result.size == len(BODY)
+    assert read(result.path) == BODY
+    assert not os.path.exists(result.path + PARTIAL_SUFFIX)
+
+
+def test_dropped_connection_resumes_with_range(serve, tmp_path):
+    server = serve(drop_after=50_000)
+    result = download_granule(requests.Session(), server.url(GRANULE), str(tmp_path), SHA256)
+
+    assert result.status == "resumed"
+    assert read(result.path) == BODY
+    first, second = server.requests
+    assert first[1] is None
+    offset = int(second[1].removeprefix("bytes=").rstrip("-"))
+    assert 0 < offset <= 50_000
+
+
+def test_leftover_partial_file_is_resumed(serve, tmp_path):
+    server = serve()
+    path = tmp_path / GRANULE
+    (tmp_path / (GRANULE + PARTIAL_SUFFIX)).write_bytes(BODY[:120_000])
+
+    result = download_granule(requests.Session(), server.url(GRANULE), str(tmp_path), SHA256)
+
+    assert result.status == "resumed"
+    assert read(path) == BODY
+    assert server.requests == [(GRANULE, "bytes=120000-")]
+
+
+def test_range_ignored_restarts_from_scratch(serve, tmp_path):
+    server = serve(ignore_range=True)
+    (tmp_path / (GRANULE + PARTIAL_SUFFIX)).write_bytes(BODY[:120_000])
+
+    result = download_granule(requests.Session(), server.url(GRANULE), str(tmp_path), SHA256)
+
+    assert read(result.path) == BODY
+
+
+def test_416_on_complete_partial_file_finishes_it(serve, tmp_path):
+    # The previous run got every byte but died before the rename
+    server = serve()
+    (tmp_path / (GRANULE + PARTIAL_SUFFIX)).write_bytes(BODY)
+
+    result = download_granule(requests.Session(), server.url(GRANULE), str(tmp_path), SHA256)
+
+    assert result.status == "resumed"
+    assert read(result.path) == BODY
+    assert server.requests == [(GRANULE, f"bytes={len(BODY)}-")]
+
+
+def test_416_on_oversized_partial_file_starts_over(serve, tmp_path):
+    server = serve()
+    (tmp_path / (GRANULE + PARTIAL_SUFFIX)).write_bytes(BODY + b"stale tail")
+
+    result = download_granule(requests.Session(), server.url(GRANULE), str(tmp_path), SHA256)
+
+    assert read(result.path) == BODY
+    assert [header for _, header in server.requests] == [f"bytes={len(BODY) + 10}-", None]
+
+
+def test_checksum_mismatch_fails_and_removes_partial(serve, tmp_path):
+    server = serve()
+    wrong = ("sha256", hashlib.sha256(b"something else").hexdigest())
+
+    result = download_granule(requests.Session(), server.url(GRANULE), str(tmp_path), wrong)
+
+    assert result.status == "failed"
+    assert result.error == "sha256 mismatch"
+    assert not os.path.exists(result.path)
+    assert not os.path.exists(result.path + PARTIAL_SUFFIX)
+
+
+def test_complete_file_is_skipped_without_a_request(serve, tmp_path):
+    server = serve()
+    (tmp_path / GRANULE).write_bytes(BODY)
+
+    result = download_granule(requests.Session(), server.url(GRANULE), str(tmp_path), SHA256)
+
+    assert result.status == "skipped"
+    assert result.size == len(BODY)
+    assert server.requests == []
+
+
+def test_missing_granule_fails_without_retries(serve, tmp_path):
+    server = serve()
+    result = download_granule(requests.Session(), server.url("missing.hdf"), str(tmp_path))
+
+    assert result.status == "failed"
+    assert len(server.requests) == 1
+
+
+def test_bulk_download_fetches_each_destination_once(serve, tmp_path):
+    other = synthetic_granule(50_000, seed=7)
+    server = serve({GRANULE: BODY, "other.hdf": other})
+    mirror = serve({GRANULE: other})
+    urls = [server.url(GRANULE), server.url("other.hdf"), server.url(GRANULE), mirror.url(GRANULE)]
+
+    results = download_granules(urls, str(tmp_path), session=requests.Session(), concurrency=4,
+                                checksums={GRANULE: SHA256})
+
+    by_status = sorted((r.status, r.url) for r in results)
+    assert by_status == [
+        ("downloaded", server.url(GRANULE)),
+        ("downloaded", server.url("other.hdf")),
+        ("failed", mirror.url(GRANULE)),
+    ]
+    assert read(tmp_path / GRANULE) == BODY
+    assert [name for name, _ in server.requests].count(GRANULE) == 1
+    assert mirror.requests == []
@@ -0,0 +1,69 @@
+import h5py
+import netCDF4
+import numpy as np
+import pytest
+
+from hdf_reader import discover, select_variables, subset_granule, subset_granules
+
+BBOX = (-10.0, -10.0, 10.0, 10.0)
+
+
+def write_grid_granule(path):
+    # A 1-degree and a 0.5-degree grid in one file, as level-3 products ship them
+    with h5py.File(path, "w") as f:
+        for group, step, value in (("coarse", 1.0, 1.0), ("fine", 0.5, 2.0)):
+            lats = np.arange(-20, 20, step)
+            lons = np.arange(-20, 20, step)
+            f[f"{group}/lat"] = lats
+            f[f"{group}/lon"] = lons
+            f[f"{group}/a"] = np.full((len(lats), len(lons)), value, dtype=np.float32)
+            f[f"{group}/b"] = np.full((len(lats), len(lons)), value, dtype=np.float32)
+    return path
+
+
+def write_swath_granule(path, offset, value):
+    lats, lons = np.meshgrid(np.linspace(-10, 10, 40), np.linspace(-10 + offset, 10 + offset, 40), indexing="ij")
+    with h5py.File(path, "w") as f:
+        f["swath/Latitude"] = lats
+        f["swath/Longitude"] = lons
+        f["swath/radiance"] = np.full(lats.shape, value, dtype=np.float32)
+    return path
+
+
+def test_mixed_grids_are_rejected(tmp_path):
+    path = write_grid_granule(tmp_path / "L3.20240101.h5")
+    with h5py.File(path, "r") as f:
+        available = discover(f)
+
+    with pytest.raises(ValueError, match="different grids"):
+        select_variables(path.name, available, ["/coarse/a", "/fine/a"])
+    with pytest.raises(ValueError, match="different grids"):
+        subset_granule(str(path), BBOX, ["/coarse/a", "/fine/b"])
+
+
+def test_default_is_one_grid(tmp_path):
+    path = write_grid_granule(tmp_path / "L3.20240101.h5")
+    _, lats, lons, grids, _ = subset_granule(str(path), BBOX)
+
+    assert sorted(grids) == ["/coarse/a", "/coarse/b"]
+    assert all(grid.shape == (len(lats), len(lons)) for grid in grids.values())
+
+
+def test_same_day_swaths_become_one_timestep(tmp_path):
+    paths = [
+        write_swath_granule(tmp_path / "SWATH.A2024001.0000.h5", -8, 1.0),
+        write_swath_granule(tmp_path / "SWATH.A2024001.0005.h5", 8, 3.0),
+        write_swath_granule(tmp_path / "SWATH.A2024002.0000.h5", 0, 5.0),
+    ]
+    output = tmp_path / "subset.nc"
+    skipped = subset_granules([str(p) for p in paths], BBOX, str(output), resolution=1.0, workers=2)
+
+    assert skipped == []
+    with netCDF4.Dataset(output) as ds:
+        assert len(ds["time"]) == 2
+        first = ds["swath_radiance"][0].filled(np.nan)
+        assert np.nanmin(first) == pytest.approx(1.0)
+        # Where the two granules overlap, the day holds their mean
+        assert np.nanmax(first) == pytest.approx(3.0)
+        assert np.any(np.isclose(first, 2.0))
+        assert np.nanmax(ds["swath_radiance"][1].filled(np.nan)) == pytest.approx(5.0)
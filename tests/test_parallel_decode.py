@@ -0,0 +1,67 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from lxml import etree
+from PIL import Image
+
+import parallel_decode
+from colormap_decoder import parse_colormap, build_lut, decode_frame
+from gibs_standin import colormap_xml, synthetic_png
+from parallel_decode import DecodePool, FrameDecodePool, decode_inline
+
+pytestmark = pytest.mark.skipif(
+    not parallel_decode.parallel_decoding_available(2), reason="needs fork-based multiprocessing"
+)
+
+SHAPE = (120, 160)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = DecodePool(workers=2, memory_limit=64 * 1024 ** 2)
+    yield pool
+    pool.shutdown()
+
+
+def lut():
+    color_map, _, _ = parse_colormap(etree.fromstring(colormap_xml()))
+    return build_lut(color_map)
+
+
+def frames(count):
+    return [(i, synthetic_png(SHAPE[1], SHAPE[0], i % 8)) for i in range(count)]
+
+
+def test_pool_matches_inline_decoding(pool, tmp_path):
+    # Two streams with different colormaps, items without content mixed in,
+    # and more frames than slots so the ring is reused
+    luts = [lut(), (lut()[0], lut()[1] * 2)]
+    items = frames(9)
+    items[3] = (3, None)
+    frame_bytes = SHAPE[0] * SHAPE[1] * 4
+    slots = pool.reserve(frame_bytes, len(luts), 3)
+    assert slots == 3
+
+    with FrameDecodePool(pool, str(tmp_path), SHAPE, luts, slots) as decoder:
+        for stream, stream_lut in enumerate(luts):
+            expected = list(decode_inline(items, stream_lut))
+            for (tag, grid, seconds), (want_tag, want, _) in zip(decoder.decode(items, stream), expected):
+                assert tag == want_tag
+                if want is None:
+                    assert grid is None and seconds is None
+                    continue
+                np.testing.assert_array_equal(grid, want)
+                with Image.open(BytesIO(items[tag][1])) as image:
+                    np.testing.assert_array_equal(grid, decode_frame(image, stream_lut))
+
+    assert pool.reserved_bytes == 0
+    assert not (tmp_path / parallel_decode.FRAMES_FILENAME).exists()
+
+
+def test_memory_budget_is_shared(pool):
+    frame_bytes = 16 * 1024 ** 2
+    assert pool.reserve(frame_bytes, 2, 4) == 2
+    assert pool.reserve(frame_bytes, 1, 4) == 0
+    pool.release(2 * 2 * frame_bytes)
+    assert pool.reserved_bytes == 0
@@ -0,0 +1,41 @@
+import pyarrow.parquet as pq
+
+from vector_extraction import GeoParquetWriter, column_values, infer_schema, schema_misfits
+
+
+def rows(*property_sets):
+    return [("2024-01-01", float(i), float(i), properties) for i, properties in enumerate(property_sets)]
+
+
+def test_schema_widens_across_samples():
+    schema = infer_schema([{"a": 1, "b": "x"}, {"a": 2}])
+    assert schema == [("a", "int"), ("b", "string")]
+
+    # A later sample adds a column and widens the existing ones
+    widened = infer_schema([{"a": 2.5, "c": 3}, {"b": 7}], schema)
+    assert widened == [("a", "float"), ("b", "string"), ("c", "int")]
+    assert infer_schema([{"a": "high"}], widened)[0] == ("a", "string")
+
+
+def test_misfits_are_reported_not_truncated():
+    schema = [("a", "int"), ("b", "float")]
+    features = rows({"a": 1, "b": 1}, {"a": 2.5, "b": "n/a"}, {"a": 3.0, "extra": True})
+    unknown, conflicts = set(), {}
+    schema_misfits(features, schema, unknown, conflicts)
+
+    assert unknown == {"extra"}
+    assert conflicts == {"a": 1, "b": 1}
+    assert column_values(features, "a", "int") == [1, None, 3]
+    assert column_values(features, "b", "float") == [1.0, None, None]
+
+
+def test_parquet_keeps_widened_columns(tmp_path):
+    features = rows({"a": 1}, {"a": 2.5, "b": "x"})
+    schema = infer_schema(properties for _, _, _, properties in features)
+    writer = GeoParquetWriter(str(tmp_path / "points.parquet"), schema)
+    writer.write(features)
+    writer.close()
+
+    table = pq.read_table(tmp_path / "points.parquet")
+    assert table.column("a").to_pylist() == [1.0, 2.5]
+    assert table.column("b").to_pylist() == [None, "x"]
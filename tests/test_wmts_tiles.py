@@ -0,0 +1,15 @@
+import pytest
+
+from wmts_tiles import MAX_NATIVE_PIXELS, check_window_size, native_level, pixel_window
+
+
+def test_continent_at_250m_is_rejected():
+    window = pixel_window((-30, -35, 55, 40), native_level("250m"))
+    assert window.shape == (34134, 38686)
+    with pytest.raises(ValueError, match=r"within about 18\.0x18\.0 degrees"):
+        check_window_size(window)
+
+
+def test_same_bbox_at_2km_fits():
+    window = check_window_size(pixel_window((-30, -35, 55, 40), native_level("2km")))
+    assert window.shape[0] * window.shape[1] <= MAX_NATIVE_PIXELS